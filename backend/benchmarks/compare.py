@@ -0,0 +1,82 @@
+"""
+基准结果对比
+比较两次 benchmarks.run 的结果文件，列出各项指标的变化，超过阈值的退化标记出来：
+
+    python -m benchmarks.compare benchmarks/results/旧.json benchmarks/results/新.json --threshold 0.1
+
+存在退化时退出码为 1，可用于 CI 判断。
+"""
+
+import sys
+import json
+import argparse
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# 指标名（路径最后一段）按后缀判断方向：吞吐和召回率越高越好，耗时越低越好
+HIGHER_IS_BETTER = ("qps", "per_sec", "recall")
+LOWER_IS_BETTER = ("_ms", "seconds", "rss_mb")
+
+
+def direction(name: str) -> Optional[int]:
+    """1 越高越好，-1 越低越好，None 不参与比较（计数、配置等）"""
+    if name.endswith(HIGHER_IS_BETTER):
+        return 1
+    if name.endswith(LOWER_IS_BETTER):
+        return -1
+    return None
+
+
+def flatten(data: Any, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    """嵌套结果 -> (点分路径, 数值)"""
+    if isinstance(data, dict):
+        for key, value in data.items():
+            yield from flatten(value, f"{prefix}.{key}" if prefix else str(key))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        yield prefix, float(data)
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    old = dict(flatten(baseline.get("results", {})))
+    rows = []
+    for path, value in flatten(current.get("results", {})):
+        sign = direction(path.rsplit(".", 1)[-1])
+        if sign is None or path not in old:
+            continue
+        before = old[path]
+        change = (value - before) / before if before else 0.0
+        rows.append({
+            "metric": path,
+            "baseline": before,
+            "current": value,
+            "change": round(change, 4),
+            "regression": sign * change < -threshold
+        })
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="对比两次基准测试结果")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1, help="相对变化超过该比例视为退化")
+    parser.add_argument("--all", action="store_true", help="列出全部指标，默认只列出变化超过阈值的")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, "r", encoding="utf-8") as f:
+        current = json.load(f)
+
+    rows = compare(baseline, current, args.threshold)
+    regressions = [row for row in rows if row["regression"]]
+    for row in rows:
+        if args.all or abs(row["change"]) > args.threshold:
+            flag = "退化" if row["regression"] else ""
+            print(f"{row['metric']:<60} {row['baseline']:>12.3f} -> {row['current']:>12.3f} "
+                  f"{row['change']:>+8.1%} {flag}")
+    print(f"共比较 {len(rows)} 项指标，退化 {len(regressions)} 项（阈值 {args.threshold:.0%}）")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
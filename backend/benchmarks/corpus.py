@@ -0,0 +1,92 @@
+"""
+合成语料生成
+按目标分块数生成中文 Markdown 文档：章节标题 + 由主题词和句式模板拼成的段落，
+夹带产品型号、错误码等代码类词，覆盖关键词检索的分词路径；同一随机种子生成的语料完全相同。
+"""
+
+import random
+from pathlib import Path
+from typing import Dict, List
+
+TOPICS = [
+    "向量数据库", "检索增强生成", "文本分块", "嵌入模型", "倒排索引", "近似最近邻", "缓存策略",
+    "数据导入", "权限管理", "日志分析", "负载均衡", "消息队列", "容器编排", "监控告警",
+    "苹果种植", "茶叶加工", "高铁调度", "电池回收", "城市规划", "气象预报", "中药炮制", "古籍修复"
+]
+
+SUBJECTS = ["系统", "平台", "团队", "该方案", "新版本", "实验结果", "运维人员", "用户", "调研报告", "测试环境"]
+VERBS = ["提升了", "降低了", "验证了", "优化了", "记录了", "分析了", "改进了", "影响了", "支持了", "限制了"]
+OBJECTS = ["检索延迟", "召回率", "吞吐量", "存储成本", "稳定性", "可维护性", "数据质量", "响应速度", "资源利用率", "用户体验"]
+CLAUSES = [
+    "在高并发场景下表现尤为明显", "但仍需要进一步观察", "相关参数已经写入配置文件", "具体数据见附录表格",
+    "建议在下一个迭代中推广", "与上一季度相比有明显变化", "需要结合业务指标综合评估", "对下游服务没有影响"
+]
+
+# 平均每个句子的字符数约 30，每个分块（默认 200 字）约 6~7 句
+SENTENCES_PER_SECTION = 24
+SECTIONS_PER_FILE = 80
+
+
+def _code(rng: random.Random) -> str:
+    kind = rng.random()
+    if kind < 0.4:
+        return f"SKU-{rng.randint(1000, 9999)}"
+    if kind < 0.7:
+        return f"ERR_{rng.choice(['CONN', 'AUTH', 'DISK', 'TIMEOUT'])}_{rng.randint(100, 999)}"
+    return f"v{rng.randint(1, 9)}.{rng.randint(0, 20)}.{rng.randint(0, 50)}"
+
+
+def sentence(rng: random.Random, topic: str) -> str:
+    text = f"{topic}{rng.choice(SUBJECTS)}{rng.choice(VERBS)}{rng.choice(OBJECTS)}，{rng.choice(CLAUSES)}"
+    if rng.random() < 0.15:
+        text += f"（编号 {_code(rng)}）"
+    return text + "。"
+
+
+def generate_corpus(target_chunks: int, output_dir: Path, chunk_size: int = 200, seed: int = 0) -> Dict:
+    """
+    生成约 target_chunks 个分块（按 chunk_size 字符切分）的语料
+
+    Returns:
+        {"files": [路径], "chars": 总字符数, "bytes": 总字节数, "sections": 章节数}
+    """
+    rng = random.Random(seed)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    target_chars = target_chunks * chunk_size
+    files: List[Path] = []
+    chars = size = sections = 0
+    while chars < target_chars:
+        lines = []
+        for _ in range(SECTIONS_PER_FILE):
+            if chars >= target_chars:
+                break
+            topic = rng.choice(TOPICS)
+            paragraph = "".join(sentence(rng, topic) for _ in range(SENTENCES_PER_SECTION))
+            lines.append(f"## {topic}（第{sections + 1}节）\n\n{paragraph}\n")
+            chars += len(paragraph)
+            sections += 1
+        path = output_dir / f"corpus_{len(files):05d}.md"
+        text = "\n".join(lines)
+        path.write_text(text, encoding="utf-8")
+        size += len(text.encode("utf-8"))
+        files.append(path)
+
+    return {"files": files, "chars": chars, "bytes": size, "sections": sections}
+
+
+def sample_queries(count: int, seed: int = 1) -> List[str]:
+    """与语料同分布的查询：部分是完整句子，部分是短语或编号"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        topic = rng.choice(TOPICS)
+        kind = rng.random()
+        if kind < 0.5:
+            queries.append(sentence(rng, topic).rstrip("。"))
+        elif kind < 0.8:
+            queries.append(f"{topic}的{rng.choice(OBJECTS)}")
+        else:
+            queries.append(_code(rng))
+    return queries
@@ -0,0 +1,439 @@
+"""
+性能基准测试
+在合成中文语料（默认 10k / 100k / 1M 个分块）上依次测量：
+
+- 服务层：直接调用各服务类，记录导入吞吐、分块 MB/s、嵌入 向量/s、各类索引构建耗时与内存、
+  检索 QPS 与 p50/p99 延迟，以及 recall@k（与同一集合上的暴力精确检索对比）
+- 接口层：通过 FastAPI TestClient 调用上传、检索、批量检索和问答接口，记录端到端延迟
+
+用法（在 backend 目录下）：
+
+    python -m benchmarks.run --sizes 10k,100k --indexes flat,ivf,hnsw,flat:int8,ivf:pq
+    python -m benchmarks.compare benchmarks/results/旧.json benchmarks/results/新.json
+
+每个规模在独立子进程和独立工作目录（--workdir/规模/data）中运行，互不影响，峰值内存分别统计；
+结果写入 --output 指定的 JSON 文件。1M 规模下嵌入耗时取决于模型和硬件，CPU 上可能需要数小时。
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import resource
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+# 子进程会切换到各自的工作目录，服务模块需要按绝对路径导入
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.corpus import generate_corpus, sample_queries  # noqa: E402
+
+DEFAULT_SIZES = "10k,100k,1m"
+DEFAULT_INDEXES = "flat,ivf,hnsw,flat:int8,ivf:pq"
+SEARCH_MODES = ("vector", "bm25", "hybrid")
+
+# 基准测试关闭检索结果缓存和回答缓存（否则重复查询只测到缓存），大模型使用无延迟的模拟后端
+BENCH_ENV = {
+    "SEARCH_CACHE_SIZE": "0",
+    "GENERATION_CACHE_SIZE": "0",
+    "LLM_BACKEND": "mock",
+    "MOCK_TOKEN_DELAY": "0"
+}
+
+
+def parse_size(label: str) -> int:
+    """10k -> 10000，1m -> 1000000"""
+    label = label.strip().lower()
+    units = {"k": 1000, "m": 1000000}
+    if label and label[-1] in units:
+        return int(float(label[:-1]) * units[label[-1]])
+    return int(label)
+
+
+def latency_stats(samples: List[float], total: Optional[float] = None) -> Dict[str, Any]:
+    """每次调用耗时（秒）-> QPS 与 p50/p99/平均延迟（毫秒）"""
+    import numpy as np
+
+    if not samples:
+        return {"count": 0}
+    ms = np.asarray(samples) * 1000
+    total = total if total is not None else float(sum(samples))
+    return {
+        "count": len(samples),
+        "qps": round(len(samples) / total, 2) if total else None,
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3)
+    }
+
+
+def peak_rss_mb() -> float:
+    # Linux 上 ru_maxrss 单位为 KB，macOS 上为字节
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def environment_info() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        commit = None
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "numpy": numpy_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def parse_index_spec(spec: str) -> Dict[str, Optional[str]]:
+    """flat、ivf:pq 形式 -> {"name", "db_type", "quantization"}"""
+    db_type, _, quantization = spec.strip().partition(":")
+    return {"name": spec.strip().replace(":", "_"), "db_type": db_type, "quantization": quantization or None}
+
+
+# ==================== 单个规模（子进程内执行） ====================
+
+class SizeBenchmark:
+    def __init__(self, args: argparse.Namespace, size: int, workdir: Path):
+        self.args = args
+        self.size = size
+        self.workdir = workdir
+        self.result: Dict[str, Any] = {"target_chunks": size}
+
+    async def run(self) -> Dict[str, Any]:
+        # data 目录相对当前工作目录解析，导入服务模块之前先切换
+        os.chdir(self.workdir)
+        from services.data_import_service import DataImportService
+        from services.text_chunk_service import TextChunkService
+        from services.vector_embed_service import VectorEmbedService
+        from services.vector_db_service import VectorDBService
+        from services.retrieval_service import RetrievalService
+
+        self.import_service = DataImportService()
+        self.chunk_service = TextChunkService()
+        self.embed_service = VectorEmbedService()
+        self.db_service = VectorDBService()
+        self.retrieval_service = RetrievalService()
+
+        started = time.perf_counter()
+        corpus = generate_corpus(self.size, self.workdir / "corpus", self.args.chunk_size, self.args.seed)
+        self.result["corpus"] = {
+            "files": len(corpus["files"]),
+            "chars": corpus["chars"],
+            "mb": round(corpus["bytes"] / 1024 / 1024, 2),
+            "generate_seconds": round(time.perf_counter() - started, 3)
+        }
+        self.files = corpus["files"]
+        self.queries = sample_queries(self.args.queries, self.args.seed + 1)
+
+        try:
+            await self.bench_ingest(corpus["bytes"])
+            await self.bench_chunk(corpus["bytes"])
+            await self.bench_embed()
+            await self.bench_indexes()
+            if not self.args.skip_api:
+                self.bench_api()
+        finally:
+            self.import_service.shutdown()
+            self.result["peak_rss_mb"] = peak_rss_mb()
+        return self.result
+
+    async def bench_ingest(self, total_bytes: int):
+        from fastapi import UploadFile
+
+        samples = []
+        started = time.perf_counter()
+        for path in self.files:
+            call_started = time.perf_counter()
+            with open(path, "rb") as f:
+                await self.import_service.upload_file(
+                    UploadFile(file=f, filename=path.name), "semi-structured", "markdown"
+                )
+            samples.append(time.perf_counter() - call_started)
+        elapsed = time.perf_counter() - started
+        self.result["ingest"] = {
+            "seconds": round(elapsed, 3),
+            "files_per_sec": round(len(self.files) / elapsed, 2),
+            "mb_per_sec": round(total_bytes / 1024 / 1024 / elapsed, 2),
+            "per_file": latency_stats(samples, elapsed)
+        }
+
+    async def bench_chunk(self, total_bytes: int):
+        started = time.perf_counter()
+        chunked = await self.chunk_service.process_chunk(
+            self.args.chunk_method, self.args.chunk_size, self.args.overlap_size
+        )
+        elapsed = time.perf_counter() - started
+        self.chunk_id = chunked["chunk_id"]
+        self.result["chunk"] = {
+            "method": self.args.chunk_method,
+            "chunks": chunked["total_chunks"],
+            "seconds": round(elapsed, 3),
+            "mb_per_sec": round(total_bytes / 1024 / 1024 / elapsed, 2),
+            "chunks_per_sec": round(chunked["total_chunks"] / elapsed, 2)
+        }
+
+    async def bench_embed(self):
+        from services.embedding_engine import DEFAULT_EMBED_MODEL
+
+        started = time.perf_counter()
+        embedded = await self.embed_service.process_embed(
+            self.args.embed_model, self.args.batch_size, self.chunk_id, self.args.vector_dtype
+        )
+        elapsed = time.perf_counter() - started
+        self.vector_id = embedded["vector_id"]
+        self.result["embed"] = {
+            "model": self.args.embed_model or DEFAULT_EMBED_MODEL,
+            "vectors": embedded["total_vectors"],
+            "seconds": round(elapsed, 3),
+            "vectors_per_sec": round(embedded["total_vectors"] / elapsed, 2)
+        }
+
+    async def bench_indexes(self):
+        self.result["indexes"] = {}
+        query_vectors = None
+        for spec in self.args.indexes.split(","):
+            spec = parse_index_spec(spec)
+            started = time.perf_counter()
+            stored = await self.db_service.store_vectors(
+                spec["db_type"], f"bench_{spec['name']}", self.vector_id, spec["quantization"]
+            )
+            build_seconds = time.perf_counter() - started
+            collection = self.db_service.get_collection(stored["collection_id"])
+            index = self.db_service.get_index(collection)
+
+            if query_vectors is None:
+                query_vectors = self.retrieval_service.engine.embed(self.queries, collection.get("model"))
+
+            report = {
+                "db_type": spec["db_type"],
+                "quantization": spec["quantization"],
+                "vectors": stored["vector_count"],
+                "build_seconds": round(build_seconds, 3),
+                "memory": stored["memory"],
+                "self_recall": stored["recall"],
+                "recall": self.recall_at_k(index, query_vectors, self.args.top_k),
+                "raw_search": self.raw_search(index, query_vectors),
+                "search": {}
+            }
+            for mode in SEARCH_MODES:
+                report["search"][mode] = await self.service_search(collection["id"], mode)
+            report["search_batch"] = await self.service_search_batch(collection["id"])
+            self.result["indexes"][spec["name"]] = report
+            self.collection_name = collection["name"]
+
+    @staticmethod
+    def recall_at_k(index, query_vectors, k: int) -> Dict[str, Any]:
+        """用真实查询文本的向量，对比索引检索与全部存活向量上的暴力精确检索"""
+        import numpy as np
+
+        live = np.flatnonzero(~index.deleted)
+        k = min(k, len(live))
+        started = time.perf_counter()
+        _, exact = index.search_subset(query_vectors, live, k)
+        brute_seconds = time.perf_counter() - started
+        _, found = index.search(query_vectors, k)
+        hits = sum(len(np.intersect1d(row[row >= 0], truth)) for row, truth in zip(found, exact))
+        return {
+            "k": k,
+            "queries": len(query_vectors),
+            "recall": round(hits / exact.size, 4),
+            "brute_force_qps": round(len(query_vectors) / brute_seconds, 2)
+        }
+
+    def raw_search(self, index, query_vectors) -> Dict[str, Any]:
+        """只测索引本身：逐条查询（不含查询向量化、分块取回）"""
+        samples = []
+        for row in query_vectors:
+            started = time.perf_counter()
+            index.search(row[None, :], self.args.top_k)
+            samples.append(time.perf_counter() - started)
+        return latency_stats(samples)
+
+    async def service_search(self, collection_id: str, mode: str) -> Dict[str, Any]:
+        """RetrievalService.search 逐条查询（含查询向量化、检索、取回分块内容）"""
+        samples = []
+        started = time.perf_counter()
+        for query in self.queries:
+            call_started = time.perf_counter()
+            await self.retrieval_service.search(query, self.args.top_k, collection_id, mode)
+            samples.append(time.perf_counter() - call_started)
+        return latency_stats(samples, time.perf_counter() - started)
+
+    async def service_search_batch(self, collection_id: str) -> Dict[str, Any]:
+        batch = self.args.batch_queries
+        samples = []
+        started = time.perf_counter()
+        for offset in range(0, len(self.queries), batch):
+            call_started = time.perf_counter()
+            await self.retrieval_service.search_batch(
+                self.queries[offset:offset + batch], self.args.top_k, collection_id, "hybrid"
+            )
+            samples.append(time.perf_counter() - call_started)
+        elapsed = time.perf_counter() - started
+        return {
+            "batch_size": batch,
+            "queries_per_sec": round(len(self.queries) / elapsed, 2),
+            "per_batch": latency_stats(samples, elapsed)
+        }
+
+    def bench_api(self):
+        """通过 FastAPI 应用调用接口，测端到端延迟（含请求解析、序列化和中间件）"""
+        from fastapi.testclient import TestClient
+        import main
+
+        api: Dict[str, Any] = {}
+        with TestClient(main.app) as client:
+            def timed(samples: List[float], method: str, url: str, **kwargs):
+                started = time.perf_counter()
+                response = client.request(method, url, **kwargs)
+                samples.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise Exception(f"{method} {url} 返回 {response.status_code}: {response.text[:200]}")
+                return response
+
+            samples = []
+            for path in self.files[:self.args.api_uploads]:
+                with open(path, "rb") as f:
+                    timed(samples, "POST", "/api/data-import/upload",
+                          params={"file_type": "semi-structured", "file_format": "markdown"},
+                          files={"file": (f"api_{path.name}", f, "text/markdown")})
+            api["upload"] = latency_stats(samples)
+
+            for mode in SEARCH_MODES:
+                samples = []
+                for query in self.queries:
+                    timed(samples, "POST", "/api/retrieval/search", params={
+                        "query": query, "top_k": self.args.top_k,
+                        "collection_name": self.collection_name, "mode": mode
+                    })
+                api[f"search_{mode}"] = latency_stats(samples)
+
+            samples = []
+            batch = self.args.batch_queries
+            for offset in range(0, len(self.queries), batch):
+                timed(samples, "POST", "/api/retrieval/search/batch", json={
+                    "queries": self.queries[offset:offset + batch], "top_k": self.args.top_k,
+                    "collection_name": self.collection_name, "mode": "hybrid"
+                })
+            api["search_batch"] = latency_stats(samples)
+
+            samples = []
+            for query in self.queries[:self.args.api_rag_queries]:
+                timed(samples, "POST", "/api/rag/query", json={
+                    "query": query, "top_k": self.args.top_k,
+                    "collection_name": self.collection_name, "stream": False
+                })
+            api["rag_query"] = latency_stats(samples)
+        self.result["api"] = api
+
+
+def run_size(args: argparse.Namespace) -> int:
+    """子进程入口：运行单个规模，把结果写入 --result"""
+    size = parse_size(args.worker)
+    workdir = Path(args.workdir).resolve() / args.worker
+    if workdir.exists():
+        shutil.rmtree(workdir)
+    workdir.mkdir(parents=True)
+
+    result = asyncio.run(SizeBenchmark(args, size, workdir).run())
+    with open(args.result, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    if not args.keep_data:
+        os.chdir(BACKEND_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+# ==================== 主进程 ====================
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="RAG 服务性能基准测试")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="语料规模（分块数），逗号分隔，如 10k,100k,1m")
+    parser.add_argument("--indexes", default=DEFAULT_INDEXES,
+                        help="索引类型[:量化方式]，逗号分隔，如 flat,ivf,hnsw,flat:int8,ivf:pq")
+    parser.add_argument("--embed-model", default=None, help="嵌入模型，为空时使用默认模型")
+    parser.add_argument("--batch-size", type=int, default=64, help="嵌入批大小")
+    parser.add_argument("--vector-dtype", default="float32", choices=["float32", "float16"])
+    parser.add_argument("--chunk-method", default="fixed")
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--overlap-size", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=200, help="每种检索模式的查询数")
+    parser.add_argument("--batch-queries", type=int, default=32, help="批量检索每批查询数")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-api", action="store_true", help="跳过接口层测试")
+    parser.add_argument("--api-uploads", type=int, default=5, help="接口层上传的文件数")
+    parser.add_argument("--api-rag-queries", type=int, default=20, help="接口层问答请求数")
+    parser.add_argument("--workdir", default=str(BACKEND_DIR / "benchmarks" / "work"))
+    parser.add_argument("--keep-data", action="store_true", help="保留各规模的工作目录")
+    parser.add_argument("--output", default=None, help="结果文件，默认 benchmarks/results/bench_时间.json")
+    # 子进程参数
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--result", default=None, help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.worker:
+        return run_size(args)
+
+    output = Path(args.output) if args.output else (
+        BACKEND_DIR / "benchmarks" / "results" / f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    worker_args = list(argv if argv is not None else sys.argv[1:])
+
+    report = {
+        "environment": environment_info(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("worker", "result", "output")},
+        "results": {}
+    }
+    env = {**os.environ, **BENCH_ENV}
+    for label in args.sizes.split(","):
+        label = label.strip().lower()
+        result_path = output.with_name(f".{output.stem}_{label}.json")
+        print(f"[benchmark] {label}: 开始", flush=True)
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-m", "benchmarks.run", *worker_args, "--worker", label, "--result", str(result_path)],
+            cwd=BACKEND_DIR, env=env
+        )
+        if completed.returncode != 0 or not result_path.exists():
+            report["results"][label] = {"error": f"子进程退出码 {completed.returncode}"}
+        else:
+            with open(result_path, "r", encoding="utf-8") as f:
+                report["results"][label] = json.load(f)
+            result_path.unlink()
+        print(f"[benchmark] {label}: 完成，用时 {time.perf_counter() - started:.1f}s", flush=True)
+
+        # 每个规模完成后都写一次，长时间运行中断时保留已完成的结果
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"[benchmark] 结果已保存: {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,11 +3,15 @@ RAG全流程服务系统 - 后端主入口
 使用FastAPI框架提供RESTful API接口
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 import os
+import json
+import time
+import asyncio
 from pathlib import Path
 
 # 导入服务模块
@@ -17,6 +21,13 @@ from services.vector_embed_service import VectorEmbedService
 from services.vector_db_service import VectorDBService
 from services.retrieval_service import RetrievalService
 from services.generation_service import GenerationService
+from services.rag_service import RAGService
+from services.llm_client import close_llm_client, llm_client_stats
+from utils.job_queue import JobQueue
+from utils.metrics import HTTP_LATENCY, get_registry, cache_metrics, queue_metrics
+from utils.profiling import get_profiler, request_tags, route_template
+from utils.sse import sse_response
+from models.schemas import BatchSearchRequest, RAGQueryRequest, ProfilingConfigRequest, JobResponse
 
 # 创建FastAPI应用实例
 app = FastAPI(
@@ -38,13 +49,66 @@ app.add_middleware(
 data_dir = Path("data")
 data_dir.mkdir(exist_ok=True)
 
+metrics_registry = get_registry()
+
 # 初始化服务实例
-data_import_service = DataImportService()
-text_chunk_service = TextChunkService()
-vector_embed_service = VectorEmbedService()
-vector_db_service = VectorDBService()
-retrieval_service = RetrievalService()
-generation_service = GenerationService()
+# 以 python main.py 启动时，本文件作为 __main__ 只负责启动 uvicorn（由它按 main:app 重新导入），
+# 文档解析进程池（spawn）的子进程也会以 __mp_main__ 重新执行本文件，这两种情况都不创建服务实例
+if __name__ not in ("__main__", "__mp_main__"):
+    data_import_service = DataImportService()
+    text_chunk_service = TextChunkService()
+    vector_embed_service = VectorEmbedService()
+    vector_db_service = VectorDBService()
+    retrieval_service = RetrievalService()
+    generation_service = GenerationService()
+    rag_service = RAGService(retrieval_service, generation_service)
+    job_queue = JobQueue()
+    profiler = get_profiler()
+
+    # 导出指标时读取缓存命中率、任务队列深度和大模型客户端统计
+    metrics_registry.register_collector(lambda: cache_metrics({
+        **retrieval_service.cache_stats(),
+        "answer": generation_service.cache_stats()
+    }))
+    metrics_registry.register_collector(lambda: queue_metrics(job_queue.queue_depth()))
+    metrics_registry.register_collector(lambda: [(
+        "rag_llm_client_total", "counter", "大模型客户端请求统计（requests/upstream_calls/coalesced/retries/errors）",
+        [({"kind": kind}, value) for kind, value in (llm_client_stats() or {}).items()]
+    )])
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """按路由模板记录请求耗时（路径参数不展开，避免标签数量无限增长）"""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_LATENCY.observe(time.perf_counter() - started, method=request.method,
+                             route=route.path if route is not None else "unmatched", status=status)
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    """按采样率剖析选定路由的请求（PROFILE_ROUTES 或 /api/admin/profiling 配置），标签为请求参数"""
+    if not profiler.active:
+        return await call_next(request)
+    with profiler.profile(route_template(app, request.scope), request_tags(request)) as capture:
+        response = await call_next(request)
+        if capture is not None:
+            capture["tags"]["status_code"] = response.status_code
+        return response
+
+@app.on_event("shutdown")
+async def shutdown():
+    # 关闭文档解析进程池
+    data_import_service.shutdown()
+    # 关闭大模型客户端连接池
+    await close_llm_client()
+    # 等待剖析结果写完
+    await asyncio.to_thread(profiler.flush)
 
 # 根路径
 @app.get("/")
@@ -60,26 +124,55 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+# Prometheus 指标
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+# ==================== 后台任务相关接口 ====================
+
+@app.get("/api/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """
+    获取后台任务状态、进度和吞吐量接口（状态取值见 JobInfo.status）
+    """
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return {"code": 200, "data": job}
+
 # ==================== 数据导入相关接口 ====================
 
 @app.post("/api/data-import/upload")
-async def upload_file(file_type: str, file_format: str, pdf_parser: str = None):
+async def upload_file(file_type: str, file_format: str, pdf_parser: str = None,
+                      file: UploadFile = File(...)):
     """
-    上传文件接口
+    上传文件接口（multipart，流式分块写入 data/uploads）
     """
     try:
-        result = await data_import_service.upload_file(file_type, file_format, pdf_parser)
+        result = await data_import_service.upload_file(file, file_type, file_format, pdf_parser)
         return {"code": 200, "message": "上传成功", "data": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/data-import/cancel/{file_id}")
+async def cancel_file_processing(file_id: str):
+    """
+    取消文件解析接口
+    """
+    try:
+        result = await data_import_service.cancel_processing(file_id)
+        return {"code": 200, "message": "取消成功", "data": result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/data-import/files")
-async def get_file_list():
+async def get_file_list(offset: int = 0, limit: int = None, desc: bool = False):
     """
     获取文件列表接口
     """
     try:
-        result = await data_import_service.get_file_list()
+        result = await data_import_service.get_file_list(offset, limit, desc)
         return {"code": 200, "data": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -98,47 +191,74 @@ async def delete_file(file_id: str):
 # ==================== 文本分块相关接口 ====================
 
 @app.post("/api/text-chunk/process")
-async def process_text_chunk(chunk_method: str, chunk_size: int, overlap_size: int):
+async def process_text_chunk(chunk_method: str, chunk_size: int, overlap_size: int,
+                             chunk_unit: str = "char", encoding_model: str = "gpt-3.5-turbo"):
     """
-    文本分块处理接口
+    文本分块处理接口（后台任务，返回任务ID）
     """
     try:
-        result = await text_chunk_service.process_chunk(chunk_method, chunk_size, overlap_size)
-        return {"code": 200, "message": "分块成功", "data": result}
+        result = job_queue.submit("text_chunk", text_chunk_service.process_chunk,
+                                  chunk_method, chunk_size, overlap_size,
+                                  chunk_unit, encoding_model)
+        return {"code": 200, "message": "分块任务已提交", "data": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/text-chunk/chunks")
-async def get_chunk_list():
+async def get_chunk_list(offset: int = 0, limit: int = None, desc: bool = False):
     """
     获取分块列表接口
     """
     try:
-        result = await text_chunk_service.get_chunk_list()
+        result = await text_chunk_service.get_chunk_list(offset, limit, desc)
         return {"code": 200, "data": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/text-chunk/chunks/{chunk_id}")
+async def get_chunk_detail(chunk_id: str, offset: int = 0, limit: int = 100):
+    """
+    分页获取某次分块任务的分块内容接口
+    """
+    try:
+        result = await text_chunk_service.get_chunks(chunk_id, offset, limit)
+        return {"code": 200, "data": result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/api/text-chunk/chunks/{chunk_id}")
+async def delete_chunk_run(chunk_id: str):
+    """
+    删除分块任务接口（同时删除分块内容和关键词索引）
+    """
+    try:
+        result = await text_chunk_service.delete_chunk_run(chunk_id)
+        return {"code": 200, "message": "删除成功", "data": result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ==================== 向量嵌入相关接口 ====================
 
 @app.post("/api/vector-embed/process")
-async def process_vector_embed(embed_model: str, batch_size: int):
+async def process_vector_embed(embed_model: str, batch_size: int, chunk_id: str = None,
+                               vector_dtype: str = "float32"):
     """
-    向量嵌入处理接口
+    向量嵌入处理接口（后台任务，返回任务ID）
     """
     try:
-        result = await vector_embed_service.process_embed(embed_model, batch_size)
-        return {"code": 200, "message": "嵌入成功", "data": result}
+        result = job_queue.submit("vector_embed", vector_embed_service.process_embed,
+                                  embed_model, batch_size, chunk_id, vector_dtype)
+        return {"code": 200, "message": "嵌入任务已提交", "data": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/vector-embed/vectors")
-async def get_vector_list():
+async def get_vector_list(offset: int = 0, limit: int = None, desc: bool = False):
     """
     获取向量列表接口
     """
     try:
-        result = await vector_embed_service.get_vector_list()
+        result = await vector_embed_service.get_vector_list(offset, limit, desc)
         return {"code": 200, "data": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -146,23 +266,25 @@ async def get_vector_list():
 # ==================== 向量数据库相关接口 ====================
 
 @app.post("/api/vector-db/store")
-async def store_vectors(db_type: str, collection_name: str):
+async def store_vectors(db_type: str, collection_name: str, vector_id: str = None, quantization: str = None):
     """
-    存储向量到数据库接口
+    存储向量到数据库接口（后台任务，返回任务ID）
+    quantization: flat / ivf 可选 int8 或 pq 量化，任务结果中报告内存节省和 recall@k
     """
     try:
-        result = await vector_db_service.store_vectors(db_type, collection_name)
-        return {"code": 200, "message": "存储成功", "data": result}
+        result = job_queue.submit("vector_db", vector_db_service.store_vectors,
+                                  db_type, collection_name, vector_id, quantization)
+        return {"code": 200, "message": "存储任务已提交", "data": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/vector-db/collections")
-async def get_collection_list():
+async def get_collection_list(offset: int = 0, limit: int = None, desc: bool = False):
     """
     获取集合列表接口
     """
     try:
-        result = await vector_db_service.get_collection_list()
+        result = await vector_db_service.get_collection_list(offset, limit, desc)
         return {"code": 200, "data": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -170,23 +292,49 @@ async def get_collection_list():
 # ==================== 检索相关接口 ====================
 
 @app.post("/api/retrieval/search")
-async def search_vectors(query: str, top_k: int = 5):
+async def search_vectors(query: str, top_k: int = 5, collection_name: str = None, mode: str = "hybrid",
+                         filters: str = None):
+    """
+    检索接口（mode: vector 向量、bm25 关键词、hybrid 两路融合；
+    filters: JSON 格式的元数据过滤条件，如 {"source": ["a.pdf"], "page_number": [1, 2]}）
+    """
+    try:
+        filter_dict = json.loads(filters) if filters else None
+        result = await retrieval_service.search(query, top_k, collection_name, mode, filter_dict)
+        return {"code": 200, "data": result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/retrieval/search/batch")
+async def search_vectors_batch(request: BatchSearchRequest):
+    """
+    批量向量检索接口（JSON请求体，一次请求处理多条查询）
+    """
+    try:
+        result = await retrieval_service.search_batch(request.queries, request.top_k, request.collection_name,
+                                                     request.mode, request.filters)
+        return {"code": 200, "data": result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/retrieval/cache/stats")
+async def get_search_cache_stats():
     """
-    向量检索接口
+    检索缓存命中统计接口
     """
     try:
-        result = await retrieval_service.search(query, top_k)
+        result = retrieval_service.cache_stats()
         return {"code": 200, "data": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/retrieval/history")
-async def get_search_history():
+async def get_search_history(offset: int = 0, limit: int = None, desc: bool = False):
     """
     获取检索历史接口
     """
     try:
-        result = await retrieval_service.get_search_history()
+        result = await retrieval_service.get_search_history(offset, limit, desc)
         return {"code": 200, "data": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -194,27 +342,107 @@ async def get_search_history():
 # ==================== 生成相关接口 ====================
 
 @app.post("/api/generation/generate")
-async def generate_content(query: str, context: list, model: str = "gpt-3.5-turbo"):
+async def generate_content(query: str, context: list, model: str = "gpt-3.5-turbo", stream: bool = False):
     """
     内容生成接口
+    stream=true 时以 SSE 逐段返回（事件 start / token / done，出错时为 error）
     """
     try:
+        if stream:
+            return sse_response(generation_service.generate_stream(query, context, model))
         result = await generation_service.generate(query, context, model)
         return {"code": 200, "data": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/generation/cache/stats")
+async def get_generation_cache_stats():
+    """
+    语义回答缓存统计接口
+    """
+    try:
+        result = generation_service.cache_stats()
+        return {"code": 200, "data": result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/generation/history")
-async def get_generation_history():
+async def get_generation_history(offset: int = 0, limit: int = None, desc: bool = False):
     """
     获取生成历史接口
     """
     try:
-        result = await generation_service.get_generation_history()
+        result = await generation_service.get_generation_history(offset, limit, desc)
+        return {"code": 200, "data": result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ==================== 检索增强问答接口 ====================
+
+@app.post("/api/rag/query")
+async def rag_query(request: RAGQueryRequest):
+    """
+    检索增强问答接口：一次请求完成检索和生成
+    stream=true（默认）时以 SSE 返回 retrieval / start / context / token / done 事件，
+    否则返回完整回答；结果中的 citations 为回答引用的分块ID和来源
+    """
+    try:
+        if request.stream:
+            return sse_response(rag_service.query_stream(request.query, request.top_k, request.collection_name,
+                                                         request.mode, request.filters, request.model))
+        result = await rag_service.query(request.query, request.top_k, request.collection_name,
+                                         request.mode, request.filters, request.model)
         return {"code": 200, "data": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ==================== 性能剖析接口 ====================
+
+@app.get("/api/admin/profiling")
+async def get_profiling_config():
+    """
+    获取性能剖析配置和统计接口
+    """
+    try:
+        return {"code": 200, "data": profiler.status()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/admin/profiling")
+async def update_profiling_config(request: ProfilingConfigRequest):
+    """
+    修改性能剖析配置接口（运行时生效，无需重启；routes 传空列表即关闭）
+    """
+    try:
+        result = profiler.configure(request.routes, request.sample_rate, request.mode, request.interval)
+        return {"code": 200, "message": "剖析配置已更新", "data": result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/admin/profiling/profiles")
+async def get_profile_list(offset: int = 0, limit: int = 100):
+    """
+    获取已保存的性能剖析列表接口（按时间从新到旧，含目标路由、请求参数标签和耗时）
+    """
+    try:
+        result = profiler.list_profiles(offset, limit)
+        return {"code": 200, "data": result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/admin/profiling/profiles/{profile_id}")
+async def download_profile(profile_id: str):
+    """
+    下载性能剖析数据接口（.prof 用 pstats/snakeviz 查看，.collapsed 用火焰图工具查看）
+    """
+    try:
+        path = profiler.profile_path(profile_id)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return FileResponse(path, filename=path.name, media_type="application/octet-stream")
+
 if __name__ == "__main__":
     # 启动服务器
     uvicorn.run(
@@ -0,0 +1,63 @@
+"""
+请求与响应数据模型
+参数较多或包含列表的接口使用JSON请求体
+"""
+
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class BatchSearchRequest(BaseModel):
+    """批量检索请求"""
+    queries: List[str] = Field(..., description="查询文本列表")
+    top_k: int = Field(5, description="每条查询返回的结果数")
+    collection_name: Optional[str] = Field(None, description="集合名称或ID，为空时使用最近一次构建成功的集合")
+    mode: str = Field("hybrid", description="检索模式：vector、bm25、hybrid")
+    filters: Optional[Dict[str, Any]] = Field(None, description="元数据过滤条件，如 {\"source\": [\"a.pdf\"]}")
+
+
+class RAGQueryRequest(BaseModel):
+    """检索增强问答请求"""
+    query: str = Field(..., description="问题")
+    top_k: int = Field(5, description="检索的分块数")
+    collection_name: Optional[str] = Field(None, description="集合名称或ID，为空时使用最近一次构建成功的集合")
+    mode: str = Field("hybrid", description="检索模式：vector、bm25、hybrid")
+    filters: Optional[Dict[str, Any]] = Field(None, description="元数据过滤条件")
+    model: str = Field("gpt-3.5-turbo", description="生成模型")
+    stream: bool = Field(True, description="是否以 SSE 流式返回")
+
+
+class ProfilingConfigRequest(BaseModel):
+    """性能剖析运行时配置，未传的项保持不变"""
+    routes: Optional[List[str]] = Field(
+        None, description="剖析目标：路由模板（如 /api/retrieval/search）或后台任务阶段（如 job:text_chunk），空列表即关闭"
+    )
+    sample_rate: Optional[float] = Field(None, ge=0, le=1, description="命中目标的请求中被剖析的比例")
+    mode: Optional[str] = Field(None, description="剖析方式：sample 调用栈采样、cprofile 确定性剖析")
+    interval: Optional[float] = Field(None, gt=0, description="sample 模式的采样间隔（秒）")
+
+
+class JobInfo(BaseModel):
+    """后台任务状态"""
+    id: str = Field(..., description="任务ID")
+    stage: str = Field(..., description="流水线阶段：text_chunk、vector_embed、vector_db")
+    status: str = Field(
+        ..., description="任务状态：queued 排队中、running 运行中、success 成功、error 任务执行失败、"
+                         "interrupted 服务重启或崩溃导致任务中断（需要重新提交）"
+    )
+    progress: float = Field(0.0, description="进度百分比")
+    processed: int = Field(0, description="已处理数量")
+    total: Optional[int] = Field(None, description="总数量，开始处理前为空")
+    throughput: float = Field(0.0, description="每秒处理数量")
+    create_time: str = Field(..., description="提交时间")
+    start_time: Optional[str] = Field(None, description="开始运行时间")
+    finish_time: Optional[str] = Field(None, description="结束时间（success、error、interrupted）")
+    result: Optional[Dict[str, Any]] = Field(None, description="成功时的阶段结果")
+    error_message: Optional[str] = Field(None, description="error、interrupted 时的原因")
+
+
+class JobResponse(BaseModel):
+    """任务查询响应"""
+    code: int = 200
+    data: JobInfo
@@ -0,0 +1,102 @@
+"""
+语义回答缓存模块
+模型、提示词模板和上下文分块集合都相同时，查询向量与已缓存查询足够相似即直接复用回答
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    线程安全的语义缓存
+
+    条目按 (模型, 模板, 上下文集合) 分组，同组内比较查询向量的余弦相似度，
+    不同上下文之间永不命中；容量按 LRU 淘汰，超过 ttl 秒的条目视为过期。
+    """
+
+    def __init__(self, max_items: int = 1024, ttl: float = 3600, threshold: float = 0.95):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.threshold = threshold
+        # 条目编号 -> (过期时间, 分组键, 归一化查询向量, 回答)
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._groups: Dict[Hashable, List[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def get(self, group: Hashable, embedding: np.ndarray) -> Optional[Dict[str, Any]]:
+        """返回同组内相似度最高且不低于阈值的回答（附 similarity），没有时返回 None"""
+        query = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            entry_ids = [i for i in self._groups.get(group, []) if self._entries[i][0] >= now]
+            if not entry_ids:
+                self.misses += 1
+                return None
+            similarities = np.stack([self._entries[i][2] for i in entry_ids]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            entry_id = entry_ids[best]
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return {**self._entries[entry_id][3], "similarity": round(float(similarities[best]), 4)}
+
+    def put(self, group: Hashable, embedding: np.ndarray, answer: Dict[str, Any]):
+        with self._lock:
+            self._purge_expired()
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (time.monotonic() + self.ttl, group, self._normalize(embedding), answer)
+            self._groups.setdefault(group, []).append(entry_id)
+            while len(self._entries) > self.max_items:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, entry_id: int):
+        group = self._entries.pop(entry_id)[1]
+        members = self._groups[group]
+        members.remove(entry_id)
+        if not members:
+            del self._groups[group]
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        for entry_id in [i for i, entry in self._entries.items() if entry[0] < now]:
+            self._remove(entry_id)
+
+    def clear(self) -> int:
+        with self._lock:
+            removed = len(self._entries)
+            self._entries.clear()
+            self._groups.clear()
+            return removed
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "items": len(self._entries),
+            "groups": len(self._groups),
+            "max_items": self.max_items,
+            "ttl_seconds": self.ttl,
+            "threshold": self.threshold
+        }
@@ -0,0 +1,418 @@
+"""
+BM25 倒排索引模块
+中文按字二元组切词、英文/数字/编号整体成词，倒排表持久化在 data/chunks/bm25_index.db
+索引随文本分块增量写入，分块任务结束时合并；查询时按 MaxScore 思路剪枝候选
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 分块时每累计多少个分块落盘一个段
+BM25_SEGMENT_DOCS = int(os.getenv("BM25_SEGMENT_DOCS", 10000))
+
+# 进程内倒排表缓存上限（字节）
+BM25_CACHE_BYTES = int(os.getenv("BM25_CACHE_BYTES", 256 * 1024 * 1024))
+
+_CJK = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_TOKEN_RE = re.compile(rf"[{_CJK}]+|[a-z0-9]+(?:[._\-/:#][a-z0-9]+)*")
+_CODE_SEP_RE = re.compile(r"[._\-/:#]")
+
+# 合并段时每批写入的词条数
+_WRITE_BATCH = 1000
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    切词
+
+    - 先做 NFKC 归一化并转小写（全角字母数字转半角）
+    - 连续汉字切成字二元组，单个汉字保留为一元词
+    - 英文、数字及 E-1024、err_conn_reset、v2.3.1 这类编号整体作为一个词，
+      含分隔符时再补充各段，编号的部分匹配也能命中
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for match in _TOKEN_RE.finditer(text):
+        token = match.group()
+        if token[0].isascii():
+            tokens.append(token)
+            if _CODE_SEP_RE.search(token):
+                tokens.extend(part for part in _CODE_SEP_RE.split(token) if part)
+        elif len(token) == 1:
+            tokens.append(token)
+        else:
+            tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return tokens
+
+
+def bm25_scores(tfs: np.ndarray, lengths: np.ndarray, idf: float, avg_length: float) -> np.ndarray:
+    """词频数组对应的 BM25 得分"""
+    tf = tfs.astype(np.float32)
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length)
+    return idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+
+def bm25_idf(df: int, doc_count: int) -> float:
+    return float(np.log(1 + (doc_count - df + 0.5) / (df + 0.5)))
+
+
+class BM25Writer:
+    """一次分块任务的索引写入器，按分块 seq 递增顺序调用 add"""
+
+    def __init__(self, index: "BM25Index", run_id: str):
+        self.index = index
+        self.run_id = run_id
+        self.segment = 0
+        self._reset()
+
+    def _reset(self):
+        self._postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self._seqs: List[int] = []
+        self._lengths: List[int] = []
+
+    def add(self, chunks: List[Dict[str, Any]]):
+        for chunk in chunks:
+            tokens = tokenize(chunk["content"])
+            for term, tf in Counter(tokens).items():
+                seqs, tfs = self._postings.setdefault(term, ([], []))
+                seqs.append(chunk["seq"])
+                tfs.append(min(tf, 65535))
+            self._seqs.append(chunk["seq"])
+            self._lengths.append(len(tokens))
+        if len(self._seqs) >= BM25_SEGMENT_DOCS:
+            self.flush()
+
+    def flush(self):
+        if self._seqs:
+            self.index.write_segment(self.run_id, self.segment, self._postings, self._seqs, self._lengths)
+            self.segment += 1
+        self._reset()
+
+    def close(self) -> Dict[str, Any]:
+        """写完最后一段并合并，返回索引统计"""
+        self.flush()
+        return self.index.finalize(self.run_id)
+
+    def abort(self):
+        self._reset()
+        self.index.delete_run(self.run_id)
+
+
+class BM25Index:
+    """
+    BM25 倒排索引存储
+
+    文档编号使用分块在分块任务中的 seq。分块过程中每个段写入 bm25_segments，
+    finalize 时按词合并为 bm25_postings 中的一行（seq 数组 + 词频数组），
+    并预先计算每个词的得分上界 max_score，查询剪枝时使用。
+    """
+
+    def __init__(self, db_path: Path, cache_bytes: int = BM25_CACHE_BYTES):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.cache_bytes = cache_bytes
+
+        self._lock = threading.RLock()
+        self._conn = self._connect()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bm25_segments ("
+            "run_id TEXT NOT NULL, term TEXT NOT NULL, segment INTEGER NOT NULL, "
+            "seqs BLOB NOT NULL, tfs BLOB NOT NULL, "
+            "PRIMARY KEY (run_id, term, segment))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bm25_segment_lengths ("
+            "run_id TEXT NOT NULL, segment INTEGER NOT NULL, "
+            "seqs BLOB NOT NULL, lengths BLOB NOT NULL, "
+            "PRIMARY KEY (run_id, segment))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bm25_postings ("
+            "run_id TEXT NOT NULL, term TEXT NOT NULL, df INTEGER NOT NULL, max_score REAL NOT NULL, "
+            "seqs BLOB NOT NULL, tfs BLOB NOT NULL, "
+            "PRIMARY KEY (run_id, term))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bm25_runs ("
+            "run_id TEXT PRIMARY KEY, doc_count INTEGER NOT NULL, avg_length REAL NOT NULL, "
+            "term_count INTEGER NOT NULL, lengths BLOB NOT NULL)"
+        )
+
+        self._runs: Dict[str, Optional[Tuple[int, float, np.ndarray]]] = {}
+        self._postings: "OrderedDict[Tuple[str, str], Optional[Tuple]]" = OrderedDict()
+        self._cached_bytes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def writer(self, run_id: str) -> BM25Writer:
+        return BM25Writer(self, run_id)
+
+    def _transaction(self, statements: List[Tuple[str, List[tuple]]]):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, rows in statements:
+                self._conn.executemany(sql, rows)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def write_segment(self, run_id: str, segment: int, postings: Dict[str, Tuple[List[int], List[int]]],
+                      seqs: List[int], lengths: List[int]):
+        """写入一个段"""
+        rows = [
+            (run_id, term, segment, np.asarray(term_seqs, dtype=np.int32).tobytes(),
+             np.asarray(term_tfs, dtype=np.uint16).tobytes())
+            for term, (term_seqs, term_tfs) in postings.items()
+        ]
+        with self._lock:
+            self._transaction([
+                ("INSERT OR REPLACE INTO bm25_segments (run_id, term, segment, seqs, tfs) VALUES (?, ?, ?, ?, ?)",
+                 rows),
+                ("INSERT OR REPLACE INTO bm25_segment_lengths (run_id, segment, seqs, lengths) VALUES (?, ?, ?, ?)",
+                 [(run_id, segment, np.asarray(seqs, dtype=np.int32).tobytes(),
+                   np.asarray(lengths, dtype=np.uint32).tobytes())])
+            ])
+
+    def finalize(self, run_id: str) -> Dict[str, Any]:
+        """
+        把各段按词合并为最终倒排表，计算文档长度与词得分上界
+
+        合并使用独立的数据库连接、分批提交，不占用 self._lock，合并期间检索照常进行；
+        检索以 bm25_runs 中的记录判断任务是否可用，该记录在最后一个事务中与清理段数据一起写入，
+        之后才在锁内清掉本进程的缓存。
+        """
+        reader, writer = self._connect(), self._connect()
+        try:
+            parts = reader.execute(
+                "SELECT seqs, lengths FROM bm25_segment_lengths WHERE run_id = ? ORDER BY segment", (run_id,)
+            ).fetchall()
+            seqs = np.concatenate([np.frombuffer(s, dtype=np.int32) for s, _ in parts]) if parts else np.empty(0, np.int32)
+            doc_lengths = np.zeros(int(seqs.max()) + 1 if len(seqs) else 0, dtype=np.uint32)
+            for seq_blob, length_blob in parts:
+                doc_lengths[np.frombuffer(seq_blob, dtype=np.int32)] = np.frombuffer(length_blob, dtype=np.uint32)
+
+            doc_count = len(seqs)
+            avg_length = float(doc_lengths.sum() / doc_count) if doc_count else 1.0
+            avg_length = avg_length or 1.0
+            lengths_f = doc_lengths.astype(np.float32)
+
+            def write(sql: str, rows: List[tuple]):
+                writer.execute("BEGIN IMMEDIATE")
+                try:
+                    writer.executemany(sql, rows)
+                    writer.execute("COMMIT")
+                except Exception:
+                    writer.execute("ROLLBACK")
+                    raise
+
+            insert_sql = ("INSERT INTO bm25_postings (run_id, term, df, max_score, seqs, tfs) "
+                          "VALUES (?, ?, ?, ?, ?, ?)")
+            write("DELETE FROM bm25_postings WHERE run_id = ?", [(run_id,)])
+            cursor = reader.execute(
+                "SELECT term, seqs, tfs FROM bm25_segments WHERE run_id = ? ORDER BY term, segment", (run_id,)
+            )
+
+            term_count = 0
+            rows = []
+            current, seq_parts, tf_parts = None, [], []
+
+            def emit():
+                term_seqs = np.concatenate(seq_parts)
+                term_tfs = np.concatenate(tf_parts)
+                if len(term_seqs) > 1 and (np.diff(term_seqs) < 0).any():
+                    order = np.argsort(term_seqs, kind="stable")
+                    term_seqs, term_tfs = term_seqs[order], term_tfs[order]
+                idf = bm25_idf(len(term_seqs), doc_count)
+                max_score = float(bm25_scores(term_tfs, lengths_f[term_seqs], idf, avg_length).max())
+                rows.append((run_id, current, len(term_seqs), max_score,
+                             term_seqs.tobytes(), term_tfs.tobytes()))
+
+            for term, seq_blob, tf_blob in cursor:
+                if term != current:
+                    if current is not None:
+                        emit()
+                        term_count += 1
+                    current, seq_parts, tf_parts = term, [], []
+                seq_parts.append(np.frombuffer(seq_blob, dtype=np.int32))
+                tf_parts.append(np.frombuffer(tf_blob, dtype=np.uint16))
+                if len(rows) >= _WRITE_BATCH:
+                    write(insert_sql, rows)
+                    rows = []
+            if current is not None:
+                emit()
+                term_count += 1
+            if rows:
+                write(insert_sql, rows)
+            cursor.close()
+
+            writer.execute("BEGIN IMMEDIATE")
+            try:
+                writer.execute("DELETE FROM bm25_segments WHERE run_id = ?", (run_id,))
+                writer.execute("DELETE FROM bm25_segment_lengths WHERE run_id = ?", (run_id,))
+                writer.execute(
+                    "INSERT OR REPLACE INTO bm25_runs (run_id, doc_count, avg_length, term_count, lengths) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (run_id, doc_count, avg_length, term_count, doc_lengths.tobytes())
+                )
+                writer.execute("COMMIT")
+            except Exception:
+                writer.execute("ROLLBACK")
+                raise
+        finally:
+            reader.close()
+            writer.close()
+
+        with self._lock:
+            self._forget(run_id)
+        return {"bm25_terms": term_count, "bm25_avg_length": round(avg_length, 2)}
+
+    def delete_run(self, run_id: str):
+        """删除一次分块任务的全部索引数据"""
+        with self._lock:
+            self._transaction([
+                (f"DELETE FROM {table} WHERE run_id = ?", [(run_id,)])
+                for table in ("bm25_segments", "bm25_segment_lengths", "bm25_postings", "bm25_runs")
+            ])
+            self._forget(run_id)
+
+    def _forget(self, run_id: str):
+        self._runs.pop(run_id, None)
+        for key in [key for key in self._postings if key[0] == run_id]:
+            self._drop_cached(key)
+
+    def _drop_cached(self, key):
+        entry = self._postings.pop(key)
+        if entry is not None:
+            self._cached_bytes -= entry[0].nbytes + entry[1].nbytes
+
+    def _run_stats(self, run_id: str) -> Optional[Tuple[int, float, np.ndarray]]:
+        """(文档数, 平均长度, 文档长度数组)"""
+        if run_id not in self._runs:
+            row = self._conn.execute(
+                "SELECT doc_count, avg_length, lengths FROM bm25_runs WHERE run_id = ?", (run_id,)
+            ).fetchone()
+            self._runs[run_id] = (
+                (row[0], row[1], np.frombuffer(row[2], dtype=np.uint32).astype(np.float32)) if row else None
+            )
+        return self._runs[run_id]
+
+    def has_run(self, run_id: str) -> bool:
+        with self._lock:
+            return self._run_stats(run_id) is not None
+
+    def _load_postings(self, run_id: str, term: str) -> Optional[Tuple[np.ndarray, np.ndarray, int, float]]:
+        """(seq数组, 词频数组, df, 得分上界)，带LRU缓存"""
+        key = (run_id, term)
+        if key in self._postings:
+            self._postings.move_to_end(key)
+            return self._postings[key]
+
+        row = self._conn.execute(
+            "SELECT df, max_score, seqs, tfs FROM bm25_postings WHERE run_id = ? AND term = ?", key
+        ).fetchone()
+        entry = None
+        if row:
+            entry = (np.frombuffer(row[2], dtype=np.int32), np.frombuffer(row[3], dtype=np.uint16), row[0], row[1])
+            self._cached_bytes += entry[0].nbytes + entry[1].nbytes
+        self._postings[key] = entry
+        while self._cached_bytes > self.cache_bytes and len(self._postings) > 1:
+            self._drop_cached(next(iter(self._postings)))
+        return entry
+
+    def search(self, run_id: str, query: str, k: int,
+               allowed_seqs: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        BM25 检索，返回 [(seq, 得分)]，按得分降序
+
+        allowed_seqs 为排序后的可选 seq 子集（元数据过滤结果），在打分前先裁剪倒排表。
+
+        查询词按得分上界从高到低处理，累加候选的部分得分；当剩余词的上界之和
+        不超过当前第k名的部分得分时，未出现过的文档已不可能进入前k，之后只在已有候选上
+        用二分查找补分，并剔除「部分得分 + 剩余上界」低于门槛的候选。
+        长倒排表（常见词）通常上界低、排在最后，只做查找而不做全量合并。
+        """
+        with self._lock:
+            stats = self._run_stats(run_id)
+            if stats is None or k <= 0:
+                return []
+            doc_count, avg_length, lengths = stats
+            terms = []
+            for term in set(tokenize(query)):
+                postings = self._load_postings(run_id, term)
+                if postings is not None:
+                    terms.append(postings)
+
+        if allowed_seqs is not None:
+            filtered = []
+            for seqs, tfs, df, max_score in terms:
+                pos = np.minimum(np.searchsorted(allowed_seqs, seqs), max(len(allowed_seqs) - 1, 0))
+                keep = allowed_seqs[pos] == seqs if len(allowed_seqs) else np.zeros(len(seqs), dtype=bool)
+                if keep.any():
+                    filtered.append((seqs[keep], tfs[keep], df, max_score))
+            terms = filtered
+        if not terms:
+            return []
+
+        terms.sort(key=lambda t: t[3], reverse=True)
+        remaining = np.concatenate([np.cumsum([t[3] for t in terms][::-1])[::-1], [0.0]])
+
+        candidates = np.empty(0, dtype=np.int32)
+        scores = np.empty(0, dtype=np.float32)
+        threshold = 0.0
+        growing = True
+        for i, (seqs, tfs, df, _) in enumerate(terms):
+            idf = bm25_idf(df, doc_count)
+            if growing:
+                term_scores = bm25_scores(tfs, lengths[seqs], idf, avg_length)
+                merged = np.concatenate([candidates, seqs])
+                candidates, inverse = np.unique(merged, return_inverse=True)
+                scores = np.bincount(inverse, weights=np.concatenate([scores, term_scores])).astype(np.float32)
+            else:
+                pos = np.minimum(np.searchsorted(seqs, candidates), len(seqs) - 1)
+                hit = seqs[pos] == candidates
+                scores[hit] += bm25_scores(tfs[pos[hit]], lengths[candidates[hit]], idf, avg_length)
+
+            if len(scores) >= k:
+                threshold = float(np.partition(scores, len(scores) - k)[len(scores) - k])
+            if growing and len(scores) >= k and remaining[i + 1] <= threshold:
+                growing = False
+            if not growing:
+                keep = scores + remaining[i + 1] >= threshold
+                candidates, scores = candidates[keep], scores[keep]
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
+
+
+_index: Optional[BM25Index] = None
+_index_lock = threading.Lock()
+
+
+def get_bm25_index(db_path: Optional[Path] = None) -> BM25Index:
+    """获取进程内共享的 BM25 索引"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = BM25Index(db_path or Path("data") / "chunks" / "bm25_index.db")
+        return _index
@@ -0,0 +1,243 @@
+"""
+文本分块算法模块
+所有分块器都是生成器，只产出 (start_pos, end_pos) 字符区间，不在内存中累积分块结果
+"""
+
+import re
+from bisect import bisect_left
+from collections import deque
+from typing import Iterator, Iterable, Tuple, Callable, Optional, List
+
+Span = Tuple[int, int]
+
+# 句末标点（含中文），后面可跟引号/括号
+_SENTENCE_END = re.compile(r"[。！？!?；;…]+[”’\"'）)\]]*|\n+")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+# 语义分块：相邻句子字符二元组相似度低于该值时视为话题切换
+SEMANTIC_THRESHOLD = 0.08
+SEMANTIC_WINDOW = 3
+
+
+def _trim(text: str, start: int, end: int) -> Optional[Span]:
+    """去掉区间首尾空白，空区间返回 None"""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return (start, end) if start < end else None
+
+
+def split_fixed(text: str, size: int, overlap: int, start: int = 0, end: Optional[int] = None) -> Iterator[Span]:
+    """按固定字符数切分，相邻块重叠 overlap 个字符"""
+    end = len(text) if end is None else end
+    step = max(size - overlap, 1)
+    pos = start
+    while pos < end:
+        span = _trim(text, pos, min(pos + size, end))
+        if span:
+            yield span
+        if pos + size >= end:
+            break
+        pos += step
+
+
+def _split_by(pattern: re.Pattern, text: str) -> Iterator[Span]:
+    start = 0
+    for match in pattern.finditer(text):
+        span = _trim(text, start, match.end())
+        if span:
+            yield span
+        start = match.end()
+    span = _trim(text, start, len(text))
+    if span:
+        yield span
+
+
+def split_sentences(text: str) -> Iterator[Span]:
+    """按句末标点和换行切分句子"""
+    return _split_by(_SENTENCE_END, text)
+
+
+def split_paragraphs(text: str) -> Iterator[Span]:
+    """按空行切分段落"""
+    return _split_by(_PARAGRAPH_BREAK, text)
+
+
+def pack_units(units: Iterable[Span], size: int, overlap: int,
+               measure: Callable[[int, int], int],
+               split_long: Callable[[int, int], Iterator[Span]]) -> Iterator[Span]:
+    """
+    把句子/段落等单元顺序拼接成不超过 size 的块
+
+    相邻块之间保留末尾若干个完整单元作为重叠（总长度不超过 overlap）；
+    单个单元本身超过 size 时交给 split_long 切分。
+    """
+    window = deque()  # (start, end, length)
+    length = 0
+
+    for start, end in units:
+        n = measure(start, end)
+
+        if n > size:
+            if window:
+                yield window[0][0], window[-1][1]
+                window.clear()
+                length = 0
+            yield from split_long(start, end)
+            continue
+
+        if window and length + n > size:
+            yield window[0][0], window[-1][1]
+
+            # 保留末尾单元作为重叠
+            kept = deque()
+            kept_length = 0
+            while window and kept_length + window[-1][2] <= overlap:
+                unit = window.pop()
+                kept.appendleft(unit)
+                kept_length += unit[2]
+            window, length = kept, kept_length
+
+            while window and length + n > size:
+                length -= window.popleft()[2]
+
+        window.append((start, end, n))
+        length += n
+
+    if window:
+        yield window[0][0], window[-1][1]
+
+
+def _bigrams(text: str) -> set:
+    text = re.sub(r"\s+", "", text)
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+
+def split_topics(text: str, sentences: List[Span], min_size: int,
+                 measure: Callable[[int, int], int]) -> Iterator[List[Span]]:
+    """
+    按话题切换把句子分组
+
+    用当前段最近 SEMANTIC_WINDOW 个句子的字符二元组与下一句比较（Jaccard），
+    相似度低于阈值且当前段已达到 min_size 时开始新的一段。
+    """
+    segment: List[Span] = []
+    recent = deque(maxlen=SEMANTIC_WINDOW)
+    segment_length = 0
+
+    for start, end in sentences:
+        grams = _bigrams(text[start:end])
+        if segment and segment_length >= min_size:
+            context = set().union(*recent)
+            similarity = len(grams & context) / len(grams | context)
+            if similarity < SEMANTIC_THRESHOLD:
+                yield segment
+                segment, segment_length = [], 0
+                recent.clear()
+
+        segment.append((start, end))
+        segment_length += measure(start, end)
+        recent.append(grams)
+
+    if segment:
+        yield segment
+
+
+def chunk_text(text: str, method: str, size: int, overlap: int,
+               measure: Optional[Callable[[int, int], int]] = None,
+               split_long: Optional[Callable[[int, int], Iterator[Span]]] = None) -> Iterator[Span]:
+    """
+    对一段文本分块
+
+    Args:
+        text: 待分块文本（通常是一页或一个章节）
+        method: 分块方法 (fixed, sentence, paragraph, semantic)
+        size: 块大小
+        overlap: 重叠大小
+        measure: 区间长度的计量方式，默认按字符数
+        split_long: 超长单元的切分方式，默认按固定字符数
+
+    Returns:
+        (start_pos, end_pos) 区间生成器
+    """
+    if size <= 0:
+        raise ValueError("chunk_size 必须大于 0")
+    if not 0 <= overlap < size:
+        raise ValueError("overlap_size 必须大于等于 0 且小于 chunk_size")
+
+    measure = measure or (lambda start, end: end - start)
+    split_long = split_long or (lambda start, end: split_fixed(text, size, overlap, start, end))
+
+    if method in ("fixed", "fixed-size"):
+        return split_long(0, len(text))
+    if method == "sentence":
+        return pack_units(split_sentences(text), size, overlap, measure, split_long)
+    if method == "paragraph":
+        return pack_units(split_paragraphs(text), size, overlap, measure, split_long)
+    if method == "semantic":
+        return _chunk_semantic(text, size, overlap, measure, split_long)
+
+    raise ValueError(f"不支持的分块方法: {method}")
+
+
+def _chunk_semantic(text, size, overlap, measure, split_long) -> Iterator[Span]:
+    """语义分块：先按话题分段，段内按句子拼接，块不跨越话题边界"""
+    sentences = list(split_sentences(text))
+    for segment in split_topics(text, sentences, size // 2, measure):
+        yield from pack_units(segment, size, overlap, measure, split_long)
+
+
+class TokenSpans:
+    """
+    按token计量的分块辅助
+
+    整段文本只编码一次，借助 decode_with_offsets 得到每个token的字符起点，
+    之后的长度计算和切分都只在token下标上做二分查找和切片，重叠窗口不需要重新编码。
+    """
+
+    def __init__(self, text: str, tokens: List[int], encoding):
+        self.text_length = len(text)
+        self.tokens = tokens
+        _, self.offsets = encoding.decode_with_offsets(tokens)
+
+    def _token_index(self, char_pos: int) -> int:
+        return bisect_left(self.offsets, char_pos)
+
+    def _char_pos(self, token_index: int) -> int:
+        return self.offsets[token_index] if token_index < len(self.offsets) else self.text_length
+
+    def measure(self, start: int, end: int) -> int:
+        """字符区间内的token数"""
+        return self._token_index(end) - self._token_index(start)
+
+    def split(self, start: int, end: int, size: int, overlap: int) -> Iterator[Span]:
+        """在token边界上按固定token数切分字符区间"""
+        first, last = self._token_index(start), self._token_index(end)
+        step = max(size - overlap, 1)
+        pos = first
+        while pos < last:
+            stop = min(pos + size, last)
+            span = (max(self._char_pos(pos), start), min(self._char_pos(stop), end))
+            if span[0] < span[1]:
+                yield span
+            if stop >= last:
+                break
+            pos += step
+
+
+def chunk_text_by_tokens(text: str, tokens: List[int], encoding, method: str,
+                         size: int, overlap: int) -> Iterator[Tuple[int, int, int]]:
+    """
+    按token数分块，size/overlap 的单位为token
+
+    Returns:
+        (start_pos, end_pos, token_count) 生成器，位置仍是字符偏移
+    """
+    spans = TokenSpans(text, tokens, encoding)
+    for start, end in chunk_text(
+        text, method, size, overlap,
+        measure=spans.measure,
+        split_long=lambda s, e: spans.split(s, e, size, overlap)
+    ):
+        yield start, end, spans.measure(start, end)
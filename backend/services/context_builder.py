@@ -0,0 +1,236 @@
+"""
+上下文组装模块
+把检索结果整理为不超过模型token预算的提示词上下文：
+1. 去重：内容相同或被其他分块包含的分块只保留一份
+2. 合并：同一来源中位置重叠或相邻的分块（例如分块时 overlap_size 产生的重叠，
+   或同一章节中只隔着空白的前后分块）拼接为一段
+3. 装填：按得分从高到低放入，直到达到该模型的token预算，放不下的最后一段按剩余预算截断
+"""
+
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.tokenizer import count_tokens_batch, get_encoding
+
+
+# 各模型的上下文token预算（留出问题、系统提示和回答的空间），按模型名前缀匹配
+CONTEXT_TOKEN_BUDGETS = {
+    "gpt-3.5-turbo": 3000,
+    "gpt-4": 6000,
+    "gpt-4-turbo": 60000,
+    "gpt-4o": 60000
+}
+DEFAULT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+
+# 截断后少于该token数的片段不值得放入
+MIN_TRUNCATED_TOKENS = 64
+
+# 没有位置信息时，按文本首尾重叠判断相邻分块：重叠至少这么多字符才合并，最多检查这么长
+MIN_TEXT_OVERLAP = 20
+MAX_TEXT_OVERLAP = 1000
+
+_SPACES = re.compile(r"[ \t\u3000\xa0]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+
+
+def context_budget(model: Optional[str]) -> int:
+    """模型对应的上下文token预算"""
+    matches = [name for name in CONTEXT_TOKEN_BUDGETS if model and model.startswith(name)]
+    return CONTEXT_TOKEN_BUDGETS[max(matches, key=len)] if matches else DEFAULT_CONTEXT_TOKEN_BUDGET
+
+
+def compress_text(text: str) -> str:
+    """压缩空白：连续空格合并为一个，连续空行合并为一个换行"""
+    return _BLANK_LINES.sub("\n", _SPACES.sub(" ", text)).strip()
+
+
+def _text_overlap(left: str, right: str) -> int:
+    """left 的结尾与 right 的开头重叠的字符数（不足 MIN_TEXT_OVERLAP 时为 0）"""
+    for size in range(min(len(left), len(right), MAX_TEXT_OVERLAP), MIN_TEXT_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _normalize(context: list) -> List[Dict[str, Any]]:
+    """统一为内部片段结构，context 元素可以是文本或检索结果"""
+    items = []
+    for rank, item in enumerate(context):
+        if not isinstance(item, dict):
+            item = {"content": str(item)}
+        metadata = item.get("metadata") or {}
+        items.append({
+            "ids": [item["id"]] if item.get("id") else [],
+            "content": item.get("content") or "",
+            "score": item.get("score"),
+            "rank": rank,
+            "source": metadata.get("source"),
+            "file_id": metadata.get("file_id"),
+            "page_number": metadata.get("page_number"),
+            "group": (metadata.get("file_id"), metadata.get("section_id")),
+            "start": metadata.get("start_pos"),
+            "end": metadata.get("end_pos"),
+            "chunk_index": metadata.get("chunk_index")
+        })
+    return [item for item in items if item["content"].strip()]
+
+
+def _absorb(target: Dict[str, Any], other: Dict[str, Any]):
+    target["ids"].extend(i for i in other["ids"] if i not in target["ids"])
+    target["rank"] = min(target["rank"], other["rank"])
+    if other["score"] is not None and (target["score"] is None or other["score"] > target["score"]):
+        target["score"] = other["score"]
+
+
+def _adjacent(current: Dict[str, Any], item: Dict[str, Any]) -> bool:
+    """
+    item 是否与 current 重叠或相接
+
+    分块器产出的区间之间只会跳过空白（如段落间的空行），所以同一章节中
+    分块序号紧随其后的分块即使偏移不相接，中间也只隔着空白，同样视为相接。
+    """
+    if item["start"] <= current["end"]:
+        return True
+    return current["chunk_index"] is not None and item["chunk_index"] == current["chunk_index"] + 1
+
+
+def _merge_spans(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """同一文件同一章节内，按字符偏移合并重叠或相邻的分块"""
+    positioned: Dict[tuple, List[Dict[str, Any]]] = {}
+    rest = []
+    for item in items:
+        if item["start"] is not None and item["end"] is not None and item["group"][0]:
+            positioned.setdefault(item["group"], []).append(item)
+        else:
+            rest.append(item)
+
+    merged = []
+    for group in positioned.values():
+        group.sort(key=lambda item: (item["start"], -item["end"]))
+        current = group[0]
+        for item in group[1:]:
+            if _adjacent(current, item):
+                if item["start"] > current["end"]:
+                    # 中间的空白不在分块内容中，以换行代替
+                    current["content"] += "\n" + item["content"]
+                    current["end"], current["chunk_index"] = item["end"], item["chunk_index"]
+                elif item["end"] > current["end"]:
+                    current["content"] += item["content"][current["end"] - item["start"]:]
+                    current["end"], current["chunk_index"] = item["end"], item["chunk_index"]
+                _absorb(current, item)
+            else:
+                merged.append(current)
+                current = item
+        merged.append(current)
+    return merged + rest
+
+
+def _merge_text(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """按文本去重：完全相同或被包含的片段并入较长的片段；同一来源首尾重叠的片段拼接"""
+    kept: List[Dict[str, Any]] = []
+    for item in sorted(items, key=lambda item: -len(item["content"])):
+        for other in kept:
+            if item["content"] in other["content"]:
+                _absorb(other, item)
+                break
+            if item["source"] != other["source"]:
+                continue
+            overlap = _text_overlap(other["content"], item["content"])
+            if overlap:
+                other["content"] += item["content"][overlap:]
+                _absorb(other, item)
+                break
+            overlap = _text_overlap(item["content"], other["content"])
+            if overlap:
+                other["content"] = item["content"] + other["content"][overlap:]
+                _absorb(other, item)
+                break
+        else:
+            kept.append(item)
+    return kept
+
+
+def _block_header(index: int, item: Dict[str, Any]) -> str:
+    """上下文段的编号和来源行（含换行）"""
+    return f"[{index}]" + (f"（来源：{item['source']}）" if item["source"] else "") + "\n"
+
+
+def citations(blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """上下文段的引用信息（不含正文）"""
+    return [{key: value for key, value in block.items() if key != "text"} for block in blocks]
+
+
+def build_context(context: list, model: Optional[str] = None,
+                  budget: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    组装上下文
+
+    Args:
+        context: 检索结果列表（含 id、content、score、metadata）或文本列表
+        model: 模型名称，决定token计数方式和默认预算
+        budget: token预算，为空时按模型选择
+
+    Returns:
+        (上下文段列表, 统计)。每段含 index、ids、source、file_id、page_number、score、
+        text（带编号和来源的完整文本）、tokens、truncated，按得分从高到低排列，
+        index 即提示词中的引用编号。
+    """
+    budget = budget if budget is not None else context_budget(model)
+    items = _normalize(context)
+    input_count = len(items)
+    items = _merge_text(_merge_spans(items))
+    # 没有得分的片段按原始顺序排在后面
+    items.sort(key=lambda item: (item["score"] is None, -(item["score"] or 0), item["rank"]))
+
+    # 全部候选的正文和编号来源行一次批量编码。来源行以标点加换行结尾，编码时不会与正文合并，
+    # 所以整段的token数等于两者之和；有候选被丢弃后编号前移，只需补充统计很短的来源行
+    encoding = get_encoding(model)
+    contents = [compress_text(item["content"]) for item in items]
+    content_tokens = count_tokens_batch(contents, model)
+    headers = [_block_header(i + 1, item) for i, item in enumerate(items)]
+    header_tokens = dict(zip(headers, count_tokens_batch(headers, model)))
+
+    blocks = []
+    used = truncated = 0
+    for item, content, tokens in zip(items, contents, content_tokens):
+        header = _block_header(len(blocks) + 1, item)
+        if header not in header_tokens:
+            header_tokens[header] = count_tokens_batch([header], model)[0]
+        overhead = header_tokens[header]
+        tokens += overhead
+        remaining = budget - used
+        is_truncated = tokens > remaining
+        if is_truncated:
+            if truncated or remaining < MIN_TRUNCATED_TOKENS:
+                continue
+            # 按剩余预算截断（编号和来源占用的token也计算在内）
+            content = encoding.decode(encoding.encode_ordinary(content)[:max(remaining - overhead, 0)])
+            tokens = overhead + count_tokens_batch([content], model)[0]
+            if tokens > remaining:
+                continue
+            truncated += 1
+        text = header + content
+        blocks.append({
+            "index": len(blocks) + 1,
+            "ids": item["ids"],
+            "source": item["source"],
+            "file_id": item["file_id"],
+            "page_number": item["page_number"],
+            "score": item["score"],
+            "text": text,
+            "tokens": tokens,
+            "truncated": is_truncated
+        })
+        used += tokens
+
+    stats = {
+        "input_chunks": len(context),
+        "merged_chunks": input_count - len(items),
+        "packed_blocks": len(blocks),
+        "dropped_blocks": len(items) - len(blocks),
+        "truncated_blocks": truncated,
+        "context_tokens": used,
+        "token_budget": budget
+    }
+    return blocks, stats
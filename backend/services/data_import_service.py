@@ -6,21 +6,22 @@
 import os
 import json
 import uuid
+import hashlib
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Optional, Set
 import asyncio
 
-# 文档处理库
-import pandas as pd
-from langchain.document_loaders import (
-    PyPDFLoader,
-    UnstructuredPDFLoader,
-    TextLoader,
-    CSVLoader,
-    UnstructuredMarkdownLoader,
-    Docx2txtLoader
-)
+from fastapi import UploadFile
+
+from services.document_parser import DocumentParserPool
+from utils.metadata_store import get_metadata_store
+from utils.metrics import STAGE_BYTES, traced
+
+
+# 上传分块大小与单文件大小上限（字节）
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 2 * 1024 * 1024 * 1024))
 
 
 class DataImportService:
@@ -33,31 +34,24 @@ class DataImportService:
         self.upload_dir.mkdir(parents=True, exist_ok=True)
         self.processed_dir.mkdir(parents=True, exist_ok=True)
         
-        # 文件信息存储文件
+        # 文件信息存储（旧版 file_info.json 首次启动时迁移）
         self.file_info_path = self.data_dir / "file_info.json"
+        self.store = get_metadata_store()
+        self.store.migrate_json("file_info", self.file_info_path)
+        self.store.create_index("file_info", "content_hash")
+        self.store.create_index("file_info", "name")
         
-        # 初始化文件信息存储
-        if not self.file_info_path.exists():
-            self._save_file_info([])
-    
-    def _load_file_info(self) -> List[Dict]:
-        """加载文件信息"""
-        try:
-            with open(self.file_info_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
+        # 文档解析进程池（进程数与超时见 PARSE_WORKERS / PARSE_TIMEOUT）
+        self.parser_pool = DocumentParserPool()
     
-    def _save_file_info(self, file_info: List[Dict]):
-        """保存文件信息"""
-        with open(self.file_info_path, 'w', encoding='utf-8') as f:
-            json.dump(file_info, f, ensure_ascii=False, indent=2)
-    
-    async def upload_file(self, file_type: str, file_format: str, pdf_parser: str = None) -> Dict[str, Any]:
+    @traced("upload_file", items=lambda result: result.get("processed_chunks"))
+    async def upload_file(self, file: UploadFile, file_type: str, file_format: str,
+                          pdf_parser: str = None) -> Dict[str, Any]:
         """
         上传并处理文件
         
         Args:
+            file: 上传的文件（multipart），按固定大小分块落盘
             file_type: 文件类型 (structured, semi-structured, unstructured)
             file_format: 文件格式 (excel, txt, markdown, pdf, word)
             pdf_parser: PDF解析器 (PyPDF, PyMuPDF)
@@ -65,240 +59,213 @@ class DataImportService:
         Returns:
             处理结果
         """
-        # 模拟文件上传和处理过程
         file_id = str(uuid.uuid4())
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        # 模拟文件信息
-        mock_file_info = {
+        # 保留原始扩展名，没有扩展名时按文件格式补齐
+        file_name = Path(file.filename or "").name or f"{file_id}.{self._get_file_extension(file_format)}"
+        suffix = Path(file_name).suffix.lower() or f".{self._get_file_extension(file_format)}"
+        stored_path = self.upload_dir / f"{file_id}{suffix}"
+        
+        size, content_hash = await self._save_upload(file, stored_path)
+        STAGE_BYTES.inc(size, stage="upload_file")
+        
+        # 同名同类型、内容完全相同且已处理成功的文件直接跳过
+        previous = self._find_previous_version(file_name, file_type, file_format)
+        if previous and previous["status"] == "success" and previous.get("content_hash") == content_hash:
+            stored_path.unlink(missing_ok=True)
+            return {
+                "file_id": previous["id"],
+                "status": "skipped",
+                "message": "文件内容未变化，已跳过处理",
+                "processed_chunks": previous.get("total_sections", 0)
+            }
+        
+        # 同名文件视为新版本：沿用原 file_id，只标记变化的页/章节。
+        # 新版本解析成功之前，旧版本的上传文件、处理结果和记录都保持不变
+        if previous:
+            file_id = previous["id"]
+        final_path = self.upload_dir / f"{file_id}{suffix}"
+        
+        file_info = {
             "id": file_id,
-            "name": f"sample_{file_format}_file.{self._get_file_extension(file_format)}",
-            "size": 1024 * 1024,  # 1MB
+            "name": file_name,
+            "size": size,
+            "content_hash": content_hash,
             "type": file_format,
             "file_type": file_type,
             "upload_time": current_time,
             "status": "processing",
             "pdf_parser": pdf_parser if file_format == "pdf" else None,
-            "processed_data_path": None
+            "file_path": str(stored_path),
+            "processed_data_path": None,
+            "version": previous.get("version", 1) + 1 if previous else 1
         }
         
-        # 模拟处理延迟
-        await asyncio.sleep(1)
+        # 新文件先登记为处理中，解析期间可在文件列表中看到并取消（新版本按原 file_id 取消）
+        if not previous:
+            self.store.append("file_info", file_info)
         
         try:
             # 根据文件类型进行处理
-            processed_data = await self._process_file(mock_file_info)
-            
-            # 保存处理后的数据
-            processed_file_path = self.processed_dir / f"{file_id}.json"
-            with open(processed_file_path, 'w', encoding='utf-8') as f:
-                json.dump(processed_data, f, ensure_ascii=False, indent=2)
+            processed_data = await self._process_file(file_info)
             
-            # 更新文件信息
-            mock_file_info["status"] = "success"
-            mock_file_info["processed_data_path"] = str(processed_file_path)
-            
-            # 保存到文件信息列表
-            file_info_list = self._load_file_info()
-            file_info_list.append(mock_file_info)
-            self._save_file_info(file_info_list)
-            
-            return {
-                "file_id": file_id,
-                "status": "success",
-                "message": "文件处理成功",
-                "processed_chunks": len(processed_data.get("chunks", []))
-            }
+            # 按页/章节计算指纹，与上一版本比较
+            previous_hashes = set()
+            if previous and previous.get("processed_data_path"):
+                previous_hashes = await asyncio.to_thread(
+                    self._load_section_hashes, Path(previous["processed_data_path"])
+                )
+            fingerprint = self._fingerprint(processed_data, previous_hashes)
             
+            # 保存处理后的数据（先写临时文件再替换，旧版本结果在替换前一直可用）
+            processed_file_path = self.processed_dir / f"{file_id}.json"
+            await asyncio.to_thread(self._write_processed, processed_file_path, processed_data)
         except Exception as e:
-            # 处理失败
-            mock_file_info["status"] = "error"
-            mock_file_info["error_message"] = str(e)
-            
-            file_info_list = self._load_file_info()
-            file_info_list.append(mock_file_info)
-            self._save_file_info(file_info_list)
-            
+            stored_path.unlink(missing_ok=True)
+            if previous:
+                # 新版本处理失败：保留旧版本，只记录本次错误
+                self.store.update("file_info", file_id, {"last_error": str(e)})
+            else:
+                self.store.update("file_info", file_id, {
+                    "status": "error",
+                    "error_message": str(e)
+                })
             raise Exception(f"文件处理失败: {str(e)}")
-    
-    async def _process_file(self, file_info: Dict) -> Dict[str, Any]:
-        """
-        根据文件类型处理文件
-        """
-        file_type = file_info["file_type"]
-        file_format = file_info["type"]
         
-        # 模拟不同类型文件的处理结果
-        if file_type == "structured":
-            if file_format == "excel":
-                return self._process_excel_file(file_info)
-            elif file_format == "txt":
-                return self._process_txt_file(file_info)
-        elif file_type == "semi-structured":
-            if file_format == "markdown":
-                return self._process_markdown_file(file_info)
-        elif file_type == "unstructured":
-            if file_format == "pdf":
-                return self._process_pdf_file(file_info)
-            elif file_format == "word":
-                return self._process_word_file(file_info)
+        # 解析成功后才替换上传文件并切换记录
+        os.replace(stored_path, final_path)
+        if previous and previous.get("file_path") and Path(previous["file_path"]) != final_path:
+            Path(previous["file_path"]).unlink(missing_ok=True)
+        
+        file_info.update({
+            "status": "success",
+            "file_path": str(final_path),
+            "processed_data_path": str(processed_file_path),
+            "error_message": None,
+            "last_error": None,
+            **fingerprint
+        })
+        self.store.update("file_info", file_id, file_info)
         
-        # 默认处理
         return {
-            "file_id": file_info["id"],
-            "original_name": file_info["name"],
-            "file_type": file_type,
-            "file_format": file_format,
-            "chunks": [
-                {
-                    "id": f"chunk_{i}",
-                    "content": f"这是第{i+1}个文本块的模拟内容，来自文件 {file_info['name']}",
-                    "metadata": {
-                        "source": file_info["name"],
-                        "chunk_index": i,
-                        "chunk_type": "text"
-                    }
-                }
-                for i in range(5)  # 模拟5个文本块
-            ],
-            "metadata": {
-                "total_chunks": 5,
-                "processing_time": datetime.now().isoformat(),
-                "file_size": file_info["size"]
-            }
+            "file_id": file_id,
+            "status": "success",
+            "message": "文件处理成功",
+            "processed_chunks": len(processed_data.get("chunks", [])),
+            "changed_sections": fingerprint["changed_sections"],
+            "unchanged_sections": fingerprint["total_sections"] - fingerprint["changed_sections"]
         }
     
-    def _process_excel_file(self, file_info: Dict) -> Dict[str, Any]:
-        """处理Excel文件"""
-        # 模拟Excel文件处理
-        return {
-            "file_id": file_info["id"],
-            "original_name": file_info["name"],
-            "file_type": "structured",
-            "file_format": "excel",
-            "chunks": [
-                {
-                    "id": f"row_{i}",
-                    "content": f"姓名: 用户{i+1}, 年龄: {20+i}, 职业: 工程师",
-                    "metadata": {
-                        "source": file_info["name"],
-                        "row_index": i,
-                        "chunk_type": "structured_data"
-                    }
-                }
-                for i in range(10)
-            ],
-            "metadata": {
-                "total_chunks": 10,
-                "columns": ["姓名", "年龄", "职业"],
-                "processing_time": datetime.now().isoformat()
-            }
-        }
+    def _find_previous_version(self, file_name: str, file_type: str, file_format: str) -> Optional[Dict]:
+        """查找同名同类型文件的最近一个版本"""
+        for file_info in self.store.find("file_info", "name", file_name, desc=True):
+            if file_info["file_type"] == file_type and file_info["type"] == file_format \
+                    and file_info["status"] != "processing":
+                return file_info
+        return None
     
-    def _process_txt_file(self, file_info: Dict) -> Dict[str, Any]:
-        """处理TXT文件"""
+    @staticmethod
+    def _fingerprint(processed_data: Dict, previous_hashes: Set[str]) -> Dict[str, Any]:
+        """
+        为每个页/章节计算内容哈希
+        
+        哈希只取决于内容本身，插入或删除页面不会让后续未变化的页面被误判为变化。
+        变化的页/章节标记 changed=True，变化数量显示在文件列表中。分块阶段只重新切分变化的页/章节，
+        其余页/章节复用上一次分块的结果（分块ID不变），嵌入阶段对这些分块命中嵌入缓存。
+        """
+        chunks = processed_data.get("chunks", [])
+        changed = 0
+        for chunk in chunks:
+            chunk["content_hash"] = hashlib.sha256(chunk["content"].encode("utf-8")).hexdigest()
+            chunk["changed"] = chunk["content_hash"] not in previous_hashes
+            changed += chunk["changed"]
+        
+        processed_data["metadata"]["changed_sections"] = changed
         return {
-            "file_id": file_info["id"],
-            "original_name": file_info["name"],
-            "file_type": "structured",
-            "file_format": "txt",
-            "chunks": [
-                {
-                    "id": f"line_{i}",
-                    "content": f"这是TXT文件的第{i+1}行内容",
-                    "metadata": {
-                        "source": file_info["name"],
-                        "line_number": i+1,
-                        "chunk_type": "text_line"
-                    }
-                }
-                for i in range(20)
-            ],
-            "metadata": {
-                "total_chunks": 20,
-                "processing_time": datetime.now().isoformat()
-            }
+            "total_sections": len(chunks),
+            "changed_sections": changed,
+            "removed_sections": len(previous_hashes - {c["content_hash"] for c in chunks})
         }
     
-    def _process_markdown_file(self, file_info: Dict) -> Dict[str, Any]:
-        """处理Markdown文件"""
-        return {
-            "file_id": file_info["id"],
-            "original_name": file_info["name"],
-            "file_type": "semi-structured",
-            "file_format": "markdown",
-            "chunks": [
-                {
-                    "id": f"section_{i}",
-                    "content": f"# 第{i+1}节标题\n\n这是第{i+1}节的内容，包含了一些重要的信息。",
-                    "metadata": {
-                        "source": file_info["name"],
-                        "section_index": i,
-                        "chunk_type": "markdown_section"
-                    }
-                }
-                for i in range(8)
-            ],
-            "metadata": {
-                "total_chunks": 8,
-                "processing_time": datetime.now().isoformat()
-            }
-        }
+    @staticmethod
+    def _load_section_hashes(processed_file_path: Path) -> Set[str]:
+        """读取上一版本处理结果中的页/章节哈希"""
+        try:
+            with open(processed_file_path, 'r', encoding='utf-8') as f:
+                processed_data = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        return {c["content_hash"] for c in processed_data.get("chunks", []) if c.get("content_hash")}
     
-    def _process_pdf_file(self, file_info: Dict) -> Dict[str, Any]:
-        """处理PDF文件"""
-        pdf_parser = file_info.get("pdf_parser", "PyPDF")
+    async def _save_upload(self, file: UploadFile, stored_path: Path) -> Tuple[int, str]:
+        """
+        分块读取上传内容写入磁盘，同时计算内容哈希
         
-        return {
-            "file_id": file_info["id"],
-            "original_name": file_info["name"],
-            "file_type": "unstructured",
-            "file_format": "pdf",
-            "chunks": [
-                {
-                    "id": f"page_{i}",
-                    "content": f"这是PDF文档第{i+1}页的内容，使用{pdf_parser}解析器提取。包含了文档的重要信息和数据。",
-                    "metadata": {
-                        "source": file_info["name"],
-                        "page_number": i+1,
-                        "parser": pdf_parser,
-                        "chunk_type": "pdf_page"
-                    }
-                }
-                for i in range(15)
-            ],
-            "metadata": {
-                "total_chunks": 15,
-                "parser_used": pdf_parser,
-                "processing_time": datetime.now().isoformat()
-            }
-        }
+        每次只在内存中保留一个 UPLOAD_CHUNK_SIZE 大小的块；先写入 .part 临时文件，
+        完成后再原子重命名，避免半截文件被当作有效上传。
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        part_path = stored_path.with_name(stored_path.name + ".part")
+        
+        try:
+            with open(part_path, 'wb') as f:
+                while True:
+                    chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    
+                    size += len(chunk)
+                    if size > MAX_UPLOAD_SIZE:
+                        raise Exception(f"文件大小超过限制: {MAX_UPLOAD_SIZE} 字节")
+                    
+                    # 哈希与写盘放到线程中执行，不阻塞事件循环
+                    await asyncio.to_thread(self._write_chunk, f, hasher, chunk)
+            
+            os.replace(part_path, stored_path)
+        except BaseException:
+            part_path.unlink(missing_ok=True)
+            raise
+        finally:
+            await file.close()
+        
+        return size, hasher.hexdigest()
     
-    def _process_word_file(self, file_info: Dict) -> Dict[str, Any]:
-        """处理Word文件"""
+    @staticmethod
+    def _write_chunk(f, hasher, chunk: bytes):
+        hasher.update(chunk)
+        f.write(chunk)
+    
+    @staticmethod
+    def _write_processed(processed_file_path: Path, processed_data: Dict):
+        tmp_path = processed_file_path.with_suffix(".json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(processed_data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, processed_file_path)
+    
+    async def _process_file(self, file_info: Dict) -> Dict[str, Any]:
+        """
+        根据文件类型处理文件
+        
+        解析在进程池中执行，事件循环只等待结果
+        """
+        return await self.parser_pool.parse(file_info["id"], file_info)
+    
+    async def cancel_processing(self, file_id: str) -> Dict[str, Any]:
+        """取消排队中或正在解析的文件"""
+        if not self.parser_pool.cancel(file_id):
+            raise Exception(f"没有正在处理的文件: {file_id}")
+        
         return {
-            "file_id": file_info["id"],
-            "original_name": file_info["name"],
-            "file_type": "unstructured",
-            "file_format": "word",
-            "chunks": [
-                {
-                    "id": f"paragraph_{i}",
-                    "content": f"这是Word文档的第{i+1}个段落，包含了丰富的文本内容和格式信息。",
-                    "metadata": {
-                        "source": file_info["name"],
-                        "paragraph_index": i,
-                        "chunk_type": "word_paragraph"
-                    }
-                }
-                for i in range(12)
-            ],
-            "metadata": {
-                "total_chunks": 12,
-                "processing_time": datetime.now().isoformat()
-            }
+            "file_id": file_id,
+            "message": "已取消文件处理"
         }
     
+    def shutdown(self):
+        """关闭解析进程池"""
+        self.parser_pool.shutdown()
+    
     def _get_file_extension(self, file_format: str) -> str:
         """获取文件扩展名"""
         extension_map = {
@@ -310,9 +277,10 @@ class DataImportService:
         }
         return extension_map.get(file_format, "txt")
     
-    async def get_file_list(self) -> List[Dict[str, Any]]:
-        """获取文件列表"""
-        file_info_list = self._load_file_info()
+    async def get_file_list(self, offset: int = 0, limit: Optional[int] = None,
+                            desc: bool = False) -> List[Dict[str, Any]]:
+        """获取文件列表（默认按创建顺序返回全部；limit 分页，desc 为 True 时从新到旧）"""
+        file_info_list = self.store.list("file_info", offset=offset, limit=limit, desc=desc)
         
         # 格式化返回数据
         result = []
@@ -325,36 +293,34 @@ class DataImportService:
                 "file_type": file_info["file_type"],
                 "upload_time": file_info["upload_time"],
                 "status": file_info["status"],
-                "error_message": file_info.get("error_message")
+                "version": file_info.get("version", 1),
+                "changed_sections": file_info.get("changed_sections"),
+                "error_message": file_info.get("error_message"),
+                "last_error": file_info.get("last_error")
             })
         
         return result
     
     async def delete_file(self, file_id: str) -> Dict[str, Any]:
         """删除文件"""
-        file_info_list = self._load_file_info()
-        
         # 查找要删除的文件
-        file_to_delete = None
-        updated_list = []
-        
-        for file_info in file_info_list:
-            if file_info["id"] == file_id:
-                file_to_delete = file_info
-            else:
-                updated_list.append(file_info)
+        file_to_delete = self.store.get("file_info", file_id)
         
         if not file_to_delete:
             raise Exception(f"文件不存在: {file_id}")
         
+        # 删除上传的原始文件
+        if file_to_delete.get("file_path"):
+            Path(file_to_delete["file_path"]).unlink(missing_ok=True)
+        
         # 删除处理后的数据文件
         if file_to_delete.get("processed_data_path"):
             processed_file = Path(file_to_delete["processed_data_path"])
             if processed_file.exists():
                 processed_file.unlink()
         
-        # 更新文件信息列表
-        self._save_file_info(updated_list)
+        # 删除文件信息
+        self.store.delete("file_info", file_id)
         
         return {
             "file_id": file_id,
@@ -0,0 +1,321 @@
+"""
+文档解析模块
+在独立进程中执行CPU密集的文档解析（PDF/Word/Excel等），避免阻塞FastAPI事件循环
+"""
+
+import os
+import re
+import signal
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Callable, Optional, Set
+
+# 文档处理库
+import pandas as pd
+from langchain.document_loaders import (
+    PyPDFLoader,
+    PyMuPDFLoader,
+    UnstructuredPDFLoader,
+    CSVLoader,
+    Docx2txtLoader
+)
+
+
+# 解析进程数与单文件解析超时（秒）
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", os.cpu_count() or 1))
+PARSE_TIMEOUT = float(os.getenv("PARSE_TIMEOUT", 600))
+
+PDF_LOADERS = {
+    "PyPDF": PyPDFLoader,
+    "PyMuPDF": PyMuPDFLoader,
+    "Unstructured": UnstructuredPDFLoader
+}
+
+
+def _chunk(chunk_id: str, content: str, file_info: Dict, **metadata) -> Dict[str, Any]:
+    """构造统一格式的文本块"""
+    return {
+        "id": chunk_id,
+        "content": content,
+        "metadata": {
+            "source": file_info["name"],
+            "file_type": file_info["file_type"],
+            "file_format": file_info["type"],
+            **metadata
+        }
+    }
+
+
+def _result(file_info: Dict, chunks: List[Dict], **metadata) -> Dict[str, Any]:
+    """构造统一格式的解析结果"""
+    return {
+        "file_id": file_info["id"],
+        "original_name": file_info["name"],
+        "file_type": file_info["file_type"],
+        "file_format": file_info["type"],
+        "chunks": chunks,
+        "metadata": {
+            "total_chunks": len(chunks),
+            "processing_time": datetime.now().isoformat(),
+            "file_size": file_info.get("size"),
+            **metadata
+        }
+    }
+
+
+def _parse_excel(file_info: Dict) -> Dict[str, Any]:
+    """解析Excel文件，每一行作为一个文本块"""
+    sheets = pd.read_excel(file_info["file_path"], sheet_name=None)
+    chunks = []
+    columns = []
+
+    for sheet_name, df in sheets.items():
+        df = df.dropna(how="all")
+        columns = columns or [str(c) for c in df.columns]
+        for row_index, row in enumerate(df.itertuples(index=False)):
+            content = ", ".join(
+                f"{col}: {value}" for col, value in zip(df.columns, row) if pd.notna(value)
+            )
+            chunks.append(_chunk(
+                f"row_{len(chunks)}", content, file_info,
+                sheet=sheet_name, row_index=row_index, chunk_type="structured_data"
+            ))
+
+    return _result(file_info, chunks, columns=columns, sheets=list(sheets.keys()))
+
+
+def _parse_txt(file_info: Dict) -> Dict[str, Any]:
+    """解析TXT/CSV文件，CSV按行记录、TXT按非空行"""
+    file_path = file_info["file_path"]
+    chunks = []
+
+    if Path(file_path).suffix.lower() == ".csv":
+        for i, doc in enumerate(CSVLoader(file_path, encoding="utf-8").load()):
+            chunks.append(_chunk(
+                f"row_{i}", doc.page_content, file_info,
+                row_index=doc.metadata.get("row", i), chunk_type="structured_data"
+            ))
+    else:
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            for line_number, line in enumerate(f, start=1):
+                line = line.strip()
+                if line:
+                    chunks.append(_chunk(
+                        f"line_{len(chunks)}", line, file_info,
+                        line_number=line_number, chunk_type="text_line"
+                    ))
+
+    return _result(file_info, chunks)
+
+
+def _parse_markdown(file_info: Dict) -> Dict[str, Any]:
+    """解析Markdown文件，按标题切分章节"""
+    with open(file_info["file_path"], 'r', encoding='utf-8', errors='replace') as f:
+        text = f.read()
+
+    sections = [s for s in re.split(r"(?m)^(?=#{1,6}\s)", text) if s.strip()]
+    chunks = [
+        _chunk(
+            f"section_{i}", section.strip(), file_info,
+            section_index=i, chunk_type="markdown_section"
+        )
+        for i, section in enumerate(sections)
+    ]
+    return _result(file_info, chunks)
+
+
+def _parse_pdf(file_info: Dict) -> Dict[str, Any]:
+    """解析PDF文件，每页一个文本块"""
+    pdf_parser = file_info.get("pdf_parser") or "PyPDF"
+    loader_cls = PDF_LOADERS.get(pdf_parser)
+    if not loader_cls:
+        raise Exception(f"不支持的PDF解析器: {pdf_parser}")
+
+    chunks = []
+    for i, doc in enumerate(loader_cls(file_info["file_path"]).load()):
+        if not doc.page_content.strip():
+            continue
+        chunks.append(_chunk(
+            f"page_{i}", doc.page_content, file_info,
+            page_number=doc.metadata.get("page", i) + 1,
+            parser=pdf_parser, chunk_type="pdf_page"
+        ))
+
+    return _result(file_info, chunks, parser_used=pdf_parser)
+
+
+def _parse_word(file_info: Dict) -> Dict[str, Any]:
+    """解析Word文件，按段落切分"""
+    text = "\n\n".join(doc.page_content for doc in Docx2txtLoader(file_info["file_path"]).load())
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+    chunks = [
+        _chunk(
+            f"paragraph_{i}", paragraph, file_info,
+            paragraph_index=i, chunk_type="word_paragraph"
+        )
+        for i, paragraph in enumerate(paragraphs)
+    ]
+    return _result(file_info, chunks)
+
+
+PARSERS = {
+    ("structured", "excel"): _parse_excel,
+    ("structured", "txt"): _parse_txt,
+    ("semi-structured", "markdown"): _parse_markdown,
+    ("unstructured", "pdf"): _parse_pdf,
+    ("unstructured", "word"): _parse_word
+}
+
+
+def parse_document(file_info: Dict) -> Dict[str, Any]:
+    """
+    根据文件类型解析文件（在解析进程中执行）
+
+    未知的类型组合按纯文本处理。
+    """
+    parser = PARSERS.get((file_info["file_type"], file_info["type"]), _parse_txt)
+    return parser(file_info)
+
+
+def _register_worker(pids):
+    """解析进程启动时登记自己的 pid，进程池需要终止卡住的任务时使用"""
+    pids.put(os.getpid())
+
+
+class _WorkerPool:
+    """一个解析进程池及提交到其中的任务（task_id -> 是否已放弃等待）"""
+
+    def __init__(self, max_workers: int):
+        # spawn 避免从带线程的服务进程 fork 出子进程
+        context = multiprocessing.get_context("spawn")
+        self._pids = context.SimpleQueue()
+        self.executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=context,
+            initializer=_register_worker,
+            initargs=(self._pids,)
+        )
+        self.tasks: Dict[str, bool] = {}
+
+    def terminate(self):
+        """终止全部解析进程并关闭进程池"""
+        while not self._pids.empty():
+            try:
+                os.kill(self._pids.get(), signal.SIGTERM)
+            except (ProcessLookupError, PermissionError):
+                pass
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class DocumentParserPool:
+    """
+    有界的文档解析进程池
+
+    - 同时提交的解析任务不超过进程数，其余任务在事件循环中排队
+    - 单个文件超过 timeout 秒未完成视为超时
+    - 超时或取消正在运行的任务时，当前进程池退役，之后的任务提交到新进程池；
+      退役进程池中其他任务照常完成，等只剩被放弃的任务时才终止其进程
+    - 进程池异常（解析进程崩溃等）导致任务失败或被丢弃时，重新提交一次
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, timeout: Optional[float] = None,
+                 target: Optional[Callable[[Dict], Dict[str, Any]]] = None):
+        self.max_workers = max_workers or PARSE_WORKERS
+        self.timeout = timeout or PARSE_TIMEOUT
+        # 解析函数，必须是子进程可以导入的模块级函数
+        self.target = target or parse_document
+
+        self._pool: Optional[_WorkerPool] = None
+        self._retired: Set[_WorkerPool] = set()
+        self._slots = asyncio.Semaphore(self.max_workers)
+        self._pending: Set[str] = set()
+        self._cancel_events: Dict[str, asyncio.Event] = {}
+
+    def _current(self) -> _WorkerPool:
+        if self._pool is None:
+            self._pool = _WorkerPool(self.max_workers)
+        return self._pool
+
+    def _retire(self, pool: _WorkerPool):
+        """不再向该进程池提交新任务"""
+        if self._pool is pool:
+            self._pool = None
+            self._retired.add(pool)
+        self._reap(pool)
+
+    def _reap(self, pool: _WorkerPool):
+        """退役进程池中没有仍需等待的任务时终止它"""
+        if pool in self._retired and all(pool.tasks.values()):
+            self._retired.discard(pool)
+            pool.terminate()
+
+    def _finish(self, pool: _WorkerPool, task_id: str, abandoned: bool = False):
+        if abandoned:
+            pool.tasks[task_id] = True
+            self._retire(pool)
+        else:
+            pool.tasks.pop(task_id, None)
+            self._reap(pool)
+
+    async def parse(self, task_id: str, file_info: Dict) -> Dict[str, Any]:
+        """在进程池中解析文件"""
+        self._pending.add(task_id)
+        cancel_event = self._cancel_events[task_id] = asyncio.Event()
+        try:
+            async with self._slots:
+                for attempt in range(2):
+                    if cancel_event.is_set():
+                        raise Exception("文件解析已取消")
+
+                    pool = self._current()
+                    future = pool.executor.submit(self.target, file_info)
+                    pool.tasks[task_id] = False
+                    result = asyncio.wrap_future(future)
+                    cancelled = asyncio.ensure_future(cancel_event.wait())
+                    try:
+                        await asyncio.wait({result, cancelled}, timeout=self.timeout,
+                                           return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        cancelled.cancel()
+
+                    if not result.done():
+                        # 解析进程仍在运行：放弃等待，进程在其所在进程池退役后终止
+                        result.cancel()
+                        self._finish(pool, task_id, abandoned=True)
+                        if cancel_event.is_set():
+                            raise Exception("文件解析已取消")
+                        raise Exception(f"文件解析超时（{self.timeout}秒）")
+
+                    if future.cancelled() or isinstance(future.exception(), BrokenProcessPool):
+                        # 进程池损坏或关闭时丢弃了该任务，换一个进程池重新提交一次
+                        self._finish(pool, task_id)
+                        self._retire(pool)
+                        if attempt:
+                            raise Exception("文件解析进程异常退出")
+                        continue
+
+                    self._finish(pool, task_id)
+                    return future.result()
+        finally:
+            self._pending.discard(task_id)
+            self._cancel_events.pop(task_id, None)
+
+    def cancel(self, task_id: str) -> bool:
+        """取消排队中或正在解析的任务"""
+        if task_id not in self._pending:
+            return False
+        self._cancel_events[task_id].set()
+        return True
+
+    def shutdown(self):
+        """关闭进程池（退役进程池中被放弃的解析进程直接终止）"""
+        if self._pool is not None:
+            self._pool.executor.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        for pool in list(self._retired):
+            pool.terminate()
+        self._retired.clear()
@@ -0,0 +1,121 @@
+"""
+向量嵌入引擎模块
+基于sentence-transformers的本地CPU嵌入，模型在进程内常驻，输入按长度排序后分批编码
+"""
+
+import os
+import threading
+from typing import List, Dict, Optional
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from utils.embedding_cache import EmbeddingCache, get_embedding_cache, cache_key
+
+
+# 未指定模型时使用的默认嵌入模型（中文）
+DEFAULT_EMBED_MODEL = os.getenv("EMBED_MODEL", "BAAI/bge-small-zh-v1.5")
+
+
+class EmbeddingEngine:
+    """
+    嵌入引擎
+
+    - 每个模型只加载一次，之后所有请求复用同一个实例
+    - 输出向量为 float32 且已归一化，内积即余弦相似度
+    - 编码前先查嵌入缓存，只对未命中且去重后的文本调用模型
+    """
+
+    def __init__(self, device: str = "cpu", cache: Optional[EmbeddingCache] = None):
+        self.device = device
+        self.cache = cache
+        self._models: Dict[str, SentenceTransformer] = {}
+        self._lock = threading.Lock()
+
+    def get_model(self, model_name: str = None) -> SentenceTransformer:
+        """获取常驻模型，首次使用时加载"""
+        model_name = model_name or DEFAULT_EMBED_MODEL
+        model = self._models.get(model_name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(model_name)
+                if model is None:
+                    model = SentenceTransformer(model_name, device=self.device)
+                    self._models[model_name] = model
+        return model
+
+    def dimension(self, model_name: str = None) -> int:
+        """模型输出向量维度"""
+        return self.get_model(model_name).get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str], model_name: str = None, batch_size: int = 32) -> np.ndarray:
+        """
+        批量计算文本向量
+
+        命中缓存的文本直接取缓存；其余文本按归一化内容去重，
+        再按长度排序切批，同一批内长度相近，减少padding带来的无效计算；
+        结果按输入顺序返回。
+
+        Returns:
+            形状为 (len(texts), dimension) 的 float32 数组
+        """
+        model_name = model_name or DEFAULT_EMBED_MODEL
+        model = self.get_model(model_name)
+        embeddings = np.empty((len(texts), model.get_sentence_embedding_dimension()), dtype=np.float32)
+        if not texts:
+            return embeddings
+
+        cached = self.cache.get_many(model_name, texts) if self.cache else {}
+        for i, vector in cached.items():
+            embeddings[i] = vector
+
+        # 未命中的文本按缓存键去重：{键: [输入下标...]}
+        pending: Dict[str, List[int]] = {}
+        for i, text in enumerate(texts):
+            if i not in cached:
+                pending.setdefault(cache_key(model_name, text), []).append(i)
+        if not pending:
+            return embeddings
+
+        unique = [positions[0] for positions in pending.values()]
+        computed = self._encode(model, [texts[i] for i in unique], batch_size)
+        for vector, positions in zip(computed, pending.values()):
+            embeddings[positions] = vector
+
+        if self.cache:
+            self.cache.put_many(model_name, [texts[i] for i in unique], computed)
+        return embeddings
+
+    def embed_query(self, query: str, model_name: str = None) -> np.ndarray:
+        """计算单条查询的向量（经过缓存）"""
+        return self.embed([query], model_name, batch_size=1)[0]
+
+    @staticmethod
+    def _encode(model: SentenceTransformer, texts: List[str], batch_size: int) -> np.ndarray:
+        """按长度排序后分批编码"""
+        embeddings = np.empty((len(texts), model.get_sentence_embedding_dimension()), dtype=np.float32)
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        batch_size = max(int(batch_size), 1)
+        for i in range(0, len(order), batch_size):
+            batch = order[i:i + batch_size]
+            embeddings[batch] = model.encode(
+                [texts[j] for j in batch],
+                batch_size=len(batch),
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+        return embeddings
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_embedding_engine() -> EmbeddingEngine:
+    """获取进程内共享的嵌入引擎"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = EmbeddingEngine(cache=get_embedding_cache())
+        return _engine
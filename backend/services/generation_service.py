@@ -2,74 +2,188 @@
 生成服务模块
 """
 
-import json
+import os
+import time
 import uuid
+import hashlib
+import asyncio
+from contextlib import aclosing
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any
-import asyncio
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
+
+from services.answer_cache import SemanticAnswerCache
+from services.context_builder import build_context, citations
+from services.embedding_engine import get_embedding_engine
+from services.llm_backends import get_llm_backend
+from utils.metadata_store import get_metadata_store
+from utils.metrics import FIRST_TOKEN_LATENCY, STAGE_ITEMS, STAGE_LATENCY
+
+
+SYSTEM_PROMPT = "你是一个知识库问答助手，请根据提供的上下文信息回答用户的问题，上下文中没有的信息请说明无法确定。"
+USER_PROMPT_TEMPLATE = "上下文信息：\n{context}\n\n问题：{query}"
+
+# 模板变化后旧缓存自动失效
+PROMPT_TEMPLATE_HASH = hashlib.sha1((SYSTEM_PROMPT + USER_PROMPT_TEMPLATE).encode("utf-8")).hexdigest()[:12]
+
+# 语义回答缓存：条目数为 0 时关闭；相似度阈值为查询向量的余弦相似度
+GENERATION_CACHE_SIZE = int(os.getenv("GENERATION_CACHE_SIZE", 1024))
+GENERATION_CACHE_TTL = float(os.getenv("GENERATION_CACHE_TTL", 3600))
+GENERATION_CACHE_THRESHOLD = float(os.getenv("GENERATION_CACHE_THRESHOLD", 0.95))
+GENERATION_CACHE_EMBED_MODEL = os.getenv("GENERATION_CACHE_EMBED_MODEL") or None
 
 
 class GenerationService:
     def __init__(self):
         self.data_dir = Path("data")
         self.generation_history_path = self.data_dir / "generation_history.json"
-        
-        if not self.generation_history_path.exists():
-            self._save_generation_history([])
-    
-    def _load_generation_history(self) -> List[Dict]:
-        try:
-            with open(self.generation_history_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
-    
-    def _save_generation_history(self, history: List[Dict]):
-        with open(self.generation_history_path, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
-    
+
+        self.store = get_metadata_store()
+        self.store.migrate_json("generation_history", self.generation_history_path)
+
+        self.backend = get_llm_backend()
+        self.engine = get_embedding_engine()
+        self.answer_cache = SemanticAnswerCache(
+            GENERATION_CACHE_SIZE, GENERATION_CACHE_TTL, GENERATION_CACHE_THRESHOLD
+        ) if GENERATION_CACHE_SIZE > 0 else None
+
+    @staticmethod
+    def _build_messages(query: str, blocks: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """拼接提示词，blocks 为 build_context 组装好的上下文段"""
+        context_text = "\n\n".join(block["text"] for block in blocks) if blocks else "（无）"
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": USER_PROMPT_TEMPLATE.format(context=context_text, query=query)}
+        ]
+
+    def _cache_group(self, context: list, model: str) -> tuple:
+        """缓存分组键：后端、模型、模板和上下文分块集合（检索结果取分块ID，纯文本取内容摘要）"""
+        context_ids = set()
+        for item in context:
+            if isinstance(item, dict) and item.get("id"):
+                context_ids.add(str(item["id"]))
+            else:
+                text = item.get("content", "") if isinstance(item, dict) else str(item)
+                context_ids.add(hashlib.sha1(text.encode("utf-8")).hexdigest())
+        return self.backend.name, model, PROMPT_TEMPLATE_HASH, frozenset(context_ids)
+
     async def generate(self, query: str, context: list, model: str = "gpt-3.5-turbo") -> Dict[str, Any]:
-        """内容生成"""
+        """内容生成（等待完整回答后返回）"""
+        result = {}
+        async for event, data in self.generate_stream(query, context, model):
+            if event == "done":
+                result = data
+        return result
+
+    async def generate_stream(self, query: str, context: list,
+                              model: str = "gpt-3.5-turbo") -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        流式内容生成，逐个产出 (事件, 数据)：
+
+        - start：{generation_id, model}
+        - context：{citations, stats}，实际放入提示词的上下文段（引用编号、分块ID、来源）
+        - token：{content}，模型后端每输出一段产出一次
+        - done：完整结果，与 generate 的返回值相同，另含首字耗时、总耗时、是否命中缓存
+          和上下文组装统计（去重合并后按模型token预算装填，见 context_builder）
+
+        命中语义缓存时整段回答作为一个 token 事件返回。
+        调用方中途断开时仍会记录生成历史（status 为 cancelled）。
+        """
         generation_id = str(uuid.uuid4())
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        await asyncio.sleep(2)  # 模拟生成时间
-        
-        # 模拟生成结果
-        generated_content = f"""
-基于您的查询"{query}"和提供的上下文信息，我为您生成以下内容：
-
-根据检索到的相关信息，{query}的相关内容如下：
-
-1. 首先，从上下文中我们可以了解到相关的背景信息
-2. 其次，结合具体的需求和场景
-3. 最后，提供具体的解决方案和建议
-
-这个回答是基于{len(context)}个相关文档片段生成的，使用了{model}模型进行内容生成。
-        """.strip()
-        
-        generation_record = {
-            "id": generation_id,
-            "query": query,
-            "model": model,
-            "context_count": len(context),
-            "generation_time": current_time,
-            "content_length": len(generated_content)
-        }
-        
-        history = self._load_generation_history()
-        history.append(generation_record)
-        self._save_generation_history(history)
-        
-        return {
+        blocks, context_stats = await asyncio.to_thread(build_context, context, model)
+        messages = self._build_messages(query, blocks)
+        context_citations = citations(blocks)
+
+        started = time.perf_counter()
+        first_token_ms = None
+        pieces: List[str] = []
+        status = "cancelled"
+        cached: Optional[Dict[str, Any]] = None
+        cache_error: Optional[str] = None
+        group = query_embedding = None
+        try:
+            yield "start", {"generation_id": generation_id, "model": model}
+            yield "context", {"citations": context_citations, "stats": context_stats}
+
+            # 缓存只是加速手段：查询嵌入或查找失败时直接走模型后端，不影响生成
+            if self.answer_cache is not None:
+                try:
+                    group = self._cache_group(context, model)
+                    query_embedding = (await asyncio.to_thread(
+                        self.engine.embed, [query], GENERATION_CACHE_EMBED_MODEL
+                    ))[0]
+                    cached = self.answer_cache.get(group, query_embedding)
+                except Exception as e:
+                    cache_error = str(e)
+
+            if cached is not None:
+                first_token_ms = round((time.perf_counter() - started) * 1000, 2)
+                pieces.append(cached["content"])
+                yield "token", {"content": cached["content"]}
+            else:
+                # 调用方断开时立即关闭后端的流，共享客户端据此取消不再有人接收的上游调用
+                async with aclosing(self.backend.stream(messages, model)) as stream:
+                    async for delta in stream:
+                        if first_token_ms is None:
+                            first_token_ms = round((time.perf_counter() - started) * 1000, 2)
+                        pieces.append(delta)
+                        yield "token", {"content": delta}
+                if self.answer_cache is not None and query_embedding is not None:
+                    try:
+                        self.answer_cache.put(group, query_embedding, {"content": "".join(pieces), "query": query})
+                    except Exception as e:
+                        cache_error = str(e)
+            status = "success"
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            generated_content = "".join(pieces)
+            elapsed = time.perf_counter() - started
+            elapsed_ms = round(elapsed * 1000, 2)
+            STAGE_LATENCY.observe(elapsed, stage="generate", status=status)
+            STAGE_ITEMS.inc(stage="generate")
+            if first_token_ms is not None and cached is None:
+                FIRST_TOKEN_LATENCY.observe(first_token_ms / 1000, model=model)
+            generation_record = {
+                "id": generation_id,
+                "query": query,
+                "model": model,
+                "backend": self.backend.name,
+                "status": status,
+                "context_count": len(context),
+                "context_used": len(blocks),
+                "context_tokens": context_stats["context_tokens"],
+                "generation_time": current_time,
+                "content_length": len(generated_content),
+                "first_token_ms": first_token_ms,
+                "elapsed_ms": elapsed_ms,
+                "cache_hit": cached is not None,
+                "cache_error": cache_error
+            }
+            self.store.append("generation_history", generation_record)
+
+        yield "done", {
             "generation_id": generation_id,
             "query": query,
             "generated_content": generated_content,
             "model": model,
-            "context_used": len(context)
+            "context_used": len(blocks),
+            "context_stats": context_stats,
+            "citations": context_citations,
+            "first_token_ms": first_token_ms,
+            "elapsed_ms": elapsed_ms,
+            "cache_hit": cached is not None,
+            "cached_query": cached["query"] if cached else None,
+            "cache_similarity": cached["similarity"] if cached else None
         }
-    
-    async def get_generation_history(self) -> List[Dict[str, Any]]:
-        """获取生成历史"""
-        return self._load_generation_history()
+
+    def cache_stats(self) -> Optional[Dict[str, Any]]:
+        """语义回答缓存统计，缓存关闭时为 None"""
+        return self.answer_cache.stats() if self.answer_cache is not None else None
+
+    async def get_generation_history(self, offset: int = 0, limit: Optional[int] = None,
+                                     desc: bool = False) -> List[Dict[str, Any]]:
+        """获取生成历史（默认按创建顺序返回全部；limit 分页，desc 为 True 时从新到旧）"""
+        return self.store.list("generation_history", offset=offset, limit=limit, desc=desc)
@@ -0,0 +1,97 @@
+"""
+大模型后端模块
+生成服务通过统一的流式接口调用模型，按环境变量 LLM_BACKEND 选择后端：
+- mock：本地模拟后端，逐个片段输出固定格式的回答，用于开发和测试
+- openai：OpenAI 兼容接口（流式 chat completions），经共享客户端调用，见 llm_client
+"""
+
+import os
+import asyncio
+from abc import ABC, abstractmethod
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Optional
+
+from services.llm_client import get_llm_client
+
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "mock")
+
+# 模拟后端每个片段的输出间隔（秒）和片段长度（字符）
+MOCK_TOKEN_DELAY = float(os.getenv("MOCK_TOKEN_DELAY", 0.02))
+MOCK_TOKEN_CHARS = 2
+
+
+class LLMBackend(ABC):
+    """模型后端基类：stream 逐段产出回答文本"""
+
+    name = ""
+
+    @abstractmethod
+    def stream(self, messages: List[Dict[str, str]], model: str) -> AsyncIterator[str]:
+        """流式生成，逐段产出回答文本"""
+
+    async def complete(self, messages: List[Dict[str, str]], model: str) -> str:
+        """非流式调用：收集全部片段"""
+        async with aclosing(self.stream(messages, model)) as stream:
+            return "".join([delta async for delta in stream])
+
+
+class MockBackend(LLMBackend):
+    """模拟后端，不访问网络"""
+
+    name = "mock"
+
+    def __init__(self, token_delay: float = MOCK_TOKEN_DELAY):
+        self.token_delay = token_delay
+
+    @staticmethod
+    def _answer(messages: List[Dict[str, str]], model: str) -> str:
+        prompt = messages[-1]["content"] if messages else ""
+        preview = prompt.strip().splitlines()[-1][:50] if prompt.strip() else ""
+        return f"""
+基于您的请求"{preview}"和提供的上下文信息，我为您生成以下内容：
+
+1. 首先，从上下文中我们可以了解到相关的背景信息
+2. 其次，结合具体的需求和场景
+3. 最后，提供具体的解决方案和建议
+
+这个回答由模拟后端生成（提示词 {len(prompt)} 字），使用了{model}模型名称。
+        """.strip()
+
+    async def stream(self, messages: List[Dict[str, str]], model: str) -> AsyncIterator[str]:
+        answer = self._answer(messages, model)
+        for start in range(0, len(answer), MOCK_TOKEN_CHARS):
+            await asyncio.sleep(self.token_delay)
+            yield answer[start:start + MOCK_TOKEN_CHARS]
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    OpenAI 兼容接口（连接池、并发限制、请求合并和重试由共享客户端负责）
+
+    每次调用时获取共享客户端，不持有引用：close_llm_client 关闭后会按需重新创建。
+    """
+
+    name = "openai"
+
+    def stream(self, messages: List[Dict[str, str]], model: str) -> AsyncIterator[str]:
+        return get_llm_client().stream(messages, model)
+
+
+BACKEND_CLASSES = {
+    "mock": MockBackend,
+    "openai": OpenAIBackend
+}
+
+
+_backends: Dict[str, LLMBackend] = {}
+
+
+def get_llm_backend(name: Optional[str] = None) -> LLMBackend:
+    """获取（首次调用时创建）指定名称的后端，默认使用 LLM_BACKEND"""
+    name = (name or LLM_BACKEND).lower()
+    if name not in BACKEND_CLASSES:
+        raise Exception(f"不支持的模型后端: {name}，可选: {', '.join(BACKEND_CLASSES)}")
+    if name not in _backends:
+        _backends[name] = BACKEND_CLASSES[name]()
+    return _backends[name]
@@ -0,0 +1,226 @@
+"""
+大模型客户端模块
+所有请求共享一个 OpenAI 兼容客户端（LLM_BASE_URL 可指向任意兼容服务或本地桩服务）：
+- 共享的 httpx 连接池，复用 TCP/TLS 连接
+- 按模型限制并发请求数
+- 相同请求（模型 + 消息 + 参数）在途时合并为一次上游调用，结果分发给所有调用方；
+  所有调用方都断开后取消上游调用
+- 限流、超时、连接错误和 5xx 按指数退避加随机抖动重试
+"""
+
+import os
+import json
+import random
+import asyncio
+import hashlib
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+try:
+    import httpx
+    import openai
+    from openai import AsyncOpenAI
+except ImportError:
+    httpx = None
+    openai = None
+    AsyncOpenAI = None
+
+
+LLM_BASE_URL = os.getenv("LLM_BASE_URL") or None
+LLM_API_KEY = os.getenv("LLM_API_KEY") or os.getenv("OPENAI_API_KEY") or "EMPTY"
+
+# 每个模型的最大并发请求数；LLM_MODEL_CONCURRENCY 可按模型覆盖，如 {"gpt-4o": 4}
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+LLM_MODEL_CONCURRENCY: Dict[str, int] = json.loads(os.getenv("LLM_MODEL_CONCURRENCY", "{}"))
+
+# 连接池
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 64))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+
+# 重试：第 n 次等待 uniform(0, min(上限, 基数 * 2^n)) 秒
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_BACKOFF_BASE = 0.5
+LLM_BACKOFF_MAX = 8.0
+
+
+def _retryable_errors() -> tuple:
+    if openai is None:
+        return ()
+    return (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+
+class _SharedStream:
+    """
+    一次上游流式调用的共享结果
+
+    上游产出的片段追加到 pieces，每个订阅者从头回放已有片段并继续等待新片段，
+    所以后加入的相同请求也能拿到完整回答。
+    subscribers 为当前订阅者数，降为 0 时由客户端取消上游任务 task。
+    """
+
+    def __init__(self):
+        self.pieces: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Condition()
+
+    async def publish(self, piece: Optional[str] = None, done: bool = False,
+                      error: Optional[BaseException] = None):
+        async with self._changed:
+            if piece is not None:
+                self.pieces.append(piece)
+            self.done = self.done or done
+            self.error = error or self.error
+            self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: position < len(self.pieces) or self.done)
+                pieces = self.pieces[position:]
+                finished, error = self.done, self.error
+            for piece in pieces:
+                yield piece
+            position += len(pieces)
+            if finished and position >= len(self.pieces):
+                if error is not None:
+                    raise error
+                return
+
+
+class LLMClient:
+    """共享的异步大模型客户端（同一事件循环内使用）"""
+
+    def __init__(self, base_url: Optional[str] = LLM_BASE_URL, api_key: str = LLM_API_KEY):
+        if AsyncOpenAI is None:
+            raise Exception("大模型客户端需要 openai 库，请先安装")
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+            timeout=LLM_TIMEOUT
+        )
+        # 重试由本客户端统一处理，关闭 openai 库自带的重试
+        self.client = AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=self.http_client, max_retries=0)
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._inflight: Dict[str, _SharedStream] = {}
+        self._tasks = set()
+        self.stats = {"requests": 0, "upstream_calls": 0, "coalesced": 0, "retries": 0, "errors": 0, "cancelled": 0}
+
+    def _semaphore(self, model: str) -> asyncio.Semaphore:
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(LLM_MODEL_CONCURRENCY.get(model, LLM_MAX_CONCURRENCY))
+        return self._semaphores[model]
+
+    @staticmethod
+    def _request_key(model: str, messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+        payload = json.dumps({"model": model, "messages": messages, "params": params},
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def stream(self, messages: List[Dict[str, str]], model: str, **params) -> AsyncIterator[str]:
+        """
+        流式调用 chat completions，逐段产出回答文本
+
+        相同请求在途时不再发起上游调用，直接订阅在途请求的输出。
+        最后一个订阅者断开（如客户端关闭连接）时取消上游调用，不再占用并发名额。
+        """
+        self.stats["requests"] += 1
+        key = self._request_key(model, messages, params)
+        shared = self._inflight.get(key)
+        if shared is None:
+            shared = self._inflight[key] = _SharedStream()
+            # 上游调用放在独立任务中，个别订阅者断开不影响其他订阅者
+            shared.task = asyncio.create_task(self._run_upstream(key, shared, messages, model, params))
+            self._tasks.add(shared.task)
+            shared.task.add_done_callback(self._tasks.discard)
+        else:
+            self.stats["coalesced"] += 1
+
+        shared.subscribers += 1
+        try:
+            async for piece in shared.subscribe():
+                yield piece
+        finally:
+            shared.subscribers -= 1
+            if shared.subscribers == 0 and not shared.done:
+                # 新的相同请求不能再加入即将取消的调用
+                if self._inflight.get(key) is shared:
+                    del self._inflight[key]
+                self.stats["cancelled"] += 1
+                shared.task.cancel()
+
+    async def complete(self, messages: List[Dict[str, str]], model: str, **params) -> str:
+        """非流式调用，同样参与请求合并"""
+        async with aclosing(self.stream(messages, model, **params)) as stream:
+            return "".join([piece async for piece in stream])
+
+    async def _run_upstream(self, key: str, shared: _SharedStream, messages: List[Dict[str, str]],
+                            model: str, params: Dict[str, Any]):
+        try:
+            async with self._semaphore(model):
+                await self._stream_with_retry(shared, messages, model, params)
+            await shared.publish(done=True)
+        except Exception as e:
+            self.stats["errors"] += 1
+            await shared.publish(done=True, error=e)
+        finally:
+            if self._inflight.get(key) is shared:
+                del self._inflight[key]
+            if not shared.done:
+                # 被取消（订阅者全部断开或客户端关闭）时也发布结束，仍在等待的订阅者不会永久挂起
+                await shared.publish(done=True, error=Exception("大模型请求已取消"))
+
+    async def _stream_with_retry(self, shared: _SharedStream, messages: List[Dict[str, str]],
+                                 model: str, params: Dict[str, Any]):
+        """已经输出片段后不能重试（订阅者已收到部分内容），只在首个片段之前重试"""
+        attempt = 0
+        while True:
+            try:
+                self.stats["upstream_calls"] += 1
+                response = await self.client.chat.completions.create(
+                    model=model, messages=messages, stream=True, **params
+                )
+                async for chunk in response:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        await shared.publish(chunk.choices[0].delta.content)
+                return
+            except _retryable_errors():
+                if shared.pieces or attempt >= LLM_MAX_RETRIES:
+                    raise
+                self.stats["retries"] += 1
+                await asyncio.sleep(random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt)))
+                attempt += 1
+
+    async def close(self):
+        """取消在途的上游调用并关闭连接池"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.http_client.aclose()
+
+
+_client: Optional[LLMClient] = None
+
+
+def get_llm_client() -> LLMClient:
+    """获取（首次调用时创建）共享客户端"""
+    global _client
+    if _client is None:
+        _client = LLMClient()
+    return _client
+
+
+def llm_client_stats() -> Optional[Dict[str, int]]:
+    """共享客户端的请求统计，尚未创建时为 None"""
+    return dict(_client.stats) if _client is not None else None
+
+
+async def close_llm_client():
+    """关闭共享客户端的连接池（应用退出时调用）"""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
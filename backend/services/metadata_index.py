@@ -0,0 +1,169 @@
+"""
+元数据列式索引模块
+为集合中的每个向量（按索引标签）保存可过滤字段的取值编码，检索前先把过滤条件解析为标签子集
+"""
+
+import json
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterable
+
+import numpy as np
+
+
+# 可用于过滤的分块元数据字段
+FILTER_FIELDS = ("source", "page_number", "chunk_type", "file_type", "file_id")
+
+
+def _value_key(value: Any) -> str:
+    """字段取值统一转为字符串比较（页码 3 与 "3" 视为相同）"""
+    return str(value)
+
+
+class MetadataIndex:
+    """
+    列式元数据索引
+
+    每个字段保存：
+    - codes[label]：该向量的取值编号，-1 表示没有该字段
+    - order / offsets：按取值编号排序后的标签数组及每个取值的区间，
+      取某个值的全部标签只需一次切片，相当于每个取值一张位图
+    另外保存 seqs[label]：向量对应的分块 seq，用于关键词检索的预过滤。
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.values: Dict[str, List[str]] = {}
+        self.codes: Dict[str, np.ndarray] = {}
+        self.order: Dict[str, np.ndarray] = {}
+        self.offsets: Dict[str, np.ndarray] = {}
+        self.seqs = np.full(size, -1, dtype=np.int64)
+        self._lookup: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def build(cls, size: int, labeled_chunks: Iterable[tuple]) -> "MetadataIndex":
+        """
+        由 (标签, 分块) 序列构建
+
+        Args:
+            size: 标签总数（索引的 ids 长度）
+            labeled_chunks: (label, chunk) 迭代器，chunk 为分块存储返回的字典
+        """
+        index = cls(size)
+        lookups = {field: {} for field in FILTER_FIELDS}
+        codes = {field: np.full(size, -1, dtype=np.int32) for field in FILTER_FIELDS}
+
+        for label, chunk in labeled_chunks:
+            index.seqs[label] = chunk["seq"]
+            metadata = {**chunk["metadata"], "file_id": chunk["file_id"]}
+            for field in FILTER_FIELDS:
+                value = metadata.get(field)
+                if value is None:
+                    continue
+                key = _value_key(value)
+                code = lookups[field].get(key)
+                if code is None:
+                    code = lookups[field][key] = len(lookups[field])
+                codes[field][label] = code
+
+        for field in FILTER_FIELDS:
+            index.values[field] = list(lookups[field])
+            index.codes[field] = codes[field]
+            index._build_postings(field)
+        index._lookup = lookups
+        return index
+
+    def _build_postings(self, field: str):
+        codes = self.codes[field]
+        present = np.flatnonzero(codes >= 0)
+        self.order[field] = present[np.argsort(codes[present], kind="stable")]
+        counts = np.bincount(codes[present], minlength=len(self.values[field]))
+        self.offsets[field] = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def labels_for(self, field: str, value: Any) -> np.ndarray:
+        """某字段取某值的全部标签（已排序）"""
+        code = self._lookup[field].get(_value_key(value))
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        return self.order[field][self.offsets[field][code]:self.offsets[field][code + 1]]
+
+    def select(self, filters: Dict[str, Any]) -> np.ndarray:
+        """
+        把过滤条件解析为排序后的标签数组
+
+        filters 形如 {"source": ["a.pdf", "b.pdf"], "chunk_type": "text"}：
+        同一字段的多个取值为「或」，不同字段之间为「与」。
+        """
+        selected = None
+        field_sets = []
+        for field, values in filters.items():
+            if field not in FILTER_FIELDS:
+                raise ValueError(f"不支持的过滤字段: {field}，可选: {', '.join(FILTER_FIELDS)}")
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            # 同一字段不同取值的标签互不重叠，拼接后排序即为并集
+            field_sets.append(np.sort(np.concatenate(
+                [self.labels_for(field, value) for value in values] or [np.empty(0, dtype=np.int64)]
+            )))
+
+        # 从最小的集合开始求交集
+        for labels in sorted(field_sets, key=len):
+            selected = labels if selected is None else np.intersect1d(selected, labels, assume_unique=True)
+            if not len(selected):
+                break
+        return selected if selected is not None else np.arange(self.size, dtype=np.int64)
+
+    def mask(self, labels: np.ndarray) -> np.ndarray:
+        """标签数组转为布尔掩码"""
+        mask = np.zeros(self.size, dtype=bool)
+        mask[labels] = True
+        return mask
+
+    def save(self, path: Path):
+        path = Path(path)
+        with open(path / "metadata.json", 'w', encoding='utf-8') as f:
+            json.dump({"size": self.size, "values": self.values}, f, ensure_ascii=False)
+        np.save(path / "metadata_seqs.npy", self.seqs)
+        for i, field in enumerate(FILTER_FIELDS):
+            np.save(path / f"metadata_{i}_codes.npy", self.codes[field])
+            np.save(path / f"metadata_{i}_order.npy", self.order[field])
+            np.save(path / f"metadata_{i}_offsets.npy", self.offsets[field])
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["MetadataIndex"]:
+        """加载元数据索引，不存在时返回 None（旧版本集合）"""
+        path = Path(path)
+        if not (path / "metadata.json").exists():
+            return None
+        with open(path / "metadata.json", 'r', encoding='utf-8') as f:
+            header = json.load(f)
+
+        index = cls(0)
+        index.size = header["size"]
+        index.values = header["values"]
+        index.seqs = np.load(path / "metadata_seqs.npy", mmap_mode="r")
+        for i, field in enumerate(FILTER_FIELDS):
+            index.codes[field] = np.load(path / f"metadata_{i}_codes.npy", mmap_mode="r")
+            index.order[field] = np.load(path / f"metadata_{i}_order.npy", mmap_mode="r")
+            index.offsets[field] = np.load(path / f"metadata_{i}_offsets.npy")
+            index._lookup[field] = {value: code for code, value in enumerate(index.values.get(field, []))}
+        return index
+
+
+_loaded: Dict[str, Optional[MetadataIndex]] = {}
+_loaded_lock = threading.Lock()
+
+
+def load_metadata_index(path: Path) -> Optional[MetadataIndex]:
+    """加载元数据索引（进程内按目录缓存，索引版本目录写完后不再修改）"""
+    key = str(Path(path).resolve())
+    with _loaded_lock:
+        if key not in _loaded:
+            _loaded[key] = MetadataIndex.load(path)
+        return _loaded[key]
+
+
+def unload_metadata_index(path: Path):
+    """清除已删除版本目录的缓存"""
+    with _loaded_lock:
+        _loaded.pop(str(Path(path).resolve()), None)
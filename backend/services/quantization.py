@@ -0,0 +1,200 @@
+"""
+向量量化模块
+大集合的向量以压缩编码常驻内存做粗排，候选再从磁盘上的原始向量精排：
+- int8：逐维标量量化，每维 1 字节（float32 的 1/4）
+- pq：乘积量化，向量切成 m 段、每段用 256 个中心编码，每段 1 字节
+"""
+
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+
+# quantization 参数 -> 量化类型
+QUANTIZATION_ALIASES = {
+    "int8": "int8",
+    "sq8": "int8",
+    "scalar": "int8",
+    "pq": "pq",
+    "product": "pq"
+}
+
+# 训练量化器的采样数
+QUANT_TRAIN_SAMPLE = int(os.getenv("QUANT_TRAIN_SAMPLE", 50000))
+
+# PQ 分段数，为 0 时按每段 8 维自动选择（768 维 -> 96 段，每个向量 96 字节）
+PQ_M = int(os.getenv("PQ_M", 0))
+PQ_KSUB = 256
+PQ_TRAIN_ITERATIONS = 15
+
+# 编码批量打分时每批的行数（int8 解码为 float32 的临时内存约为 行数 x 维度 x 4 字节）
+QUANT_SCAN_BATCH = 16384
+
+
+def resolve_quantization(quantization: Optional[str]) -> Optional[str]:
+    """quantization 参数转换为量化类型，空值或 none 表示不量化"""
+    if not quantization or quantization.lower() == "none":
+        return None
+    kind = QUANTIZATION_ALIASES.get(quantization.lower())
+    if not kind:
+        raise ValueError(f"不支持的量化方式: {quantization}，可选: none, {', '.join(sorted(QUANTIZATION_ALIASES))}")
+    return kind
+
+
+class ScalarQuantizer:
+    """逐维 8 位标量量化：x ≈ vmin + code * scale"""
+
+    kind = "int8"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.vmin = np.zeros(dim, dtype=np.float32)
+        self.scale = np.ones(dim, dtype=np.float32)
+
+    @property
+    def code_size(self) -> int:
+        return self.dim
+
+    @property
+    def nbytes(self) -> int:
+        return self.vmin.nbytes + self.scale.nbytes
+
+    @property
+    def params(self) -> dict:
+        return {}
+
+    def train(self, samples: np.ndarray):
+        self.vmin = samples.min(axis=0).astype(np.float32)
+        scale = (samples.max(axis=0) - self.vmin) / 255.0
+        scale[scale == 0] = 1.0
+        self.scale = scale.astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((np.asarray(vectors, dtype=np.float32) - self.vmin) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def scores(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """查询与编码的近似内积：q·vmin + (q*scale)·code"""
+        return (queries * self.scale) @ codes.T.astype(np.float32) + (queries @ self.vmin)[:, None]
+
+    def save(self, path: Path):
+        np.savez(Path(path) / "quantizer.npz", vmin=self.vmin, scale=self.scale)
+
+    @classmethod
+    def load(cls, path: Path, dim: int, params: dict) -> "ScalarQuantizer":
+        quantizer = cls(dim)
+        with np.load(Path(path) / "quantizer.npz") as data:
+            quantizer.vmin, quantizer.scale = data["vmin"], data["scale"]
+        return quantizer
+
+
+def _pick_subspaces(dim: int, m: int) -> int:
+    """选择能整除维度的分段数"""
+    if m and dim % m == 0:
+        return m
+    target = max(1, dim // 8)
+    return max(d for d in range(1, target + 1) if dim % d == 0)
+
+
+def _kmeans_l2(samples: np.ndarray, k: int, iterations: int = PQ_TRAIN_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """欧氏距离 k-means，返回 (k, d) 聚类中心"""
+    rng = np.random.default_rng(seed)
+    centroids = samples[rng.choice(len(samples), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _nearest(samples, centroids)
+        counts = np.bincount(assign, minlength=k)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        ordered = samples[np.argsort(assign, kind="stable")]
+        centroids[nonempty] = np.add.reduceat(ordered, starts[nonempty], axis=0) / counts[nonempty, None]
+        # 空簇重新随机取一个样本作为中心
+        centroids[~nonempty] = samples[rng.choice(len(samples), int((~nonempty).sum()))]
+    return centroids
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """最近中心：argmin ||x-c||² = argmax (x·c - ||c||²/2)"""
+    half_norms = 0.5 * (centroids ** 2).sum(axis=1)
+    return np.argmax(vectors @ centroids.T - half_norms, axis=1)
+
+
+class ProductQuantizer:
+    """
+    乘积量化
+
+    向量切成 m 段，每段独立做 256 类 k-means，编码为每段的中心编号；
+    打分时每条查询先算出各段与全部中心的内积表，编码得分为 m 次查表之和。
+    """
+
+    kind = "pq"
+
+    def __init__(self, dim: int, m: int = PQ_M):
+        self.dim = dim
+        self.m = _pick_subspaces(dim, m)
+        self.dsub = dim // self.m
+        self.centroids = np.zeros((self.m, PQ_KSUB, self.dsub), dtype=np.float32)
+
+    @property
+    def code_size(self) -> int:
+        return self.m
+
+    @property
+    def nbytes(self) -> int:
+        return self.centroids.nbytes
+
+    @property
+    def params(self) -> dict:
+        return {"m": self.m}
+
+    def train(self, samples: np.ndarray):
+        ksub = min(PQ_KSUB, len(samples))
+        self.centroids = np.zeros((self.m, PQ_KSUB, self.dsub), dtype=np.float32)
+        for j in range(self.m):
+            part = np.ascontiguousarray(samples[:, j * self.dsub:(j + 1) * self.dsub])
+            self.centroids[j, :ksub] = _kmeans_l2(part, ksub, seed=j)
+        if ksub < PQ_KSUB:
+            # 样本不足 256 个时未用到的中心置为极远，编码时不会被选中
+            self.centroids[:, ksub:] = np.float32(1e6)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = _nearest(vectors[:, j * self.dsub:(j + 1) * self.dsub], self.centroids[j])
+        return codes
+
+    def scores(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """查表计算近似内积"""
+        # tables[q, j, c] = 第 q 条查询第 j 段与第 c 个中心的内积
+        tables = np.einsum("qjd,jcd->qjc", queries.reshape(len(queries), self.m, self.dsub), self.centroids)
+        out = np.zeros((len(queries), len(codes)), dtype=np.float32)
+        for j in range(self.m):
+            out += tables[:, j, codes[:, j]]
+        return out
+
+    def save(self, path: Path):
+        np.savez(Path(path) / "quantizer.npz", centroids=self.centroids)
+
+    @classmethod
+    def load(cls, path: Path, dim: int, params: dict) -> "ProductQuantizer":
+        quantizer = cls(dim, params.get("m", PQ_M))
+        with np.load(Path(path) / "quantizer.npz") as data:
+            quantizer.centroids = data["centroids"]
+        return quantizer
+
+
+QUANTIZER_CLASSES = {
+    "int8": ScalarQuantizer,
+    "pq": ProductQuantizer
+}
+
+
+def create_quantizer(kind: str, dim: int):
+    """创建未训练的量化器"""
+    return QUANTIZER_CLASSES[kind](dim)
+
+
+def load_quantizer(path: Path, kind: str, dim: int, params: dict):
+    return QUANTIZER_CLASSES[kind].load(path, dim, params)
@@ -0,0 +1,59 @@
+"""
+检索增强问答服务模块
+在同一进程内完成查询向量化、检索和生成：检索结果直接交给生成服务组装上下文，
+不再经过前端回传分块文本；回答附带引用的分块ID和来源。
+"""
+
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from services.generation_service import GenerationService
+from services.retrieval_service import RetrievalService
+
+
+class RAGService:
+    def __init__(self, retrieval_service: Optional[RetrievalService] = None,
+                 generation_service: Optional[GenerationService] = None):
+        # 与接口层共用同一组服务实例，检索缓存和回答缓存才能共享
+        self.retrieval = retrieval_service or RetrievalService()
+        self.generation = generation_service or GenerationService()
+
+    async def query_stream(self, query: str, top_k: int = 5, collection_name: Optional[str] = None,
+                           mode: str = "hybrid", filters: Optional[Dict[str, Any]] = None,
+                           model: str = "gpt-3.5-turbo") -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        流式问答，逐个产出 (事件, 数据)：
+
+        - retrieval：{search_id, collection, mode, result_count, elapsed_ms, cache_hit}，
+          elapsed_ms 含查询向量化与检索
+        - 之后依次为生成服务的 start / context / token / done 事件，
+          context 与 done 中的 citations 即回答引用的上下文段
+        """
+        started = time.perf_counter()
+        search = await self.retrieval.search(query, top_k, collection_name, mode, filters)
+        yield "retrieval", {
+            "search_id": search["search_id"],
+            "collection": search["collection"],
+            "mode": search["mode"],
+            "result_count": len(search["results"]),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+            "cache_hit": search["cache_hit"]
+        }
+
+        async for event, data in self.generation.generate_stream(query, search["results"], model):
+            if event == "done":
+                data = {**data, "search_id": search["search_id"],
+                        "total_ms": round((time.perf_counter() - started) * 1000, 2)}
+            yield event, data
+
+    async def query(self, query: str, top_k: int = 5, collection_name: Optional[str] = None,
+                    mode: str = "hybrid", filters: Optional[Dict[str, Any]] = None,
+                    model: str = "gpt-3.5-turbo") -> Dict[str, Any]:
+        """非流式问答：返回完整回答、引用和各阶段耗时"""
+        result: Dict[str, Any] = {}
+        async for event, data in self.query_stream(query, top_k, collection_name, mode, filters, model):
+            if event == "retrieval":
+                result["retrieval"] = data
+            elif event == "done":
+                result.update(data)
+        return result
@@ -1,70 +1,356 @@
 """
 检索服务模块
+查询向量化后在集合索引上取前k个最相似的分块，再从分块存储取回内容与元数据
 """
 
+import os
 import json
+import time
 import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import asyncio
 
+import numpy as np
+
+from services.bm25_index import get_bm25_index
+from services.embedding_engine import get_embedding_engine
+from services.vector_db_service import VectorDBService
+from utils.cache import get_cache, SEARCH_CACHE
+from utils.chunk_store import get_chunk_store
+from utils.embedding_cache import normalize_text
+from utils.metadata_store import get_metadata_store
+from utils.metrics import span, traced
+
+
+# 单次批量检索的查询条数上限
+BATCH_SEARCH_MAX = int(os.getenv("BATCH_SEARCH_MAX", 1000))
+
+# 查询向量化的批大小
+QUERY_EMBED_BATCH = 64
+
+# 检索模式：vector 仅向量、bm25 仅关键词、hybrid 两路结果做倒数排名融合
+SEARCH_MODES = ("vector", "bm25", "hybrid")
+
+# 检索结果缓存的条数上限与过期时间（秒）
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 2048))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", 300))
+
+# 元数据过滤后的子集不超过该数量时，直接在子集上精确检索（比在全集上带过滤的近似检索更快）
+FILTER_EXACT_MAX = int(os.getenv("FILTER_EXACT_MAX", 20000))
+
+# 倒数排名融合常数，以及混合检索时每一路取回的候选数倍数
+RRF_K = 60
+HYBRID_CANDIDATE_FACTOR = 4
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[tuple]:
+    """倒数排名融合：score = Σ 1 / (k + 名次)，返回 [(ID, 融合得分)]，按得分降序"""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            fused[item_id] = fused.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
 
 class RetrievalService:
     def __init__(self):
         self.data_dir = Path("data")
         self.search_history_path = self.data_dir / "search_history.json"
-        
-        if not self.search_history_path.exists():
-            self._save_search_history([])
-    
-    def _load_search_history(self) -> List[Dict]:
-        try:
-            with open(self.search_history_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
-    
-    def _save_search_history(self, history: List[Dict]):
-        with open(self.search_history_path, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
-    
-    async def search(self, query: str, top_k: int = 5) -> Dict[str, Any]:
-        """向量检索"""
+
+        self.store = get_metadata_store()
+        self.store.migrate_json("search_history", self.search_history_path)
+        self.store.create_index("vector_db_info", "status")
+
+        self.vector_db = VectorDBService()
+        self.chunk_store = get_chunk_store(self.data_dir / "chunks" / "chunk_store.db")
+        self.engine = get_embedding_engine()
+        self.bm25 = get_bm25_index(self.data_dir / "chunks" / "bm25_index.db")
+        # 检索结果缓存，键为 (集合ID, 集合版本, 模式, 过滤条件, 归一化查询, top_k)
+        self.cache = get_cache(SEARCH_CACHE, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+
+    @traced("search", items=lambda result: 1)
+    async def search(self, query: str, top_k: int = 5, collection_name: Optional[str] = None,
+                     mode: str = "hybrid", filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        检索
+
+        Args:
+            query: 查询文本
+            top_k: 返回结果数
+            collection_name: 集合名称或ID，为空时使用最近一次构建成功的集合
+            mode: vector 仅向量、bm25 仅关键词、hybrid 两路融合（分块没有关键词索引时退化为 vector）
+            filters: 元数据过滤条件，如 {"source": ["a.pdf"], "page_number": [1, 2]}，
+                同一字段多个取值为「或」、不同字段之间为「与」，在相似度计算之前生效
+
+        Returns:
+            检索结果，按相似度降序
+        """
+        if not query or not query.strip():
+            raise Exception("查询内容不能为空")
+        if top_k <= 0:
+            raise Exception("top_k 必须大于0")
+
+        collection = self._get_collection(collection_name)
+        mode = self._resolve_mode(mode, collection)
+        filters = self._check_filters(filters)
+        results, elapsed, cached = await self._cached_search([query], top_k, collection, mode, filters)
+
         search_id = str(uuid.uuid4())
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        await asyncio.sleep(1)
-        
-        # 模拟检索结果
-        results = [
-            {
-                "id": f"result_{i}",
-                "content": f"这是与查询'{query}'相关的第{i+1}个检索结果",
-                "score": 0.9 - i * 0.1,
-                "metadata": {"source": f"document_{i}.txt"}
-            }
-            for i in range(top_k)
-        ]
-        
-        search_record = {
+        self.store.append("search_history", {
             "id": search_id,
             "query": query,
             "top_k": top_k,
-            "search_time": current_time,
-            "results_count": len(results)
-        }
-        
-        history = self._load_search_history()
-        history.append(search_record)
-        self._save_search_history(history)
-        
+            "collection": collection["name"],
+            "mode": mode,
+            "filters": filters,
+            "search_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "elapsed_ms": elapsed,
+            "cache_hit": cached == 1,
+            "results_count": len(results[0])
+        })
+
         return {
             "search_id": search_id,
             "query": query,
-            "results": results
+            "collection": collection["name"],
+            "mode": mode,
+            "elapsed_ms": elapsed,
+            "cache_hit": cached == 1,
+            "results": results[0]
         }
-    
-    async def get_search_history(self) -> List[Dict[str, Any]]:
-        """获取检索历史"""
-        return self._load_search_history()
+
+    @traced("search_batch", items=lambda result: len(result["results"]))
+    async def search_batch(self, queries: List[str], top_k: int = 5, collection_name: Optional[str] = None,
+                           mode: str = "hybrid", filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        批量向量检索
+
+        所有查询一次性批量嵌入，与索引做一次矩阵-矩阵乘法，分块内容合并为一次查询取回，
+        整批只写一条检索历史。
+
+        Returns:
+            与 queries 顺序一致的每条查询的检索结果
+        """
+        if not queries:
+            raise Exception("查询列表不能为空")
+        if len(queries) > BATCH_SEARCH_MAX:
+            raise Exception(f"单次批量检索最多 {BATCH_SEARCH_MAX} 条查询")
+        if any(not q or not q.strip() for q in queries):
+            raise Exception("查询内容不能为空")
+        if top_k <= 0:
+            raise Exception("top_k 必须大于0")
+
+        collection = self._get_collection(collection_name)
+        mode = self._resolve_mode(mode, collection)
+        filters = self._check_filters(filters)
+        results, elapsed, cached = await self._cached_search(queries, top_k, collection, mode, filters)
+
+        search_id = str(uuid.uuid4())
+        self.store.append("search_history", {
+            "id": search_id,
+            "query": queries[0],
+            "queries_count": len(queries),
+            "top_k": top_k,
+            "collection": collection["name"],
+            "mode": mode,
+            "filters": filters,
+            "search_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "elapsed_ms": elapsed,
+            "cache_hits": cached,
+            "results_count": sum(len(r) for r in results)
+        })
+
+        return {
+            "search_id": search_id,
+            "collection": collection["name"],
+            "mode": mode,
+            "results": [
+                {"query": query, "results": query_results}
+                for query, query_results in zip(queries, results)
+            ]
+        }
+
+    def _get_collection(self, collection_name: Optional[str]) -> Dict[str, Any]:
+        """获取指定的或最近一次构建成功的集合"""
+        if collection_name:
+            collection = self.vector_db.get_collection(collection_name)
+            if not collection:
+                raise Exception(f"集合不存在: {collection_name}")
+        else:
+            found = self.store.find("vector_db_info", "status", "success", limit=1, desc=True)
+            if not found:
+                raise Exception("没有可用的向量集合，请先执行向量存储")
+            collection = found[0]
+        return collection
+
+    async def _cached_search(self, queries: List[str], top_k: int, collection: Dict[str, Any], mode: str,
+                             filters: Optional[Dict[str, Any]] = None):
+        """
+        先查检索结果缓存，只对未命中的查询执行检索
+
+        Returns:
+            (每条查询的结果列表, 耗时毫秒, 命中缓存的查询数)
+        """
+        started = time.perf_counter()
+        filter_key = json.dumps(filters, sort_keys=True, ensure_ascii=False) if filters else None
+        keys = [
+            (collection["id"], collection.get("version", 0), mode, filter_key, normalize_text(query), top_k)
+            for query in queries
+        ]
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+
+        if missing:
+            # 嵌入与矩阵运算都是CPU密集操作，放到线程中执行，不阻塞事件循环
+            computed, _ = await asyncio.to_thread(
+                self._search, [queries[i] for i in missing], top_k, collection, mode, filters
+            )
+            for i, result in zip(missing, computed):
+                results[i] = result
+                self.cache.put(keys[i], result)
+
+        elapsed = round((time.perf_counter() - started) * 1000, 2)
+        return results, elapsed, len(queries) - len(missing)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """检索结果缓存与查询向量缓存的命中统计"""
+        return {
+            "search": self.cache.stats(),
+            "embedding": self.engine.cache.stats() if self.engine.cache else None
+        }
+
+    @staticmethod
+    def _check_filters(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """校验过滤条件格式，空条件视为不过滤"""
+        if not filters:
+            return None
+        if not isinstance(filters, dict):
+            raise Exception("过滤条件必须是 {字段: 取值或取值列表} 形式的对象")
+        return filters
+
+    def _resolve_mode(self, mode: str, collection: Dict[str, Any]) -> str:
+        """校验检索模式；分块任务没有关键词索引时 hybrid 退化为 vector"""
+        if mode not in SEARCH_MODES:
+            raise Exception(f"不支持的检索模式: {mode}，可选: {', '.join(SEARCH_MODES)}")
+        if mode != "vector" and not self.bm25.has_run(collection["chunk_id"]):
+            if mode == "bm25":
+                raise Exception("该集合的分块结果没有关键词索引，请重新执行文本分块")
+            return "vector"
+        return mode
+
+    def _search(self, queries: List[str], top_k: int, collection: Dict[str, Any], mode: str = "vector",
+                filters: Optional[Dict[str, Any]] = None):
+        """查询向量化/关键词检索、融合、取回分块内容，返回 (每条查询的结果列表, 耗时毫秒)"""
+        started = time.perf_counter()
+        run_id = collection["chunk_id"]
+        depth = top_k if mode != "hybrid" else top_k * HYBRID_CANDIDATE_FACTOR
+        chunks: Dict[str, Dict] = {}
+
+        # 元数据过滤：先解析为向量标签子集，后续两路检索都只在子集内打分
+        metadata, allowed = None, None
+        if filters:
+            metadata = self.vector_db.get_metadata_index(collection)
+            try:
+                allowed = metadata.select(filters)
+            except ValueError as e:
+                raise Exception(str(e))
+            if not len(allowed):
+                return [[] for _ in queries], round((time.perf_counter() - started) * 1000, 2)
+
+        vector_hits = [[] for _ in queries]
+        if mode != "bm25":
+            index = self.vector_db.get_index(collection)
+            with span("search.embed") as record:
+                query_vectors = self.engine.embed(queries, collection.get("model"), batch_size=QUERY_EMBED_BATCH)
+                record.items = len(queries)
+            with span("search.vector"):
+                scores, labels = self._vector_search(index, query_vectors, depth, allowed, metadata)
+            vector_hits = [
+                [(chunk_id, float(score)) for chunk_id, score in zip(index.ids_for(row_labels), row_scores)
+                 if chunk_id is not None]
+                for row_scores, row_labels in zip(scores, labels)
+            ]
+
+        lexical_hits = [[] for _ in queries]
+        if mode != "vector":
+            allowed_seqs = np.sort(metadata.seqs[allowed]) if allowed is not None else None
+            with span("search.bm25"):
+                seq_hits = [self.bm25.search(run_id, query, depth, allowed_seqs) for query in queries]
+            by_seq = {chunk["seq"]: chunk for chunk in
+                      self.chunk_store.get_by_seq(run_id, [seq for row in seq_hits for seq, _ in row])}
+            chunks.update((chunk["id"], chunk) for chunk in by_seq.values())
+            lexical_hits = [
+                [(by_seq[seq]["id"], score) for seq, score in row if seq in by_seq]
+                for row in seq_hits
+            ]
+
+        if mode == "hybrid":
+            hits = []
+            for vector_row, lexical_row in zip(vector_hits, lexical_hits):
+                vector_scores, lexical_scores = dict(vector_row), dict(lexical_row)
+                fused = reciprocal_rank_fusion([[i for i, _ in vector_row], [i for i, _ in lexical_row]])
+                hits.append([
+                    (chunk_id, score, {"vector_score": vector_scores.get(chunk_id),
+                                       "bm25_score": lexical_scores.get(chunk_id)})
+                    for chunk_id, score in fused[:top_k]
+                ])
+        else:
+            hits = [[(chunk_id, score, None) for chunk_id, score in row[:top_k]]
+                    for row in (vector_hits if mode == "vector" else lexical_hits)]
+
+        missing = [hit[0] for row in hits for hit in row if hit[0] not in chunks]
+        with span("search.fetch"):
+            chunks.update((chunk["id"], chunk) for chunk in self.chunk_store.get_many(run_id, missing))
+        results = [self._format_results(row, chunks) for row in hits]
+        return results, round((time.perf_counter() - started) * 1000, 2)
+
+    @staticmethod
+    def _vector_search(index, query_vectors: np.ndarray, depth: int, allowed: Optional[np.ndarray], metadata):
+        """
+        向量检索，带过滤时：
+
+        - 子集较小（或 flat 索引下子集不超过全集的1/4）时，直接在子集上精确检索
+        - 否则把子集掩码传入索引，在打分/遍历时跳过子集外的向量；
+          近似索引凑不满结果的查询再退回子集精确检索，保证返回完整的k条
+        """
+        if allowed is None:
+            return index.search(query_vectors, depth)
+        if len(allowed) <= FILTER_EXACT_MAX or (index.index_type == "flat" and len(allowed) * 4 <= len(index.ids)):
+            return index.search_subset(query_vectors, allowed, depth)
+
+        scores, labels = index.search(query_vectors, depth, allowed=metadata.mask(allowed))
+        short = (labels >= 0).sum(axis=1) < min(depth, len(allowed))
+        if short.any():
+            scores[short], labels[short] = index.search_subset(query_vectors[short], allowed, depth)
+        return scores, labels
+
+    @staticmethod
+    def _format_results(hits: List[tuple], chunks: Dict[str, Dict]) -> List[Dict[str, Any]]:
+        """按 (分块ID, 得分, 分路得分) 组装结果，保持得分顺序"""
+        results = []
+        for chunk_id, score, component_scores in hits:
+            chunk = chunks.get(chunk_id)
+            if chunk is None:
+                continue
+            result = {
+                "id": chunk_id,
+                "content": chunk["content"],
+                "score": round(score, 4),
+                "metadata": {
+                    **chunk["metadata"],
+                    "file_id": chunk["file_id"],
+                    "start_pos": chunk["start_pos"],
+                    "end_pos": chunk["end_pos"]
+                }
+            }
+            if component_scores:
+                result.update({k: round(v, 4) if v is not None else None for k, v in component_scores.items()})
+            results.append(result)
+        return results
+
+    async def get_search_history(self, offset: int = 0, limit: Optional[int] = None,
+                                 desc: bool = False) -> List[Dict[str, Any]]:
+        """获取检索历史（默认按创建顺序返回全部；limit 分页，desc 为 True 时从新到旧）"""
+        return self.store.list("search_history", offset=offset, limit=limit, desc=desc)
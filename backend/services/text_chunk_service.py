@@ -3,13 +3,29 @@
 处理文本的分块操作
 """
 
+import os
 import json
 import uuid
+import hashlib
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional, Iterator, Set
 import asyncio
 
+from services.chunkers import chunk_text, chunk_text_by_tokens
+from services.bm25_index import get_bm25_index
+from utils.tokenizer import get_encoding
+from utils.chunk_store import get_chunk_store
+from utils.metadata_store import get_metadata_store
+from utils.metrics import traced
+
+
+# 分块结果每批写入存储的条数
+CHUNK_WRITE_BATCH = 500
+
+# 保留最近几次成功的分块任务（供下一次同参数分块复用），更早且没有被向量/集合引用的任务会被清理
+CHUNK_KEEP_RUNS = int(os.getenv("CHUNK_KEEP_RUNS", 3))
+
 
 class TextChunkService:
     def __init__(self):
@@ -17,80 +33,329 @@ class TextChunkService:
         self.chunks_dir = self.data_dir / "chunks"
         self.chunks_dir.mkdir(parents=True, exist_ok=True)
         
-        # 分块信息存储文件
+        # 分块信息存储（旧版 chunk_info.json 首次启动时迁移）
         self.chunk_info_path = self.data_dir / "chunk_info.json"
+        self.store = get_metadata_store()
+        self.store.migrate_json("chunk_info", self.chunk_info_path)
+        self.store.create_index("chunk_info", "method")
+        self.store.create_index("file_info", "status")
         
-        if not self.chunk_info_path.exists():
-            self._save_chunk_info([])
+        # 分块内容存储（data/chunks/chunk_store.db）
+        self.chunk_store = get_chunk_store(self.chunks_dir / "chunk_store.db")
+        # BM25 倒排索引（data/chunks/bm25_index.db），随分块增量构建
+        self.bm25 = get_bm25_index(self.chunks_dir / "bm25_index.db")
     
-    def _load_chunk_info(self) -> List[Dict]:
-        """加载分块信息"""
-        try:
-            with open(self.chunk_info_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
-    
-    def _save_chunk_info(self, chunk_info: List[Dict]):
-        """保存分块信息"""
-        with open(self.chunk_info_path, 'w', encoding='utf-8') as f:
-            json.dump(chunk_info, f, ensure_ascii=False, indent=2)
-    
-    async def process_chunk(self, chunk_method: str, chunk_size: int, overlap_size: int) -> Dict[str, Any]:
+    @traced("process_chunk", items=lambda result: result["total_chunks"])
+    async def process_chunk(self, chunk_method: str, chunk_size: int, overlap_size: int,
+                            chunk_unit: str = "char", encoding_model: str = "gpt-3.5-turbo",
+                            progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
         """
         处理文本分块
         
+        读取所有处理成功文件的 data/processed/*.json，逐页/逐章节分块，
+        分块结果按批写入分块存储，chunk_info 中只保存统计信息。
+        
         Args:
             chunk_method: 分块方法 (fixed, semantic, sentence, paragraph)
             chunk_size: 块大小
             overlap_size: 重叠大小
+            chunk_unit: 大小的计量单位 (char 字符数, token 按 encoding_model 的tokenizer计数)
+            encoding_model: token 模式下使用的模型编码，通常与生成模型一致
+            progress: 进度回调 progress(已完成数, 总数)，由任务队列传入
         
         Returns:
             分块结果
         """
-        # 模拟分块处理
+        # 提前校验分块参数，避免登记一条必然失败的任务
+        chunk_text("", chunk_method, chunk_size, overlap_size)
+        if chunk_unit not in ("char", "token"):
+            raise Exception(f"不支持的分块单位: {chunk_unit}")
+        if chunk_unit == "char":
+            encoding_model = None
+        
         chunk_id = str(uuid.uuid4())
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        # 模拟处理延迟
-        await asyncio.sleep(1)
-        
-        # 模拟分块结果
-        chunk_result = {
-            "id": chunk_id,
+        files = self.store.find("file_info", "status", "success")
+        params = {
             "method": chunk_method,
             "chunk_size": chunk_size,
             "overlap_size": overlap_size,
+            "chunk_unit": chunk_unit,
+            "encoding_model": encoding_model
+        }
+        previous = self._find_previous_run(params)
+        
+        chunk_info = {
+            "id": chunk_id,
+            **params,
             "process_time": current_time,
-            "status": "success",
-            "total_chunks": 15,
-            "chunks": [
-                {
-                    "id": f"chunk_{i}",
-                    "content": f"这是使用{chunk_method}方法生成的第{i+1}个文本块，大小约为{chunk_size}字符。",
-                    "start_pos": i * (chunk_size - overlap_size),
-                    "end_pos": (i + 1) * chunk_size - overlap_size,
-                    "size": len(f"这是使用{chunk_method}方法生成的第{i+1}个文本块，大小约为{chunk_size}字符。")
-                }
-                for i in range(15)
-            ]
+            "status": "processing",
+            "total_chunks": 0,
+            "file_count": len(files)
         }
+        self.store.append("chunk_info", chunk_info)
+        
+        try:
+            # 分块是纯CPU计算，放到线程中执行
+            stats = await asyncio.to_thread(
+                self._run_chunking, chunk_id, files, params, previous, progress
+            )
+        except Exception as e:
+            self.chunk_store.delete_run(chunk_id)
+            self.bm25.delete_run(chunk_id)
+            self.store.update("chunk_info", chunk_id, {"status": "error", "error_message": str(e)})
+            raise Exception(f"文本分块失败: {str(e)}")
         
-        # 保存分块信息
-        chunk_info_list = self._load_chunk_info()
-        chunk_info_list.append(chunk_result)
-        self._save_chunk_info(chunk_info_list)
+        self.store.update("chunk_info", chunk_id, {"status": "success", **stats})
+        # 每次分块都会写入全部分块（含复用的文件），清理不再需要的旧任务，避免分块库无限增长
+        await asyncio.to_thread(self.purge_runs)
         
         return {
             "chunk_id": chunk_id,
             "status": "success",
             "message": "文本分块成功",
-            "total_chunks": 15
+            "total_chunks": stats["total_chunks"],
+            "reused_files": stats["reused_files"],
+            "reused_sections": stats["reused_sections"]
         }
     
-    async def get_chunk_list(self) -> List[Dict[str, Any]]:
-        """获取分块列表"""
-        chunk_info_list = self._load_chunk_info()
+    def _referenced_runs(self) -> Set[str]:
+        """被向量嵌入任务或向量集合引用的分块任务"""
+        runs = {info.get("chunk_id") for info in self.store.list("vector_info")}
+        runs.update(info.get("chunk_id") for info in self.store.list("vector_db_info"))
+        return runs
+    
+    def _delete_run_data(self, chunk_id: str):
+        self.chunk_store.delete_run(chunk_id)
+        self.bm25.delete_run(chunk_id)
+    
+    def purge_runs(self) -> List[str]:
+        """
+        清理旧分块任务的分块和关键词索引
+        
+        保留最近 CHUNK_KEEP_RUNS 次成功的任务和所有被引用的任务；
+        被清理的任务记录保留，状态改为 purged（不再被复用，也不能再用于嵌入）。
+        """
+        referenced = self._referenced_runs()
+        kept = 0
+        purged = []
+        for chunk_info in self.store.list("chunk_info", desc=True):
+            if chunk_info["status"] != "success":
+                continue
+            if kept < CHUNK_KEEP_RUNS:
+                kept += 1
+                continue
+            if chunk_info["id"] in referenced:
+                continue
+            self._delete_run_data(chunk_info["id"])
+            self.store.update("chunk_info", chunk_info["id"], {
+                "status": "purged",
+                "purge_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            })
+            purged.append(chunk_info["id"])
+        return purged
+    
+    async def delete_chunk_run(self, chunk_id: str) -> Dict[str, Any]:
+        """删除一次分块任务（被向量或集合引用、或仍在处理中的任务不能删除）"""
+        chunk_info = self.store.get("chunk_info", chunk_id)
+        if not chunk_info:
+            raise Exception(f"分块任务不存在: {chunk_id}")
+        if chunk_info["status"] == "processing":
+            raise Exception(f"分块任务仍在处理中: {chunk_id}")
+        if chunk_id in self._referenced_runs():
+            raise Exception(f"分块任务已被向量嵌入或向量集合使用，不能删除: {chunk_id}")
+        
+        await asyncio.to_thread(self._delete_run_data, chunk_id)
+        self.store.delete("chunk_info", chunk_id)
+        
+        return {
+            "chunk_id": chunk_id,
+            "message": "分块任务删除成功"
+        }
+    
+    def _find_previous_run(self, params: Dict[str, Any]) -> Optional[Dict]:
+        """查找参数相同的最近一次成功分块任务"""
+        for chunk_info in self.store.find("chunk_info", "method", params["method"], desc=True):
+            same_params = all(chunk_info.get(k, "char" if k == "chunk_unit" else None) == v
+                              for k, v in params.items())
+            if same_params and chunk_info["status"] == "success" and chunk_info.get("file_hashes"):
+                return chunk_info
+        return None
+    
+    def _run_chunking(self, run_id: str, files: List[Dict], params: Dict[str, Any],
+                      previous: Optional[Dict], progress: Optional[Callable[[int, int], None]]) -> Dict[str, Any]:
+        """
+        逐文件分块并增量写入分块存储
+        
+        内容哈希与上一次同参数分块时相同的文件直接复制旧分块，不再重新读取和切分；
+        文件有变化时，内容未变的页/章节复用上一次的分块，只切分变化的页/章节。
+        每批分块写入存储的同时写入 BM25 索引。
+        """
+        previous_hashes = previous.get("file_hashes", {}) if previous else {}
+        file_hashes = {}
+        reused_files = reused_sections = 0
+        seq = 0
+        buffer = []
+        lexical = self.bm25.writer(run_id)
+        
+        def write(chunks):
+            self.chunk_store.add_many(run_id, chunks)
+            lexical.add(chunks)
+        
+        for i, file_info in enumerate(files):
+            file_hashes[file_info["id"]] = file_info.get("content_hash")
+            
+            if file_info.get("content_hash") and previous_hashes.get(file_info["id"]) == file_info["content_hash"]:
+                if buffer:
+                    write(buffer)
+                    buffer = []
+                copied = self.chunk_store.copy_file_chunks(previous["id"], run_id, file_info["id"], seq)
+                if copied:
+                    # 复制的分块没有经过切分流程，从存储读回后补建索引
+                    for chunks in self.chunk_store.iter_chunks(run_id, CHUNK_WRITE_BATCH, start_seq=seq):
+                        lexical.add([c for c in chunks if c["seq"] < seq + copied])
+                        if chunks[-1]["seq"] >= seq + copied - 1:
+                            break
+                    seq += copied
+                    reused_files += 1
+                    if progress:
+                        progress(i + 1, len(files))
+                    continue
+            
+            reusable = self._previous_sections(previous["id"], file_info["id"]) if previous_hashes else {}
+            for chunk in self._iter_file_chunks(file_info, params, reusable):
+                if chunk.pop("reused", False) and chunk["metadata"]["chunk_index"] == 0:
+                    reused_sections += 1
+                chunk["seq"] = seq
+                seq += 1
+                buffer.append(chunk)
+                if len(buffer) >= CHUNK_WRITE_BATCH:
+                    write(buffer)
+                    buffer = []
+            
+            if progress:
+                progress(i + 1, len(files))
+        
+        if buffer:
+            write(buffer)
+        lexical_stats = lexical.close()
+        
+        return {
+            "total_chunks": seq,
+            "reused_files": reused_files,
+            "reused_sections": reused_sections,
+            "file_hashes": file_hashes,
+            **lexical_stats
+        }
+    
+    def _previous_sections(self, previous_run_id: str, file_id: str) -> Dict[tuple, List[Dict[str, Any]]]:
+        """
+        上一次分块中某文件的分块，按 (章节内容哈希, 同内容章节的出现序号) 分组
+        
+        与 _iter_file_chunks 生成分块ID时使用的键一致。
+        """
+        sections: Dict[tuple, List[Dict[str, Any]]] = {}
+        occurrences: Dict[str, int] = {}
+        current = None
+        for chunk in self.chunk_store.get_file_chunks(previous_run_id, file_id):
+            section = (chunk["section_hash"], chunk["metadata"].get("section_id"))
+            if section != current:
+                current = section
+                occurrence = occurrences.get(chunk["section_hash"], 0)
+                occurrences[chunk["section_hash"]] = occurrence + 1
+                sections[(chunk["section_hash"], occurrence)] = []
+            sections[(chunk["section_hash"], occurrence)].append(chunk)
+        return sections
+    
+    def _iter_file_chunks(self, file_info: Dict, params: Dict[str, Any],
+                          reusable: Optional[Dict[tuple, List[Dict[str, Any]]]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        对单个文件逐页/逐章节分块
+        
+        start_pos/end_pos 是分块在所属页/章节文本中的字符偏移；
+        分块ID由文件、章节内容哈希、分块参数和序号决定，内容不变时ID也不变。
+        导入时未标记 changed 的页/章节若在 reusable（上一次分块的结果）中，直接复用其分块，
+        只更新页码等章节元数据，复用的分块带 reused=True。
+        token 模式下整个文件的页/章节一次批量编码，切分只在token下标上进行。
+        """
+        with open(file_info["processed_data_path"], 'r', encoding='utf-8') as f:
+            processed_data = json.load(f)
+        
+        sections = processed_data.get("chunks", [])
+        method, size, overlap = params["method"], params["chunk_size"], params["overlap_size"]
+        param_key = ":".join(str(params[k]) for k in ("method", "chunk_size", "overlap_size", "chunk_unit", "encoding_model"))
+        reusable = reusable or {}
+        
+        occurrences = {}
+        keys = []
+        for section in sections:
+            section_hash = section.get("content_hash") or hashlib.sha256(section["content"].encode("utf-8")).hexdigest()
+            occurrence = occurrences.get(section_hash, 0)
+            occurrences[section_hash] = occurrence + 1
+            reuse = section.get("changed") is not True and (section_hash, occurrence) in reusable
+            keys.append((section_hash, occurrence, reuse))
+        
+        if params["chunk_unit"] == "token":
+            encoding = get_encoding(params["encoding_model"])
+            split = [i for i, key in enumerate(keys) if not key[2]]
+            token_lists = dict(zip(split, encoding.encode_ordinary_batch([sections[i]["content"] for i in split])))
+        
+        for i, section in enumerate(sections):
+            text = section["content"]
+            section_hash, occurrence, reuse = keys[i]
+            
+            if reuse:
+                for chunk in reusable[(section_hash, occurrence)]:
+                    metadata = {**chunk["metadata"], **section.get("metadata", {}), "section_id": section["id"]}
+                    yield {
+                        "id": chunk["id"],
+                        "file_id": file_info["id"],
+                        "section_hash": section_hash,
+                        "content": chunk["content"],
+                        "start_pos": chunk["start_pos"],
+                        "end_pos": chunk["end_pos"],
+                        "metadata": metadata,
+                        "reused": True
+                    }
+                continue
+            
+            if params["chunk_unit"] == "token":
+                spans = chunk_text_by_tokens(text, token_lists[i], encoding, method, size, overlap)
+            else:
+                spans = ((start, end, None) for start, end in chunk_text(text, method, size, overlap))
+            
+            for index, (start, end, token_count) in enumerate(spans):
+                key = f"{file_info['id']}:{section_hash}:{occurrence}:{param_key}:{index}"
+                metadata = {
+                    **section.get("metadata", {}),
+                    "section_id": section["id"],
+                    "chunk_index": index,
+                    "chunk_method": method
+                }
+                if token_count is not None:
+                    metadata["token_count"] = token_count
+                
+                yield {
+                    "id": hashlib.sha1(key.encode("utf-8")).hexdigest()[:24],
+                    "file_id": file_info["id"],
+                    "section_hash": section_hash,
+                    "content": text[start:end],
+                    "start_pos": start,
+                    "end_pos": end,
+                    "metadata": metadata
+                }
+    
+    async def get_chunks(self, chunk_id: str, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """分页查看某次分块任务的分块内容"""
+        if not self.store.get("chunk_info", chunk_id):
+            raise Exception(f"分块任务不存在: {chunk_id}")
+        return self.chunk_store.list_chunks(chunk_id, offset=offset, limit=limit)
+    
+    async def get_chunk_list(self, offset: int = 0, limit: Optional[int] = None,
+                             desc: bool = False) -> List[Dict[str, Any]]:
+        """获取分块列表（默认按创建顺序返回全部；limit 分页，desc 为 True 时从新到旧）"""
+        chunk_info_list = self.store.list("chunk_info", offset=offset, limit=limit, desc=desc)
         
         result = []
         for chunk_info in chunk_info_list:
@@ -99,7 +364,10 @@ class TextChunkService:
                 "method": chunk_info["method"],
                 "chunk_size": chunk_info["chunk_size"],
                 "overlap_size": chunk_info["overlap_size"],
+                "chunk_unit": chunk_info.get("chunk_unit", "char"),
                 "total_chunks": chunk_info["total_chunks"],
+                "file_count": chunk_info.get("file_count"),
+                "reused_files": chunk_info.get("reused_files"),
                 "process_time": chunk_info["process_time"],
                 "status": chunk_info["status"]
             })
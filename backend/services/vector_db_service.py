@@ -1,60 +1,312 @@
 """
 向量数据库服务模块
+把向量嵌入结果构建为可检索的索引集合，索引文件保存在 data/indexes/{集合ID}/v{版本}
 """
 
-import json
+import os
+import time
 import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional
 import asyncio
 
+import numpy as np
+
+from services.quantization import resolve_quantization
+from services.metadata_index import MetadataIndex, load_metadata_index, unload_metadata_index
+from services.vector_index import (
+    VectorIndex, resolve_index_type, create_index, read_index, load_index, remove_index
+)
+from utils.cache import get_cache, SEARCH_CACHE
+from utils.chunk_store import get_chunk_store
+from utils.metadata_store import get_metadata_store
+from utils.metrics import traced
+from utils.vector_store import open_vectors
+
+
+# 增量更新时新增向量超过该比例则重新训练 IVF 聚类
+IVF_REBUILD_RATIO = 0.5
+
+# 增量更新时每批写入索引的向量数
+INDEX_ADD_BATCH = 10000
+
+# 构建元数据索引时每批读取的分块数
+METADATA_READ_BATCH = 5000
+
+# 构建完成后评估 recall@k 的查询数与k
+RECALL_EVAL_QUERIES = int(os.getenv("RECALL_EVAL_QUERIES", 100))
+RECALL_EVAL_K = 10
+
+# recall 评估需要对全集合做精确检索：auto 时跳过未量化的 flat 索引（结果本身就是精确的）
+# 和超过 RECALL_EVAL_MAX_VECTORS 的集合；on 总是评估，off 从不评估
+RECALL_EVAL = os.getenv("RECALL_EVAL", "auto").lower()
+RECALL_EVAL_MAX_VECTORS = int(os.getenv("RECALL_EVAL_MAX_VECTORS", 200000))
+
+# 每个集合保留的索引版本数：其他进程可能仍在使用刚被替换的版本，旧目录延后到之后的构建再删除
+INDEX_KEEP_VERSIONS = max(int(os.getenv("INDEX_KEEP_VERSIONS", 2)), 2)
+
 
 class VectorDBService:
     def __init__(self):
         self.data_dir = Path("data")
+        self.indexes_dir = self.data_dir / "indexes"
+        self.indexes_dir.mkdir(parents=True, exist_ok=True)
         self.db_info_path = self.data_dir / "vector_db_info.json"
-        
-        if not self.db_info_path.exists():
-            self._save_db_info([])
-    
-    def _load_db_info(self) -> List[Dict]:
+
+        self.store = get_metadata_store()
+        self.store.migrate_json("vector_db_info", self.db_info_path)
+        self.store.create_index("vector_db_info", "name")
+        self.store.create_index("vector_info", "status")
+
+        self.chunk_store = get_chunk_store(self.data_dir / "chunks" / "chunk_store.db")
+
+    @traced("store_vectors", items=lambda result: result["vector_count"])
+    async def store_vectors(self, db_type: str, collection_name: str, vector_id: Optional[str] = None,
+                            quantization: Optional[str] = None,
+                            progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+        """
+        把向量存入索引集合
+
+        同名集合已存在时生成新版本：索引类型和嵌入模型不变则在旧索引上增删差异向量，
+        否则全量重建；新版本写完后才切换，检索在切换前继续使用旧版本。
+
+        Args:
+            db_type: 索引类型，flat/bruteforce、ivf/faiss、hnsw/chroma
+            collection_name: 集合名称
+            vector_id: 向量嵌入任务ID，为空时使用最近一次成功的嵌入任务
+            quantization: 量化方式（仅 flat / ivf）：none、int8、pq，量化后内存中只保留压缩编码，
+                候选用磁盘上的原始向量精排；结果中报告内存节省和 recall@k
+            progress: 进度回调 progress(已完成数, 总数)，由任务队列传入
+
+        Returns:
+            存储结果
+        """
         try:
-            with open(self.db_info_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
-    
-    def _save_db_info(self, db_info: List[Dict]):
-        with open(self.db_info_path, 'w', encoding='utf-8') as f:
-            json.dump(db_info, f, ensure_ascii=False, indent=2)
-    
-    async def store_vectors(self, db_type: str, collection_name: str) -> Dict[str, Any]:
-        """存储向量到数据库"""
-        collection_id = str(uuid.uuid4())
+            index_type = resolve_index_type(db_type)
+            quantization = resolve_quantization(quantization)
+        except ValueError as e:
+            raise Exception(str(e))
+        vector_info = self._get_vector_run(vector_id)
+
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        await asyncio.sleep(1)
-        
-        collection_result = {
-            "id": collection_id,
-            "name": collection_name,
+        existing = self.get_collection(collection_name)
+        if existing:
+            collection_id = existing["id"]
+        else:
+            collection_id = str(uuid.uuid4())
+            self.store.append("vector_db_info", {
+                "id": collection_id,
+                "name": collection_name,
+                "db_type": db_type,
+                "index_type": index_type,
+                "create_time": current_time,
+                "status": "processing",
+                "vector_count": 0,
+                "version": 0
+            })
+        # 版本号在元数据库中原子分配，并发构建同一集合时各自写入不同的目录
+        version = self.store.increment(
+            "vector_db_info", collection_id, "next_version", floor=existing.get("version", 0) if existing else 0
+        )
+        if version is None:
+            raise Exception("集合已被删除")
+
+        index_path = self.indexes_dir / collection_id / f"v{version}"
+        try:
+            stats = await asyncio.to_thread(
+                self._build_index, index_type, quantization, vector_info, existing, index_path, progress
+            )
+        except Exception as e:
+            remove_index(index_path)
+            current = self.store.get("vector_db_info", collection_id) or {}
+            if current.get("version", 0) > version:
+                # 构建期间更新的版本已切换，并可能清理了本次正在写入的目录；本次结果本来就会被丢弃
+                raise Exception(f"集合已切换到更新的版本 v{current['version']}，本次构建结果已丢弃")
+            if existing:
+                self.store.update("vector_db_info", collection_id, {"last_error": str(e)})
+            else:
+                self.store.update("vector_db_info", collection_id, {"status": "error", "error_message": str(e)})
+            raise Exception(f"向量存储失败: {str(e)}")
+
+        # 更晚开始的构建已经先完成切换时，不再用本次结果覆盖
+        current = self.store.get("vector_db_info", collection_id) or {}
+        if current.get("version", 0) > version:
+            remove_index(index_path)
+            raise Exception(f"集合已切换到更新的版本 v{current['version']}，本次构建结果已丢弃")
+
+        self.store.update("vector_db_info", collection_id, {
             "db_type": db_type,
-            "create_time": current_time,
+            "index_type": index_type,
+            "quantization": quantization,
             "status": "success",
-            "vector_count": 15
-        }
-        
-        db_info_list = self._load_db_info()
-        db_info_list.append(collection_result)
-        self._save_db_info(db_info_list)
-        
+            "version": version,
+            "index_path": str(index_path),
+            "vector_id": vector_info["id"],
+            "chunk_id": vector_info.get("chunk_id"),
+            "model": vector_info.get("model"),
+            "dimension": vector_info.get("dimension"),
+            "update_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "last_error": None,
+            **stats
+        })
+
+        # 检索缓存键中带有集合版本，其他进程的旧结果自然失效；本进程的旧条目直接清掉
+        get_cache(SEARCH_CACHE).invalidate(lambda key: key[0] == collection_id)
+
+        self._remove_old_versions(collection_id, version)
+
         return {
             "collection_id": collection_id,
             "status": "success",
-            "message": "向量存储成功"
+            "message": "向量存储成功",
+            "vector_count": stats["vector_count"],
+            "version": version,
+            "memory": stats["memory"],
+            "recall": stats["recall"]
         }
-    
-    async def get_collection_list(self) -> List[Dict[str, Any]]:
-        """获取集合列表"""
-        return self._load_db_info()
+
+    def _remove_old_versions(self, collection_id: str, version: int):
+        """
+        删除超出保留数的旧版本目录
+
+        刚被替换的版本仍保留：其他进程在看到新版本记录之前会继续从它加载索引。
+        只删除比当前版本更旧的目录，并发构建中的更高版本不受影响。
+        """
+        collection_dir = self.indexes_dir / collection_id
+        if not collection_dir.exists():
+            return
+        for path in collection_dir.iterdir():
+            if not path.name.startswith("v") or not path.name[1:].isdigit():
+                continue
+            if int(path.name[1:]) <= version - INDEX_KEEP_VERSIONS:
+                unload_metadata_index(path)
+                remove_index(path)
+
+    def _get_vector_run(self, vector_id: Optional[str]) -> Dict[str, Any]:
+        """获取指定的或最近一次成功的嵌入任务"""
+        if vector_id:
+            vector_info = self.store.get("vector_info", vector_id)
+        else:
+            runs = self.store.find("vector_info", "status", "success", limit=1, desc=True)
+            vector_info = runs[0] if runs else None
+
+        if not vector_info or vector_info["status"] != "success":
+            raise Exception("没有可用的向量结果，请先执行向量嵌入")
+        if not vector_info.get("vector_path") or not Path(vector_info["vector_path"] + ".json").exists():
+            raise Exception("向量文件不存在，请重新执行向量嵌入")
+        return vector_info
+
+    def _build_index(self, index_type: str, quantization: Optional[str], vector_info: Dict,
+                     existing: Optional[Dict], index_path: Path,
+                     progress: Optional[Callable[[int, int], None]]) -> Dict[str, Any]:
+        """构建（或增量更新）索引并保存到 index_path"""
+        started = time.monotonic()
+        vectors = open_vectors(Path(vector_info["vector_path"]))
+        if not vectors.count:
+            raise Exception("向量结果为空")
+
+        index = self._load_for_update(index_type, quantization, vector_info, existing)
+        added = deleted = 0
+        if index is not None:
+            new_ids = set(vectors.ids)
+            deleted = index.delete([i for i in index.ids if i not in new_ids])
+            rows = np.asarray([row for row, i in enumerate(vectors.ids) if index.label_of(i) is None], dtype=np.int64)
+            if index_type == "ivf" and len(rows) > IVF_REBUILD_RATIO * max(len(index), 1):
+                index = None
+            else:
+                for start in range(0, len(rows), INDEX_ADD_BATCH):
+                    batch = rows[start:start + INDEX_ADD_BATCH]
+                    index.add([vectors.ids[row] for row in batch], vectors.get_rows(batch))
+                    if progress:
+                        progress(start + len(batch), len(rows))
+                added = len(rows)
+
+        if index is None:
+            try:
+                index = create_index(index_type, vectors.dim, quantization)
+            except ValueError as e:
+                raise Exception(str(e))
+            index.build(vectors, progress)
+            added, deleted = vectors.count, 0
+
+        index.save(index_path)
+        self._build_metadata_index(index, vector_info["chunk_id"]).save(index_path)
+        elapsed = time.monotonic() - started
+        return {
+            "vector_count": len(index),
+            "added_vectors": added,
+            "deleted_vectors": deleted,
+            "build_seconds": round(elapsed, 2),
+            **self._quality_report(index)
+        }
+
+    @staticmethod
+    def _quality_report(index: VectorIndex) -> Dict[str, Any]:
+        """
+        内存占用与 recall@k（量化集合的精度损失；HNSW 为图检索的近似损失）
+
+        recall 评估要对全集合做精确检索，按 RECALL_EVAL 决定是否执行，跳过时 recall 中给出原因
+        """
+        report = {"memory": index.memory_report()}
+        if RECALL_EVAL == "off":
+            report["recall"] = {"skipped": "RECALL_EVAL=off"}
+        elif RECALL_EVAL != "on" and index.index_type == "flat" and index.quantization is None:
+            report["recall"] = {"skipped": "未量化的 flat 索引为精确检索"}
+        elif RECALL_EVAL != "on" and len(index) > RECALL_EVAL_MAX_VECTORS:
+            report["recall"] = {"skipped": f"集合超过 {RECALL_EVAL_MAX_VECTORS} 个向量，设置 RECALL_EVAL=on 强制评估"}
+        else:
+            report["recall"] = index.recall_report(RECALL_EVAL_K, RECALL_EVAL_QUERIES)
+        return report
+
+    def _build_metadata_index(self, index: VectorIndex, chunk_id: str) -> MetadataIndex:
+        """按索引标签顺序收集分块元数据，构建列式过滤索引"""
+        def labeled_chunks():
+            for chunks in self.chunk_store.iter_chunks(chunk_id, batch_size=METADATA_READ_BATCH):
+                for chunk in chunks:
+                    label = index.label_of(chunk["id"])
+                    if label is not None:
+                        yield label, chunk
+
+        return MetadataIndex.build(len(index.ids), labeled_chunks())
+
+    def _load_for_update(self, index_type: str, quantization: Optional[str], vector_info: Dict,
+                         existing: Optional[Dict]) -> Optional[VectorIndex]:
+        """旧索引可以增量更新时返回其独立副本，否则返回 None"""
+        if not existing or existing.get("status") != "success" or not existing.get("index_path"):
+            return None
+        if existing.get("index_type") != index_type or existing.get("model") != vector_info.get("model"):
+            return None
+        if existing.get("quantization") != quantization:
+            return None
+        if existing.get("dimension") != vector_info.get("dimension"):
+            return None
+        if not (Path(existing["index_path"]) / "index.json").exists():
+            return None
+        return read_index(Path(existing["index_path"]))
+
+    def get_collection(self, name_or_id: str) -> Optional[Dict[str, Any]]:
+        """按集合ID或名称查找集合"""
+        collection = self.store.get("vector_db_info", name_or_id)
+        if collection:
+            return collection
+        found = self.store.find("vector_db_info", "name", name_or_id, limit=1, desc=True)
+        return found[0] if found else None
+
+    def get_index(self, collection: Dict[str, Any]) -> VectorIndex:
+        """获取集合当前版本的索引（进程内缓存）"""
+        if collection.get("status") != "success" or not collection.get("index_path"):
+            raise Exception(f"集合 {collection.get('name')} 尚未构建索引")
+        return load_index(Path(collection["index_path"]))
+
+    def get_metadata_index(self, collection: Dict[str, Any]) -> MetadataIndex:
+        """获取集合当前版本的元数据过滤索引"""
+        metadata = load_metadata_index(Path(collection["index_path"])) if collection.get("index_path") else None
+        if metadata is None:
+            raise Exception(f"集合 {collection.get('name')} 没有元数据索引，请重新执行向量存储")
+        return metadata
+
+    async def get_collection_list(self, offset: int = 0, limit: Optional[int] = None,
+                                  desc: bool = False) -> List[Dict[str, Any]]:
+        """获取集合列表（默认按创建顺序返回全部；limit 分页，desc 为 True 时从新到旧）"""
+        return self.store.list("vector_db_info", offset=offset, limit=limit, desc=desc)
@@ -3,13 +3,23 @@
 处理文本的向量化操作
 """
 
-import json
+import time
 import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional
 import asyncio
 
+from services.embedding_engine import get_embedding_engine, DEFAULT_EMBED_MODEL
+from utils.chunk_store import get_chunk_store
+from utils.metadata_store import get_metadata_store
+from utils.metrics import traced
+from utils.vector_store import VectorWriter, SUPPORTED_DTYPES
+
+
+# 每次从分块存储读取的批次数，窗口内统一按长度排序
+EMBED_WINDOW_BATCHES = 16
+
 
 class VectorEmbedService:
     def __init__(self):
@@ -19,48 +29,119 @@ class VectorEmbedService:
         
         self.vector_info_path = self.data_dir / "vector_info.json"
         
-        if not self.vector_info_path.exists():
-            self._save_vector_info([])
-    
-    def _load_vector_info(self) -> List[Dict]:
-        try:
-            with open(self.vector_info_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
-    
-    def _save_vector_info(self, vector_info: List[Dict]):
-        with open(self.vector_info_path, 'w', encoding='utf-8') as f:
-            json.dump(vector_info, f, ensure_ascii=False, indent=2)
+        self.store = get_metadata_store()
+        self.store.migrate_json("vector_info", self.vector_info_path)
+        self.store.create_index("chunk_info", "status")
+        
+        self.chunk_store = get_chunk_store(self.data_dir / "chunks" / "chunk_store.db")
+        # 常驻的嵌入模型，跨请求复用
+        self.engine = get_embedding_engine()
     
-    async def process_embed(self, embed_model: str, batch_size: int) -> Dict[str, Any]:
-        """处理向量嵌入"""
+    @traced("process_embed", items=lambda result: result["total_vectors"])
+    async def process_embed(self, embed_model: str, batch_size: int, chunk_id: Optional[str] = None,
+                            vector_dtype: str = "float32",
+                            progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+        """
+        处理向量嵌入
+        
+        Args:
+            embed_model: sentence-transformers 模型名，为空时使用默认模型
+            batch_size: 每次送入模型的文本数
+            chunk_id: 分块任务ID，为空时使用最近一次成功的分块任务
+            vector_dtype: 向量落盘精度，float32 或 float16（体积减半）
+            progress: 进度回调 progress(已完成数, 总数)，由任务队列传入
+        
+        Returns:
+            嵌入结果
+        """
+        if vector_dtype not in SUPPORTED_DTYPES:
+            raise Exception(f"不支持的向量精度: {vector_dtype}")
+        chunk_info = self._get_chunk_run(chunk_id)
+        embed_model = embed_model or DEFAULT_EMBED_MODEL
+        
         vector_id = str(uuid.uuid4())
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        await asyncio.sleep(2)  # 模拟向量化处理时间
-        
         vector_result = {
             "id": vector_id,
             "model": embed_model,
             "batch_size": batch_size,
+            "chunk_id": chunk_info["id"],
+            "dtype": vector_dtype,
             "process_time": current_time,
-            "status": "success",
-            "total_vectors": 15,
-            "dimension": 768
+            "status": "processing",
+            "total_vectors": 0,
+            "dimension": None
         }
+        self.store.append("vector_info", vector_result)
         
-        vector_info_list = self._load_vector_info()
-        vector_info_list.append(vector_result)
-        self._save_vector_info(vector_info_list)
+        try:
+            stats = await asyncio.to_thread(
+                self._run_embedding, vector_id, chunk_info, embed_model, batch_size, vector_dtype, progress
+            )
+        except Exception as e:
+            self.store.update("vector_info", vector_id, {"status": "error", "error_message": str(e)})
+            raise Exception(f"向量嵌入失败: {str(e)}")
+        
+        self.store.update("vector_info", vector_id, {"status": "success", **stats})
         
         return {
             "vector_id": vector_id,
             "status": "success",
             "message": "向量嵌入成功",
-            "total_vectors": 15
+            "total_vectors": stats["total_vectors"]
+        }
+    
+    def _get_chunk_run(self, chunk_id: Optional[str]) -> Dict[str, Any]:
+        """获取指定的或最近一次成功的分块任务"""
+        if chunk_id:
+            chunk_info = self.store.get("chunk_info", chunk_id)
+        else:
+            runs = self.store.find("chunk_info", "status", "success", limit=1, desc=True)
+            chunk_info = runs[0] if runs else None
+        
+        if not chunk_info or chunk_info["status"] != "success":
+            raise Exception("没有可用的分块结果，请先执行文本分块")
+        return chunk_info
+    
+    def _run_embedding(self, vector_id: str, chunk_info: Dict, embed_model: str, batch_size: int,
+                       vector_dtype: str, progress: Optional[Callable[[int, int], None]]) -> Dict[str, Any]:
+        """
+        按分块顺序流式读取、嵌入并写入向量文件
+        
+        每次读取 batch_size * EMBED_WINDOW_BATCHES 条分块，在这个窗口内按长度排序后分批编码，
+        编码结果直接追加到 data/vectors/{vector_id}.vec，内存占用与分块总数无关；
+        向量行号与分块 seq 顺序一致。
+        """
+        started = time.monotonic()
+        total = chunk_info["total_chunks"]
+        window = max(batch_size, 1) * EMBED_WINDOW_BATCHES
+        
+        dimension = self.engine.dimension(embed_model)
+        vector_path = self.vectors_dir / vector_id
+        writer = VectorWriter(vector_path, dimension, vector_dtype)
+        try:
+            for chunks in self.chunk_store.iter_chunks(chunk_info["id"], batch_size=window):
+                vectors = self.engine.embed([c["content"] for c in chunks], embed_model, batch_size)
+                writer.append([c["id"] for c in chunks], vectors)
+                if progress:
+                    progress(writer.count, total)
+            header = writer.close()
+        except Exception:
+            writer.abort()
+            raise
+        
+        elapsed = time.monotonic() - started
+        return {
+            "total_vectors": header["count"],
+            "dimension": dimension,
+            "vector_path": str(vector_path),
+            "size_bytes": header["count"] * dimension * (2 if vector_dtype == "float16" else 4),
+            "elapsed_seconds": round(elapsed, 2),
+            "throughput": round(header["count"] / elapsed, 2) if elapsed > 0 else 0.0
         }
     
-    async def get_vector_list(self) -> List[Dict[str, Any]]:
-        """获取向量列表"""
-        return self._load_vector_info()
+    async def get_vector_list(self, offset: int = 0, limit: Optional[int] = None,
+                              desc: bool = False) -> List[Dict[str, Any]]:
+        """获取向量列表（默认按创建顺序返回全部；limit 分页，desc 为 True 时从新到旧）"""
+        return self.store.list("vector_info", offset=offset, limit=limit, desc=desc)
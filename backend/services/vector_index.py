@@ -0,0 +1,782 @@
+"""
+向量索引模块
+按 db_type 选择索引后端：精确暴力检索（flat）、倒排聚类（ivf）、HNSW 图索引（hnsw）
+向量均为归一化 float32，相似度为内积（即余弦相似度）
+flat / ivf 可选量化（int8 / pq）：压缩编码常驻内存做粗排，候选再用磁盘上的原始向量精排
+"""
+
+import os
+import json
+import itertools
+from abc import ABC, abstractmethod
+import shutil
+import threading
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple, Callable
+
+import numpy as np
+
+from services.quantization import QUANT_SCAN_BATCH, QUANT_TRAIN_SAMPLE, create_quantizer, load_quantizer
+from utils.vector_store import VectorFile, VectorWriter, open_vectors
+
+try:
+    # chromadb 依赖的 chroma-hnswlib 提供 hnswlib 模块
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+
+# db_type -> 索引类型
+INDEX_ALIASES = {
+    "flat": "flat",
+    "bruteforce": "flat",
+    "brute_force": "flat",
+    "ivf": "ivf",
+    "ivf_flat": "ivf",
+    "faiss": "ivf",
+    "hnsw": "hnsw",
+    "chroma": "hnsw",
+    "chromadb": "hnsw"
+}
+
+# IVF 参数：聚类数为 0 时按 sqrt(n) 自动选择
+IVF_NLIST = int(os.getenv("IVF_NLIST", 0))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 16))
+IVF_TRAIN_SAMPLE = int(os.getenv("IVF_TRAIN_SAMPLE", 100000))
+IVF_TRAIN_ITERATIONS = 10
+
+# HNSW 参数
+HNSW_M = int(os.getenv("HNSW_M", 16))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 200))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 64))
+
+# 全量扫描时每批参与矩阵乘法的行数，控制临时内存
+SCAN_BATCH = 65536
+
+# 暴力检索单批得分矩阵的元素上限：float32 向量文件可直接在映射上计算，
+# 单条查询时整个集合只做一次矩阵-向量乘法
+SCORE_BUDGET = 1 << 24
+
+# 量化索引粗排取 k x 该倍数个候选，再用原始向量精排
+QUANT_RERANK_FACTOR = int(os.getenv("QUANT_RERANK_FACTOR", 4))
+
+
+def resolve_index_type(db_type: str) -> str:
+    """db_type 转换为索引类型"""
+    index_type = INDEX_ALIASES.get((db_type or "").lower())
+    if not index_type:
+        raise ValueError(f"不支持的向量库类型: {db_type}，可选: {', '.join(sorted(INDEX_ALIASES))}")
+    return index_type
+
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """对 (nq, n) 得分矩阵逐行取前k，返回 (得分, 列下标)，按得分降序"""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=scores.dtype), np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    part = np.take_along_axis(scores, idx, axis=1)
+    order = np.argsort(-part, axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(idx, order, axis=1)
+
+
+def _merge(best: Tuple[np.ndarray, np.ndarray], scores: np.ndarray, labels: np.ndarray,
+           k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """把新一批候选并入当前前k"""
+    all_scores = np.concatenate([best[0], scores], axis=1)
+    all_labels = np.concatenate([best[1], labels], axis=1)
+    merged, idx = top_k(all_scores, k)
+    return merged, np.take_along_axis(all_labels, idx, axis=1)
+
+
+def _pad(scores: np.ndarray, labels: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """结果补齐到k列：不足的位置得分为 -inf、标签为 -1"""
+    out_scores = np.full((scores.shape[0], k), -np.inf, dtype=np.float32)
+    out_labels = np.full((scores.shape[0], k), -1, dtype=np.int64)
+    out_scores[:, :scores.shape[1]] = scores
+    out_labels[:, :labels.shape[1]] = labels
+    out_labels[~np.isfinite(out_scores)] = -1
+    return out_scores, out_labels
+
+
+class VectorIndex(ABC):
+    """
+    索引基类
+
+    每个向量有一个内部整数标签（label），ids[label] 为对应的分块ID；
+    删除只打标记，保存时由各后端决定是否压缩。
+    search 返回 (得分, 标签) 两个 (nq, k) 数组，标签为 -1 表示该位置无结果。
+    """
+
+    index_type = ""
+    # 量化器（仅 flat / ivf 支持），为 None 时直接用原始向量打分
+    quantizer = None
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.ids: List[str] = []
+        self.deleted = np.zeros(0, dtype=bool)
+        self.deleted_count = 0
+        self._labels: Optional[Dict[str, int]] = None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.ids) - self.deleted_count
+
+    @property
+    def params(self) -> Dict:
+        """保存到 index.json 的后端参数"""
+        return {}
+
+    def label_of(self, vector_id: str) -> Optional[int]:
+        """分块ID -> 标签（已删除的返回 None）"""
+        if self._labels is None:
+            self._labels = {vector_id: label for label, vector_id in enumerate(self.ids)}
+        label = self._labels.get(vector_id)
+        if label is None or self.deleted[label]:
+            return None
+        return label
+
+    def ids_for(self, labels: np.ndarray) -> List[Optional[str]]:
+        """标签 -> 分块ID，-1 对应 None"""
+        return [self.ids[label] if label >= 0 else None for label in labels]
+
+    def _register(self, ids: List[str]) -> np.ndarray:
+        """为新向量分配标签；ID已存在时旧向量标记删除（即更新）"""
+        self.delete(ids)
+        start = len(self.ids)
+        self.ids.extend(ids)
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(ids), dtype=bool)])
+        if self._labels is not None:
+            for offset, vector_id in enumerate(ids):
+                self._labels[vector_id] = start + offset
+        return np.arange(start, start + len(ids), dtype=np.int64)
+
+    def _live_mask(self, allowed: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """合并调用方的过滤掩码与删除标记，全部可用时返回 None"""
+        if allowed is None:
+            return ~self.deleted if self.deleted_count else None
+        return allowed & ~self.deleted if self.deleted_count else allowed
+
+    def delete(self, ids: List[str]) -> int:
+        """按分块ID删除，返回实际删除数"""
+        with self._lock:
+            labels = [label for label in (self.label_of(i) for i in ids) if label is not None]
+            if labels:
+                self.deleted[labels] = True
+                self.deleted_count += len(labels)
+                self._on_delete(np.asarray(labels, dtype=np.int64))
+            return len(labels)
+
+    def _on_delete(self, labels: np.ndarray):
+        pass
+
+    @abstractmethod
+    def _vectors(self, labels: np.ndarray) -> np.ndarray:
+        """按标签取向量（float32）"""
+
+    def search_subset(self, queries: np.ndarray, labels: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """只在给定标签子集上精确检索（已删除的标签会被跳过）"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        labels = np.asarray(labels, dtype=np.int64)
+        if self.deleted_count:
+            labels = labels[~self.deleted[labels]]
+        best = (np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64))
+        for start in range(0, len(labels), SCAN_BATCH):
+            batch = labels[start:start + SCAN_BATCH]
+            scores, idx = top_k(queries @ self._vectors(batch).T, k)
+            best = _merge(best, scores, batch[idx], k)
+        return _pad(best[0], best[1], k)
+
+    @abstractmethod
+    def build(self, vectors: VectorFile, progress: Optional[Callable[[int, int], None]] = None):
+        """从向量文件全量构建索引"""
+
+    @abstractmethod
+    def add(self, ids: List[str], vectors: np.ndarray):
+        """增量追加向量"""
+
+    @abstractmethod
+    def search(self, queries: np.ndarray, k: int,
+               allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """检索前k，allowed 为可选的标签过滤掩码"""
+
+    @abstractmethod
+    def save(self, path: Path):
+        """保存到索引目录"""
+
+    @abstractmethod
+    def _resident_bytes(self) -> int:
+        """检索时需要常驻内存的向量数据字节数"""
+
+    def memory_report(self) -> Dict:
+        """常驻内存的向量数据量与全精度 float32 的对比"""
+        full_bytes = len(self.ids) * self.dim * 4
+        resident = self._resident_bytes()
+        return {
+            "float32_bytes": full_bytes,
+            "resident_bytes": int(resident),
+            "compression_ratio": round(full_bytes / resident, 2) if resident else None
+        }
+
+    def recall_report(self, k: int = 10, sample: int = 100) -> Dict:
+        """
+        以集合内随机向量为查询，对比精确检索结果估计召回率：
+        recall 为本索引（含精排）的 recall@k，code_recall 为只用编码全量粗排、不精排的 recall@k
+        """
+        live = np.flatnonzero(~self.deleted)
+        if not len(live):
+            return {}
+        rng = np.random.default_rng(0)
+        queries = self._vectors(np.sort(rng.choice(live, min(sample, len(live)), replace=False)))
+        k = min(k, len(live))
+
+        _, exact = self.search_subset(queries, live, k)
+
+        def recall(labels: np.ndarray) -> float:
+            hits = sum(len(np.intersect1d(row, truth)) for row, truth in zip(labels, exact))
+            return round(hits / exact.size, 4)
+
+        report = {"k": k, "queries": len(queries), "recall": recall(self.search(queries, k)[1])}
+        if self.quantizer is not None:
+            report["code_recall"] = recall(self._scan_codes(queries, k, self._live_mask(None))[1])
+        return report
+
+    def _write_header(self, path: Path):
+        with open(path / "index.json", 'w', encoding='utf-8') as f:
+            json.dump({
+                "index_type": self.index_type,
+                "dim": self.dim,
+                "count": len(self),
+                "params": self.params,
+                "quantization": self.quantization
+            }, f)
+
+    @property
+    def quantization(self) -> Optional[Dict]:
+        """量化配置，未量化时为 None"""
+        return None
+
+
+class _StoredVectorsIndex(VectorIndex):
+    """
+    向量保存在内存映射文件中的索引（flat / ivf 共用）
+
+    base 为已落盘的向量文件，标签 [0, base.count) 对应文件行；
+    之后 add 的向量暂存在内存中，save 时与 base 合并并剔除已删除的行。
+    设置了 quantizer 时，codes[label] 为该向量的压缩编码，检索先在编码上粗排，
+    再只读取候选的原始向量精排，原始向量文件不需要常驻内存。
+    """
+
+    def __init__(self, dim: int, dtype: str = "float32"):
+        super().__init__(dim)
+        self.dtype = dtype
+        self.base: Optional[VectorFile] = None
+        self._delta: List[np.ndarray] = []
+        self._delta_matrix: Optional[np.ndarray] = None
+        self.quantizer = None
+        self.codes = np.empty((0, 0), dtype=np.uint8)
+
+    @property
+    def base_count(self) -> int:
+        return self.base.count if self.base is not None else 0
+
+    def _attach(self, vectors: VectorFile):
+        self.base = vectors
+        self.dtype = vectors.dtype
+        self.ids = list(vectors.ids)
+        self.deleted = np.zeros(len(self.ids), dtype=bool)
+        self.deleted_count = 0
+        self._labels = None
+        self._delta = []
+        self._delta_matrix = None
+
+    def _delta_vectors(self) -> np.ndarray:
+        if self._delta_matrix is None:
+            self._delta_matrix = np.vstack(self._delta) if self._delta else np.empty((0, self.dim), dtype=np.float32)
+        return self._delta_matrix
+
+    def _vectors(self, labels: np.ndarray) -> np.ndarray:
+        """按标签取向量（float32）"""
+        labels = np.asarray(labels, dtype=np.int64)
+        in_base = labels < self.base_count
+        if in_base.all():
+            return self.base.get_rows(labels)
+        out = np.empty((len(labels), self.dim), dtype=np.float32)
+        if in_base.any():
+            out[in_base] = self.base.get_rows(labels[in_base])
+        out[~in_base] = self._delta_vectors()[labels[~in_base] - self.base_count]
+        return out
+
+    def _append_delta(self, ids: List[str], vectors: np.ndarray) -> np.ndarray:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.shape != (len(ids), self.dim):
+            raise ValueError(f"向量形状 {vectors.shape} 与ID数量/维度不匹配")
+        labels = self._register(ids)
+        self._delta.append(vectors)
+        self._delta_matrix = None
+        if self.quantizer is not None:
+            self.codes = np.concatenate([self.codes, self.quantizer.encode(vectors)])
+        return labels
+
+    @property
+    def quantization(self) -> Optional[Dict]:
+        if self.quantizer is None:
+            return None
+        return {"kind": self.quantizer.kind, **self.quantizer.params}
+
+    def _train_quantizer(self, vectors: VectorFile, progress: Optional[Callable[[int, int], None]] = None):
+        """在采样向量上训练量化器，并为全部 base 向量编码"""
+        if self.quantizer is None:
+            return
+        n = vectors.count
+        rng = np.random.default_rng(0)
+        rows = np.sort(rng.choice(n, min(n, QUANT_TRAIN_SAMPLE), replace=False))
+        self.quantizer.train(vectors.get_rows(rows))
+
+        self.codes = np.empty((n, self.quantizer.code_size), dtype=np.uint8)
+        for start, block in vectors.iter_batches(SCAN_BATCH):
+            self.codes[start:start + len(block)] = self.quantizer.encode(block)
+            if progress:
+                progress(start + len(block), n)
+
+    def _scan_codes(self, queries: np.ndarray, k: int,
+                    mask: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """在全部编码上近似打分取前k"""
+        best = (np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64))
+        for start in range(0, len(self.codes), QUANT_SCAN_BATCH):
+            scores = self.quantizer.scores(queries, self.codes[start:start + QUANT_SCAN_BATCH])
+            if mask is not None:
+                scores[:, ~mask[start:start + scores.shape[1]]] = -np.inf
+            part, idx = top_k(scores, k)
+            best = _merge(best, part, idx + start, k)
+        return _pad(best[0], best[1], k)
+
+    def _rerank(self, queries: np.ndarray, candidates: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        用原始向量为粗排候选精确打分
+
+        candidates 为 (nq, depth) 标签矩阵（-1 为空位），所有查询的候选去重后
+        按标签顺序一次读取，读取量只与候选数有关。
+        """
+        unique = np.unique(candidates[candidates >= 0])
+        if not len(unique):
+            return _pad(np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64), k)
+        exact = queries @ self._vectors(unique).T
+        scores = np.take_along_axis(exact, np.searchsorted(unique, np.maximum(candidates, 0)), axis=1)
+        scores[candidates < 0] = -np.inf
+        scores, idx = top_k(scores, k)
+        return _pad(scores, np.take_along_axis(candidates, idx, axis=1), k)
+
+    def _save_codes(self, path: Path, order: np.ndarray) -> np.ndarray:
+        """按写出顺序保存编码和量化器，返回重排后的编码"""
+        if self.quantizer is None:
+            return self.codes
+        codes = self.codes[order]
+        np.save(path / "codes.npy", codes)
+        self.quantizer.save(path)
+        return codes
+
+    def _load_codes(self, path: Path, header: Dict):
+        """加载量化器和编码（编码读入内存，原始向量仍为内存映射）"""
+        quantization = header.get("quantization")
+        if quantization:
+            self.quantizer = load_quantizer(path, quantization["kind"], self.dim, quantization)
+            self.codes = np.load(path / "codes.npy")
+
+    def _resident_bytes(self) -> int:
+        if self.quantizer is None:
+            return self.base.nbytes if self.base is not None else 0
+        return self.codes.nbytes + self.quantizer.nbytes
+
+    def add(self, ids: List[str], vectors: np.ndarray):
+        with self._lock:
+            self._append_delta(ids, vectors)
+
+    def _storage_order(self) -> np.ndarray:
+        """保存时的行顺序（只含未删除的标签）"""
+        return np.flatnonzero(~self.deleted)
+
+    def _save_vectors(self, path: Path) -> np.ndarray:
+        """按 _storage_order 写出向量文件，返回写出的标签顺序"""
+        order = self._storage_order()
+        writer = VectorWriter(path / "vectors", self.dim, self.dtype)
+        try:
+            for start in range(0, len(order), SCAN_BATCH):
+                labels = order[start:start + SCAN_BATCH]
+                writer.append([self.ids[label] for label in labels], self._vectors(labels))
+            writer.close()
+        except Exception:
+            writer.abort()
+            raise
+        return order
+
+class FlatIndex(_StoredVectorsIndex):
+    """精确暴力检索：分批矩阵乘法 + argpartition"""
+
+    index_type = "flat"
+
+    def build(self, vectors: VectorFile, progress: Optional[Callable[[int, int], None]] = None):
+        with self._lock:
+            self._attach(vectors)
+            self._train_quantizer(vectors, progress)
+            if progress:
+                progress(vectors.count, vectors.count)
+
+    def search(self, queries: np.ndarray, k: int,
+               allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        mask = self._live_mask(allowed)
+        if self.quantizer is not None:
+            _, candidates = self._scan_codes(queries, k * QUANT_RERANK_FACTOR, mask)
+            return self._rerank(queries, candidates, k)
+
+        best = (np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64))
+
+        blocks = iter(())
+        if self.base is not None:
+            # float16 需要逐批转换为 float32，批次不宜过大
+            rows = max(SCAN_BATCH, SCORE_BUDGET // len(queries)) if self.dtype == "float32" else SCAN_BATCH
+            blocks = self.base.iter_batches(rows)
+        if self._delta:
+            blocks = itertools.chain(blocks, [(self.base_count, self._delta_vectors())])
+
+        for start, block in blocks:
+            scores = queries @ block.T
+            if mask is not None:
+                scores[:, ~mask[start:start + len(block)]] = -np.inf
+            part, idx = top_k(scores, k)
+            best = _merge(best, part, idx + start, k)
+        return _pad(best[0], best[1], k)
+
+    def save(self, path: Path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            order = self._save_vectors(path)
+            codes = self._save_codes(path, order)
+            self._write_header(path)
+            self._attach(open_vectors(path / "vectors"))
+            self.codes = codes
+
+    @classmethod
+    def load(cls, path: Path, header: Dict) -> "FlatIndex":
+        index = cls(header["dim"])
+        index._attach(open_vectors(Path(path) / "vectors"))
+        index._load_codes(Path(path), header)
+        return index
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, batch: int = 8192) -> np.ndarray:
+    """为每个向量分配内积最大的聚类中心"""
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch):
+        out[start:start + batch] = np.argmax(vectors[start:start + batch] @ centroids.T, axis=1)
+    return out
+
+
+def _kmeans(samples: np.ndarray, nlist: int, iterations: int = IVF_TRAIN_ITERATIONS,
+            seed: int = 0) -> np.ndarray:
+    """球面k-means，返回归一化的聚类中心"""
+    rng = np.random.default_rng(seed)
+    centroids = samples[rng.choice(len(samples), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _assign(samples, centroids)
+        counts = np.bincount(assign, minlength=nlist)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+
+        sums = np.zeros_like(centroids)
+        ordered = samples[np.argsort(assign, kind="stable")]
+        sums[nonempty] = np.add.reduceat(ordered, starts[nonempty], axis=0)
+        # 空簇重新随机取一个样本作为中心
+        sums[~nonempty] = samples[rng.choice(len(samples), int((~nonempty).sum()))]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class IVFFlatIndex(_StoredVectorsIndex):
+    """
+    倒排聚类索引
+
+    k-means 把向量分到 nlist 个簇，查询时只扫描与查询最近的 nprobe 个簇；
+    保存时向量文件按簇排序，同一簇的向量在文件中连续。
+    """
+
+    index_type = "ivf"
+
+    def __init__(self, dim: int, dtype: str = "float32", nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE):
+        super().__init__(dim, dtype)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = np.empty((0, dim), dtype=np.float32)
+        self.assign = np.empty(0, dtype=np.int32)
+        self._list_labels: Optional[np.ndarray] = None
+        self._list_offsets: Optional[np.ndarray] = None
+
+    @property
+    def params(self) -> Dict:
+        return {"nlist": self.nlist, "nprobe": self.nprobe}
+
+    def _build_lists(self):
+        """由 base 部分的簇分配计算每个簇的标签区间"""
+        base_assign = self.assign[:self.base_count]
+        self._list_labels = np.argsort(base_assign, kind="stable").astype(np.int64)
+        counts = np.bincount(base_assign, minlength=len(self.centroids))
+        self._list_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def build(self, vectors: VectorFile, progress: Optional[Callable[[int, int], None]] = None):
+        with self._lock:
+            self._attach(vectors)
+            n = vectors.count
+            nlist = self.nlist or int(np.sqrt(n))
+            self.nlist = max(1, min(nlist, n))
+
+            # 训练样本
+            sample_size = min(n, max(self.nlist * 40, 10000), IVF_TRAIN_SAMPLE)
+            rng = np.random.default_rng(0)
+            rows = np.sort(rng.choice(n, sample_size, replace=False))
+            self.centroids = _kmeans(vectors.get_rows(rows), self.nlist)
+
+            self.assign = np.empty(n, dtype=np.int32)
+            for start, block in vectors.iter_batches(SCAN_BATCH):
+                self.assign[start:start + len(block)] = _assign(block, self.centroids)
+                if progress:
+                    progress(start + len(block), n)
+            self._train_quantizer(vectors)
+            self._build_lists()
+
+    def add(self, ids: List[str], vectors: np.ndarray):
+        with self._lock:
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            self._append_delta(ids, vectors)
+            self.assign = np.concatenate([self.assign, _assign(vectors, self.centroids)])
+
+    def _candidates(self, lists: np.ndarray) -> np.ndarray:
+        """给定簇内的全部标签"""
+        parts = [self._list_labels[self._list_offsets[l]:self._list_offsets[l + 1]] for l in lists]
+        if len(self.assign) > self.base_count:
+            delta = np.flatnonzero(np.isin(self.assign[self.base_count:], lists))
+            parts.append(delta + self.base_count)
+        return np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+
+    def search(self, queries: np.ndarray, k: int,
+               allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        mask = self._live_mask(allowed)
+        _, probes = top_k(queries @ self.centroids.T, min(self.nprobe, len(self.centroids)))
+
+        out_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        out_labels = np.full((len(queries), k), -1, dtype=np.int64)
+        for qi, lists in enumerate(probes):
+            candidates = self._candidates(lists)
+            if mask is not None:
+                candidates = candidates[mask[candidates]]
+            if not len(candidates):
+                continue
+            if self.quantizer is not None:
+                query = queries[qi:qi + 1]
+                _, idx = top_k(self.quantizer.scores(query, self.codes[candidates]), k * QUANT_RERANK_FACTOR)
+                scores, labels = self._rerank(query, candidates[idx], k)
+                out_scores[qi], out_labels[qi] = scores[0], labels[0]
+                continue
+            scores, idx = top_k((self._vectors(candidates) @ queries[qi])[None, :], k)
+            out_scores[qi, :scores.shape[1]] = scores[0]
+            out_labels[qi, :scores.shape[1]] = candidates[idx[0]]
+        return out_scores, out_labels
+
+    def _storage_order(self) -> np.ndarray:
+        live = np.flatnonzero(~self.deleted)
+        return live[np.argsort(self.assign[live], kind="stable")]
+
+    def save(self, path: Path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            order = self._save_vectors(path)
+            codes = self._save_codes(path, order)
+            np.save(path / "centroids.npy", self.centroids)
+            np.save(path / "assign.npy", self.assign[order])
+            self._write_header(path)
+
+            centroids, assign = self.centroids, self.assign[order]
+            self._attach(open_vectors(path / "vectors"))
+            self.centroids, self.assign, self.codes = centroids, assign, codes
+            self._build_lists()
+
+    @classmethod
+    def load(cls, path: Path, header: Dict) -> "IVFFlatIndex":
+        path = Path(path)
+        params = header.get("params", {})
+        index = cls(header["dim"], nlist=params.get("nlist", IVF_NLIST), nprobe=params.get("nprobe", IVF_NPROBE))
+        index._attach(open_vectors(path / "vectors"))
+        index.centroids = np.load(path / "centroids.npy")
+        index.assign = np.load(path / "assign.npy")
+        index._load_codes(path, header)
+        index._build_lists()
+        return index
+
+
+class HNSWIndex(VectorIndex):
+    """HNSW 图索引（hnswlib，进程内），删除通过 mark_deleted 实现"""
+
+    index_type = "hnsw"
+
+    def __init__(self, dim: int, m: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION,
+                 ef_search: int = HNSW_EF_SEARCH):
+        if hnswlib is None:
+            raise Exception("HNSW 索引需要 hnswlib（chromadb 依赖的 chroma-hnswlib），请先安装")
+        super().__init__(dim)
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._index = None
+
+    @property
+    def params(self) -> Dict:
+        return {"m": self.m, "ef_construction": self.ef_construction, "ef_search": self.ef_search}
+
+    def _new_index(self, capacity: int):
+        self._index = hnswlib.Index(space="ip", dim=self.dim)
+        self._index.init_index(max_elements=max(capacity, 1), ef_construction=self.ef_construction, M=self.m)
+        self._index.set_ef(self.ef_search)
+
+    def build(self, vectors: VectorFile, progress: Optional[Callable[[int, int], None]] = None):
+        with self._lock:
+            self.ids = list(vectors.ids)
+            self.deleted = np.zeros(len(self.ids), dtype=bool)
+            self.deleted_count = 0
+            self._labels = None
+            self._new_index(vectors.count)
+            for start, block in vectors.iter_batches(SCAN_BATCH):
+                self._index.add_items(block, np.arange(start, start + len(block)))
+                if progress:
+                    progress(start + len(block), vectors.count)
+
+    def add(self, ids: List[str], vectors: np.ndarray):
+        with self._lock:
+            labels = self._register(ids)
+            needed = len(self.ids)
+            if needed > self._index.get_max_elements():
+                self._index.resize_index(max(needed, self._index.get_max_elements() * 2))
+            self._index.add_items(np.asarray(vectors, dtype=np.float32), labels)
+
+    def _on_delete(self, labels: np.ndarray):
+        for label in labels:
+            self._index.mark_deleted(int(label))
+
+    def search(self, queries: np.ndarray, k: int,
+               allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k_found = min(k, len(self) if allowed is None else int(allowed.sum()))
+        if k_found <= 0:
+            return _pad(np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64), k)
+
+        self._index.set_ef(max(self.ef_search, k_found))
+        try:
+            if allowed is None:
+                labels, distances = self._index.knn_query(queries, k=k_found)
+            else:
+                labels, distances = self._index.knn_query(queries, k=k_found, filter=lambda label: bool(allowed[label]))
+        except RuntimeError:
+            # 过滤条件过严时图搜索可能凑不满k个结果，退回到子集上的精确检索
+            return self._exact_search(queries, k, allowed)
+        # ip 空间的距离为 1 - 内积
+        return _pad((1.0 - distances).astype(np.float32), labels.astype(np.int64), k)
+
+    def _exact_search(self, queries: np.ndarray, k: int,
+                      allowed: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        mask = self._live_mask(allowed)
+        labels = np.flatnonzero(mask) if mask is not None else np.arange(len(self.ids))
+        return self.search_subset(queries, labels, k)
+
+    def _resident_bytes(self) -> int:
+        # hnswlib 在内存中保存 float32 向量和每层邻接表（底层 2M 个邻居）
+        return len(self.ids) * (self.dim * 4 + self.m * 2 * 4)
+
+    def _vectors(self, labels: np.ndarray) -> np.ndarray:
+        return np.asarray(self._index.get_items(np.asarray(labels).tolist()), dtype=np.float32).reshape(-1, self.dim)
+
+    def save(self, path: Path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._index.save_index(str(path / "hnsw.bin"))
+            with open(path / "ids.txt", 'w', encoding='utf-8') as f:
+                f.write("".join(f"{i}\n" for i in self.ids))
+            np.save(path / "deleted.npy", self.deleted)
+            self._write_header(path)
+
+    @classmethod
+    def load(cls, path: Path, header: Dict) -> "HNSWIndex":
+        path = Path(path)
+        params = header.get("params", {})
+        index = cls(header["dim"], m=params.get("m", HNSW_M),
+                    ef_construction=params.get("ef_construction", HNSW_EF_CONSTRUCTION),
+                    ef_search=params.get("ef_search", HNSW_EF_SEARCH))
+        with open(path / "ids.txt", 'r', encoding='utf-8') as f:
+            index.ids = f.read().splitlines()
+        index.deleted = np.load(path / "deleted.npy")
+        index.deleted_count = int(index.deleted.sum())
+        index._index = hnswlib.Index(space="ip", dim=index.dim)
+        index._index.load_index(str(path / "hnsw.bin"), max_elements=len(index.ids))
+        index._index.set_ef(index.ef_search)
+        return index
+
+
+INDEX_CLASSES = {
+    "flat": FlatIndex,
+    "ivf": IVFFlatIndex,
+    "hnsw": HNSWIndex
+}
+
+
+def create_index(index_type: str, dim: int, quantization: Optional[str] = None) -> VectorIndex:
+    """创建空索引，quantization 为 resolve_quantization 的结果"""
+    index = INDEX_CLASSES[index_type](dim)
+    if quantization:
+        if not isinstance(index, _StoredVectorsIndex):
+            raise ValueError(f"{index_type} 索引不支持量化，请使用 flat 或 ivf")
+        index.quantizer = create_quantizer(quantization, dim)
+    return index
+
+
+def read_index(path: Path) -> VectorIndex:
+    """从目录读取索引（不缓存，返回的实例可以修改）"""
+    with open(Path(path) / "index.json", 'r', encoding='utf-8') as f:
+        header = json.load(f)
+    return INDEX_CLASSES[header["index_type"]].load(path, header)
+
+
+_loaded: Dict[str, VectorIndex] = {}
+_loaded_lock = threading.Lock()
+
+
+def load_index(path: Path) -> VectorIndex:
+    """
+    加载只读索引（进程内缓存）
+
+    每个索引版本保存在独立目录中、写完后不再修改，所以按目录路径缓存即可；
+    需要增删向量时用 read_index 取得独立实例，保存到新版本目录。
+    """
+    key = str(Path(path).resolve())
+    with _loaded_lock:
+        index = _loaded.get(key)
+        if index is None:
+            index = read_index(path)
+            _loaded[key] = index
+        return index
+
+
+def remove_index(path: Path):
+    """删除索引目录并清除缓存（已打开的内存映射在进程内仍然有效）"""
+    key = str(Path(path).resolve())
+    with _loaded_lock:
+        _loaded.pop(key, None)
+    shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,32 @@
+"""
+测试公共配置
+测试从 backend 目录或仓库根目录运行都能导入 services / utils
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+class FakeClock:
+    """可手动推进的 time.monotonic 替身"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """把 time.monotonic 替换为 FakeClock，测试中修改 clock.now 推进时间"""
+    clock = FakeClock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    return clock
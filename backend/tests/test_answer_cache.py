@@ -0,0 +1,60 @@
+"""
+语义回答缓存测试
+"""
+
+import numpy as np
+import pytest
+
+from services.answer_cache import SemanticAnswerCache
+
+
+def _vector(*values):
+    return np.asarray(values, dtype=np.float32)
+
+
+def test_similar_query_hits_within_group(clock):
+    cache = SemanticAnswerCache(max_items=10, ttl=60, threshold=0.95)
+    cache.put("g1", _vector(1, 0, 0), {"content": "答案", "query": "问题"})
+    hit = cache.get("g1", _vector(10, 1, 0))
+    assert hit["content"] == "答案"
+    assert hit["similarity"] == pytest.approx(10 / np.sqrt(101), abs=1e-4)
+    assert cache.get("g1", _vector(1, 1, 0)) is None
+    # 不同上下文分组永不命中
+    assert cache.get("g2", _vector(1, 0, 0)) is None
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 2)
+
+
+def test_returns_most_similar_entry(clock):
+    cache = SemanticAnswerCache(threshold=0.5)
+    cache.put("g", _vector(1, 0), {"content": "x"})
+    cache.put("g", _vector(0.8, 0.6), {"content": "y"})
+    assert cache.get("g", _vector(0.7, 0.7))["content"] == "y"
+
+
+def test_entries_expire(clock):
+    cache = SemanticAnswerCache(ttl=60)
+    cache.put("g", _vector(1, 0), {"content": "x"})
+    clock.now += 61
+    assert cache.get("g", _vector(1, 0)) is None
+    # 写入时清理过期条目及其空分组
+    cache.put("h", _vector(0, 1), {"content": "y"})
+    assert cache.stats()["items"] == 1 and cache.stats()["groups"] == 1
+
+
+def test_lru_eviction_and_clear(clock):
+    cache = SemanticAnswerCache(max_items=2)
+    cache.put("a", _vector(1, 0), {"content": "a"})
+    cache.put("b", _vector(1, 0), {"content": "b"})
+    assert cache.get("a", _vector(1, 0)) is not None
+    cache.put("c", _vector(1, 0), {"content": "c"})
+    assert cache.get("b", _vector(1, 0)) is None
+    assert cache.get("a", _vector(1, 0)) is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.clear() == 2
+    assert cache.stats()["groups"] == 0
+
+
+def test_zero_vector_does_not_crash(clock):
+    cache = SemanticAnswerCache()
+    cache.put("g", _vector(0, 0), {"content": "x"})
+    assert cache.get("g", _vector(0, 0)) is None
@@ -0,0 +1,93 @@
+"""
+BM25 切词与检索测试：MaxScore 剪枝后的前k结果应与全量打分一致
+"""
+
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+import services.bm25_index as bm25_index
+from services.bm25_index import BM25Index, tokenize, bm25_idf, bm25_scores
+
+
+def test_tokenize_cjk_bigrams():
+    assert tokenize("向量检索") == ["向量", "量检", "检索"]
+    assert tokenize("苹") == ["苹"]
+
+
+def test_tokenize_codes_and_normalization():
+    # 全角转半角、转小写；编号整体成词并补充各段
+    assert tokenize("ＳＫＵ-1024") == ["sku-1024", "sku", "1024"]
+    assert tokenize("v2.3.1 ERR_CONN") == ["v2.3.1", "v2", "3", "1", "err_conn", "err", "conn"]
+
+
+def _corpus(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    words = ["向量", "数据库", "检索", "苹果", "种植", "缓存", "SKU-1024", "ERR_DISK", "调度", "高铁"]
+    # 常见词出现在大多数文档中，使剪枝路径真正生效
+    return [
+        " ".join(rng.choice(words) for _ in range(rng.randint(3, 12))) + " 的" * rng.randint(0, 3)
+        for _ in range(n)
+    ]
+
+
+def _brute_force(docs, query, k):
+    tokenized = [tokenize(doc) for doc in docs]
+    lengths = np.array([len(tokens) for tokens in tokenized], dtype=np.float32)
+    avg_length = float(lengths.sum() / len(docs))
+    scores = np.zeros(len(docs), dtype=np.float64)
+    for term in set(tokenize(query)):
+        tfs = np.array([Counter(tokens)[term] for tokens in tokenized])
+        df = int((tfs > 0).sum())
+        if df:
+            scores += np.where(tfs > 0, bm25_scores(tfs, lengths, bm25_idf(df, len(docs)), avg_length), 0)
+    order = np.argsort(-scores, kind="stable")
+    return [(int(i), float(scores[i])) for i in order[:k] if scores[i] > 0]
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    # 小段大小，覆盖多段合并
+    monkeypatch.setattr(bm25_index, "BM25_SEGMENT_DOCS", 50)
+    return BM25Index(tmp_path / "bm25.db")
+
+
+def _build(index, run_id, docs):
+    writer = index.writer(run_id)
+    for start in range(0, len(docs), 20):
+        writer.add([{"seq": i, "content": docs[i]} for i in range(start, min(start + 20, len(docs)))])
+    return writer.close()
+
+
+@pytest.mark.parametrize("query", ["向量数据库检索", "苹果种植的缓存", "sku-1024", "err_disk 高铁调度 的"])
+@pytest.mark.parametrize("k", [1, 5, 20])
+def test_pruned_search_matches_brute_force(index, query, k):
+    docs = _corpus(300)
+    _build(index, "run", docs)
+    result = index.search("run", query, k)
+    expected = _brute_force(docs, query, k)
+    assert len(result) == len(expected)
+    # 同分文档顺序不固定，比较得分序列和第k名之前的文档集合
+    assert np.allclose([s for _, s in result], [s for _, s in expected], rtol=1e-4)
+    threshold = expected[-1][1]
+    assert {seq for seq, s in result if s > threshold + 1e-4} == {seq for seq, s in expected if s > threshold + 1e-4}
+
+
+def test_allowed_seqs_restricts_results(index):
+    docs = _corpus(200)
+    _build(index, "run", docs)
+    allowed = np.arange(0, 200, 3, dtype=np.int32)
+    result = index.search("run", "向量 苹果", 10, allowed_seqs=allowed)
+    assert result and all(seq % 3 == 0 for seq, _ in result)
+    assert index.search("run", "向量", 10, allowed_seqs=np.empty(0, dtype=np.int32)) == []
+
+
+def test_unknown_run_and_delete(index):
+    assert index.search("missing", "向量", 5) == []
+    _build(index, "run", _corpus(30))
+    assert index.has_run("run")
+    index.delete_run("run")
+    assert not index.has_run("run")
+    assert index.search("run", "向量", 5) == []
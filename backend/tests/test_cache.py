@@ -0,0 +1,59 @@
+"""
+进程内 TTL 缓存测试
+"""
+
+from utils.cache import TTLCache, get_cache
+
+
+def test_get_put_and_stats(clock):
+    cache = TTLCache(max_items=4, ttl=10)
+    assert cache.get("a") is None
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"], stats["items"]) == (1, 1, 0.5, 1)
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(max_items=4, ttl=10)
+    cache.put("a", 1)
+    clock.now += 10
+    assert cache.get("a") == 1
+    clock.now += 0.01
+    assert cache.get("a") is None
+    assert cache.stats()["items"] == 0
+
+
+def test_put_refreshes_ttl(clock):
+    cache = TTLCache(max_items=4, ttl=10)
+    cache.put("a", 1)
+    clock.now += 8
+    cache.put("a", 2)
+    clock.now += 8
+    assert cache.get("a") == 2
+
+
+def test_lru_eviction_keeps_recently_used(clock):
+    cache = TTLCache(max_items=2, ttl=10)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_by_predicate_and_all(clock):
+    cache = TTLCache()
+    for key in [("c1", 1), ("c1", 2), ("c2", 1)]:
+        cache.put(key, key)
+    assert cache.invalidate(lambda key: key[0] == "c1") == 2
+    assert cache.get(("c2", 1)) == ("c2", 1)
+    assert cache.invalidate() == 1
+    assert cache.stats()["items"] == 0
+
+
+def test_named_caches_are_shared():
+    assert get_cache("test_shared") is get_cache("test_shared")
+    assert get_cache("test_shared") is not get_cache("test_other")
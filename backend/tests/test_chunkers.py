@@ -0,0 +1,76 @@
+"""
+分块算法测试：区间是否覆盖全文、块大小与重叠是否符合设置
+"""
+
+import pytest
+
+from services.chunkers import chunk_text, split_fixed, split_sentences, pack_units
+
+
+TEXT = "第一句话。第二句话比较长一些！第三句？\n第四句没有标点\n\n第二段的第一句。第二段的第二句。"
+
+
+def test_fixed_spans_size_and_overlap():
+    text = "abcdefghij" * 5
+    spans = list(split_fixed(text, 12, 4))
+    assert spans[0] == (0, 12)
+    assert all(end - start <= 12 for start, end in spans)
+    # 相邻块起点间隔 size - overlap，最后一块到达文本末尾
+    assert [start for start, _ in spans] == [0, 8, 16, 24, 32, 40]
+    assert spans[-1][1] == len(text)
+
+
+def test_fixed_trims_whitespace_and_skips_blank_windows():
+    text = "abc" + " " * 20 + "def"
+    spans = list(split_fixed(text, 5, 0))
+    assert all(text[start:end].strip() == text[start:end] for start, end in spans)
+    assert "".join(text[start:end] for start, end in spans) == "abcdef"
+
+
+def test_sentences_keep_trailing_punctuation():
+    sentences = [TEXT[start:end] for start, end in split_sentences(TEXT)]
+    assert sentences[:3] == ["第一句话。", "第二句话比较长一些！", "第三句？"]
+    assert "第四句没有标点" in sentences
+
+
+def test_pack_units_overlap_is_whole_units():
+    units = [(i * 10, i * 10 + 10) for i in range(6)]
+    measure = lambda start, end: end - start
+    spans = list(pack_units(units, 30, 10, measure, lambda s, e: iter([(s, e)])))
+    assert spans == [(0, 30), (20, 50), (40, 60)]
+
+
+def test_pack_units_splits_long_unit():
+    units = [(0, 5), (5, 50), (50, 55)]
+    measure = lambda start, end: end - start
+    spans = list(pack_units(units, 20, 0, measure, lambda s, e: iter([(s, s + 20), (s + 20, e)])))
+    assert spans == [(0, 5), (5, 25), (25, 50), (50, 55)]
+
+
+@pytest.mark.parametrize("method", ["fixed", "sentence", "paragraph", "semantic"])
+def test_chunks_cover_text_within_size(method):
+    text = TEXT * 8
+    spans = list(chunk_text(text, method, 40, 10))
+    assert spans
+    assert all(0 <= start < end <= len(text) and end - start <= 40 for start, end in spans)
+    # 除空白外每个字符都落在某个块中
+    covered = set()
+    for start, end in spans:
+        covered.update(range(start, end))
+    assert all(i in covered for i, ch in enumerate(text) if not ch.isspace())
+
+
+def test_paragraph_chunks_do_not_cross_blank_line_when_they_fit():
+    spans = list(chunk_text("甲" * 10 + "\n\n" + "乙" * 10, "paragraph", 15, 0))
+    assert spans == [(0, 10), (12, 22)]
+
+
+@pytest.mark.parametrize("size, overlap", [(0, 0), (10, 10), (10, -1)])
+def test_invalid_size_or_overlap(size, overlap):
+    with pytest.raises(ValueError):
+        list(chunk_text(TEXT, "fixed", size, overlap))
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        chunk_text(TEXT, "unknown", 10, 0)
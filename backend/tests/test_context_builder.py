@@ -0,0 +1,141 @@
+"""
+上下文组装测试：去重合并（含只隔着空白的相邻分块）与token预算装填
+"""
+
+import services.context_builder as context_builder
+from services.context_builder import build_context, context_budget, MIN_TEXT_OVERLAP
+from utils.tokenizer import count_tokens
+
+
+def _chunk(chunk_id, content, score, start=None, end=None, source="a.md", file_id="f1"):
+    metadata = {"source": source, "file_id": file_id, "section_id": "s1"}
+    if start is not None:
+        metadata.update(start_pos=start, end_pos=end)
+    return {"id": chunk_id, "content": content, "score": score, "metadata": metadata}
+
+
+TEXT = "".join(f"第{i}句话讲的是检索增强生成中的上下文组装。" for i in range(40))
+
+
+def test_overlapping_spans_merge_into_one_block():
+    context = [
+        _chunk("c2", TEXT[80:200], 0.9, 80, 200),
+        _chunk("c1", TEXT[0:100], 0.5, 0, 100),
+        _chunk("c3", TEXT[200:260], 0.4, 200, 260),
+    ]
+    blocks, stats = build_context(context, budget=100000)
+    assert len(blocks) == 1
+    assert blocks[0]["text"].endswith(TEXT[0:260])
+    assert sorted(blocks[0]["ids"]) == ["c1", "c2", "c3"]
+    assert blocks[0]["score"] == 0.9
+    assert stats["merged_chunks"] == 2
+
+
+def test_spans_in_other_files_are_not_merged():
+    context = [_chunk("c1", TEXT[0:100], 0.9, 0, 100), _chunk("c2", TEXT[50:150], 0.8, 50, 150, source="b.md", file_id="f2")]
+    blocks, _ = build_context(context, budget=100000)
+    assert len(blocks) == 2
+
+
+def test_text_dedup_and_overlap_without_positions():
+    overlap = MIN_TEXT_OVERLAP + 10
+    left, right = TEXT[:120], TEXT[120 - overlap:220]
+    context = [
+        _chunk("a", left, 0.7),
+        _chunk("b", right, 0.6),
+        _chunk("dup", TEXT[10:60], 0.95),
+        "纯文本上下文",
+    ]
+    blocks, _ = build_context(context, budget=100000)
+    assert len(blocks) == 2
+    merged = blocks[0]
+    assert merged["text"].endswith(TEXT[:220])
+    assert set(merged["ids"]) == {"a", "b", "dup"}
+    # 没有得分的纯文本排在最后
+    assert blocks[1]["score"] is None and blocks[1]["text"].endswith("纯文本上下文")
+    assert [block["index"] for block in blocks] == [1, 2]
+
+
+def test_blocks_ordered_by_score_and_fit_budget():
+    context = [_chunk(f"c{i}", f"来源{i}：" + TEXT[i * 30:i * 30 + 200], score, source=f"s{i}.md", file_id=f"f{i}")
+               for i, score in enumerate([0.2, 0.9, 0.5, 0.7])]
+    full, _ = build_context(context, budget=100000)
+    assert [block["ids"][0] for block in full] == ["c1", "c3", "c2", "c0"]
+
+    budget = full[0]["tokens"] + full[1]["tokens"] + 100
+    blocks, stats = build_context(context, budget=budget)
+    assert stats["context_tokens"] <= budget
+    assert sum(block["tokens"] for block in blocks) == stats["context_tokens"]
+    assert all(block["tokens"] == count_tokens(block["text"]) for block in blocks)
+    # 前两段完整放入，第三段按剩余预算截断，最后一段放不下
+    assert [block["truncated"] for block in blocks] == [False, False, True]
+    assert stats["truncated_blocks"] == 1 and stats["dropped_blocks"] == 1
+
+
+def test_too_small_remainder_is_dropped_not_truncated():
+    context = [_chunk("c1", TEXT[:200], 0.9, file_id="f1"), _chunk("c2", TEXT[200:400], 0.8, file_id="f2")]
+    first, _ = build_context(context[:1], budget=100000)
+    blocks, stats = build_context(context, budget=first[0]["tokens"] + 10)
+    assert len(blocks) == 1 and not blocks[0]["truncated"]
+    assert stats["dropped_blocks"] == 1
+
+
+def test_empty_context_and_budget_lookup():
+    assert build_context([], "gpt-4")[0] == []
+    assert build_context(["   "], "gpt-4")[0] == []
+    assert context_budget("gpt-4-turbo-2024-04-09") == 60000
+    assert context_budget("gpt-4-0613") == 6000
+
+
+def test_chunks_separated_by_whitespace_merge():
+    paragraphs = ["第一段讲检索。" * 5, "第二段讲生成。" * 5, "第三段讲评估。" * 5]
+    text = "\n\n".join(paragraphs)
+    spans, start = [], 0
+    for paragraph in paragraphs:
+        spans.append((start, start + len(paragraph)))
+        start += len(paragraph) + 2
+
+    def chunk(index, score):
+        item = _chunk(f"p{index}", text[spans[index][0]:spans[index][1]], score, *spans[index])
+        item["metadata"]["chunk_index"] = index
+        return item
+
+    blocks, stats = build_context([chunk(2, 0.5), chunk(0, 0.9), chunk(1, 0.3)], budget=100000)
+    assert len(blocks) == 1 and stats["merged_chunks"] == 2
+    assert blocks[0]["text"].endswith("\n".join(paragraphs))
+
+    # 中间的分块没有检索到时，前后两段之间隔着正文，不能合并
+    blocks, _ = build_context([chunk(0, 0.9), chunk(2, 0.5)], budget=100000)
+    assert len(blocks) == 2
+
+
+def test_candidates_are_tokenized_in_batch(monkeypatch):
+    calls = []
+    original = context_builder.count_tokens_batch
+
+    def recording(texts, model=None):
+        calls.append(len(texts))
+        return original(texts, model)
+
+    monkeypatch.setattr(context_builder, "count_tokens_batch", recording)
+    context = [_chunk(f"c{i}", f"候选{i}：" + TEXT[i * 7:i * 7 + 80], 1 - i / 100, source=f"s{i}.md", file_id=f"f{i}")
+               for i in range(30)]
+    blocks, _ = build_context(context, budget=100000)
+    assert len(blocks) == 30
+    # 正文和来源行各批量编码一次，不随候选数增加
+    assert calls == [30, 30]
+
+
+def test_token_counts_exact_after_dropping_a_middle_block():
+    context = [
+        _chunk("big0", TEXT[:300], 0.9, source="a.md", file_id="f1"),
+        _chunk("big1", TEXT[300:800], 0.8, source="b.md", file_id="f2"),
+        _chunk("small", TEXT[800:820], 0.7, source="c.md", file_id="f3"),
+    ]
+    first, _ = build_context(context[:1], budget=100000)
+    blocks, stats = build_context(context, budget=first[0]["tokens"] + 60)
+    # 第二段放不下被丢弃（剩余预算太小，不截断），第三段编号前移为 [2]
+    assert [block["ids"] for block in blocks] == [["big0"], ["small"]]
+    assert blocks[1]["text"].startswith("[2]")
+    assert all(block["tokens"] == count_tokens(block["text"]) for block in blocks)
+    assert stats["context_tokens"] == sum(block["tokens"] for block in blocks)
@@ -0,0 +1,100 @@
+"""
+数据导入测试：上传内容按固定大小分块落盘，超限或中断时不留下半截文件；同名文件的新版本只标记变化的章节
+"""
+
+import asyncio
+import hashlib
+import io
+
+import pytest
+
+import services.data_import_service as data_import_service
+from services.data_import_service import DataImportService
+
+
+class FakeUpload:
+    """记录每次读取的大小和是否被关闭"""
+
+    def __init__(self, data: bytes, filename: str = "doc.md", fail_after: int = None):
+        self.file = io.BytesIO(data)
+        self.filename = filename
+        self.reads = []
+        self.closed = False
+        self.fail_after = fail_after
+
+    async def read(self, size: int = -1) -> bytes:
+        if self.fail_after is not None and len(self.reads) >= self.fail_after:
+            raise asyncio.CancelledError()
+        self.reads.append(size)
+        return self.file.read(size)
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    service = DataImportService()
+    yield service
+    service.shutdown()
+
+
+def _leftovers(service):
+    return sorted(p.name for p in service.upload_dir.iterdir())
+
+
+def test_upload_is_written_in_chunks(service, monkeypatch):
+    monkeypatch.setattr(data_import_service, "UPLOAD_CHUNK_SIZE", 4)
+    data = "分块写入的上传内容".encode("utf-8")
+    upload = FakeUpload(data)
+    path = service.upload_dir / "a.md"
+
+    size, content_hash = asyncio.run(service._save_upload(upload, path))
+    assert size == len(data) and content_hash == hashlib.sha256(data).hexdigest()
+    assert path.read_bytes() == data
+    # 每次最多读取一个块，读到空块结束
+    assert set(upload.reads) == {4} and len(upload.reads) == len(data) // 4 + 2
+    assert upload.closed and _leftovers(service) == ["a.md"]
+
+
+def test_oversized_upload_is_rejected(service, monkeypatch):
+    monkeypatch.setattr(data_import_service, "UPLOAD_CHUNK_SIZE", 4)
+    monkeypatch.setattr(data_import_service, "MAX_UPLOAD_SIZE", 10)
+    upload = FakeUpload(b"x" * 20)
+    with pytest.raises(Exception, match="超过限制"):
+        asyncio.run(service._save_upload(upload, service.upload_dir / "big.md"))
+    assert upload.closed and _leftovers(service) == []
+
+
+def test_interrupted_upload_leaves_no_partial_file(service, monkeypatch):
+    monkeypatch.setattr(data_import_service, "UPLOAD_CHUNK_SIZE", 4)
+    upload = FakeUpload(b"x" * 20, fail_after=2)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(service._save_upload(upload, service.upload_dir / "cut.md"))
+    assert upload.closed and _leftovers(service) == []
+
+
+def test_reupload_marks_only_changed_sections(service):
+    first = "# 第一章\n向量检索。\n\n# 第二章\n文本分块。\n"
+    second = "# 第一章\n向量检索。\n\n# 第二章\n改写后的文本分块。\n"
+
+    async def scenario():
+        results = []
+        for text in (first, first, second):
+            results.append(await service.upload_file(
+                FakeUpload(text.encode("utf-8")), "semi-structured", "markdown"
+            ))
+        return results
+
+    created, skipped, updated = asyncio.run(scenario())
+    assert created["status"] == "success"
+    # 内容未变化的重复上传直接跳过
+    assert skipped["status"] == "skipped" and skipped["file_id"] == created["file_id"]
+    # 新版本沿用原 file_id，只有第二章变化
+    assert updated["file_id"] == created["file_id"]
+    assert updated["changed_sections"] == 1 and updated["unchanged_sections"] == 1
+
+    record = service.store.get("file_info", created["file_id"])
+    assert record["version"] == 2 and record["status"] == "success"
+    assert _leftovers(service) == [f"{created['file_id']}.md"]
@@ -0,0 +1,100 @@
+"""
+解析进程池测试：超时/取消只影响对应任务，进程异常时重新提交
+解析函数需为模块级函数，spawn 出的解析进程按模块名导入本文件
+"""
+
+import asyncio
+import os
+import time
+
+import pytest
+
+from services.document_parser import DocumentParserPool
+
+
+def _sleep_parse(file_info):
+    """记录每次调用，睡眠后返回"""
+    with open(file_info["log"], "a", encoding="utf-8") as f:
+        f.write(f"start {file_info['id']}\n")
+    time.sleep(file_info["sleep"])
+    with open(file_info["log"], "a", encoding="utf-8") as f:
+        f.write(f"done {file_info['id']}\n")
+    return {"id": file_info["id"]}
+
+
+def _crash_once_parse(file_info):
+    """第一次调用时让解析进程直接退出"""
+    marker = file_info["marker"]
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        os._exit(1)
+    return {"id": file_info["id"]}
+
+
+def _lines(path):
+    return path.read_text(encoding="utf-8").splitlines() if path.exists() else []
+
+
+async def _warm_up(pool, log):
+    # 先让进程启动完成，后续计时不包含进程启动
+    await asyncio.gather(*[pool.parse(f"warm{i}", {"id": f"warm{i}", "sleep": 0.3, "log": log}) for i in range(2)])
+
+
+def test_timeout_does_not_disturb_other_running_task(tmp_path):
+    log = tmp_path / "calls.log"
+
+    async def scenario():
+        pool = DocumentParserPool(max_workers=2, timeout=1.0, target=_sleep_parse)
+        try:
+            await _warm_up(pool, str(log))
+            stuck = asyncio.ensure_future(pool.parse("stuck", {"id": "stuck", "sleep": 4, "log": str(log)}))
+            await asyncio.sleep(0.5)
+            # 该任务在 stuck 超时、进程池退役时仍在运行，应正常完成且只解析一次
+            other = await pool.parse("other", {"id": "other", "sleep": 0.8, "log": str(log)})
+            with pytest.raises(Exception, match="超时"):
+                await stuck
+            # 退役进程池已终止，新的任务使用新的进程池
+            after = await pool.parse("after", {"id": "after", "sleep": 0, "log": str(log)})
+            await asyncio.sleep(3.5)
+            return other, after
+        finally:
+            pool.shutdown()
+
+    other, after = asyncio.run(scenario())
+    assert other == {"id": "other"} and after == {"id": "after"}
+    lines = _lines(log)
+    assert lines.count("start other") == 1 and "done other" in lines
+    # 卡住的解析进程被终止，没有运行完
+    assert "start stuck" in lines and "done stuck" not in lines
+
+
+def test_cancel_running_task(tmp_path):
+    log = tmp_path / "calls.log"
+
+    async def scenario():
+        pool = DocumentParserPool(max_workers=2, timeout=30, target=_sleep_parse)
+        try:
+            await _warm_up(pool, str(log))
+            slow = asyncio.ensure_future(pool.parse("slow", {"id": "slow", "sleep": 10, "log": str(log)}))
+            await asyncio.sleep(0.3)
+            started = time.monotonic()
+            assert pool.cancel("slow") is True
+            with pytest.raises(Exception, match="取消"):
+                await slow
+            assert time.monotonic() - started < 2
+            assert pool.cancel("slow") is False
+        finally:
+            pool.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_crashed_worker_is_retried_once(tmp_path):
+    async def scenario():
+        pool = DocumentParserPool(max_workers=1, timeout=30, target=_crash_once_parse)
+        try:
+            return await pool.parse("f", {"id": "f", "marker": str(tmp_path / "crashed")})
+        finally:
+            pool.shutdown()
+
+    assert asyncio.run(scenario()) == {"id": "f"}
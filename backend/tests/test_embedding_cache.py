@@ -0,0 +1,80 @@
+"""
+嵌入缓存测试：命中、大小统计（重复键、覆盖已有键、多进程共享文件）与淘汰
+"""
+
+import numpy as np
+import pytest
+
+import utils.embedding_cache as embedding_cache
+from utils.embedding_cache import EmbeddingCache, cache_key, normalize_text
+
+
+DIM = 4
+ROW_BYTES = DIM * 4
+
+
+def _vectors(n: int, value: float = 1.0) -> np.ndarray:
+    return np.full((n, DIM), value, dtype=np.float32)
+
+
+def _disk_bytes(cache: EmbeddingCache) -> int:
+    return cache._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+
+def test_normalized_keys():
+    assert normalize_text("  Ｈello \n\t world ") == "Hello world"
+    assert cache_key("m", "hello  world") == cache_key("m", " hello world")
+    assert cache_key("m", "x") != cache_key("n", "x")
+
+
+def test_get_many_hits_memory_and_disk(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.db")
+    cache.put_many("m", ["a", "b"], np.array([[1, 0, 0, 0], [0, 1, 0, 0]], dtype=np.float32))
+    # 新实例只能从磁盘读取
+    other = EmbeddingCache(tmp_path / "cache.db")
+    found = other.get_many("m", ["b", "c", "a", "b"])
+    assert sorted(found) == [0, 2, 3]
+    assert found[0].tolist() == [0, 1, 0, 0] and found[2].tolist() == [1, 0, 0, 0]
+    assert other.stats()["hits"] == 3 and other.stats()["misses"] == 1
+
+
+def test_duplicate_and_existing_keys_count_once(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.db")
+    cache.put_many("m", ["a", "a", " a "], _vectors(3))
+    assert cache._total_bytes == ROW_BYTES
+
+    for _ in range(5):
+        cache.put_many("m", ["a", "b"], _vectors(2, 2.0))
+    assert cache._total_bytes == 2 * ROW_BYTES == _disk_bytes(cache)
+    # 覆盖写入使用最新的向量
+    assert cache.get_many("m", ["a"])[0].tolist() == [2.0] * DIM
+
+
+def test_resync_picks_up_other_writers(tmp_path, monkeypatch):
+    first = EmbeddingCache(tmp_path / "cache.db")
+    second = EmbeddingCache(tmp_path / "cache.db")
+    first.put_many("m", [f"x{i}" for i in range(10)], _vectors(10))
+    second.put_many("m", ["y"], _vectors(1))
+    # 未到重新统计的间隔时，second 的计数只包含自己的写入
+    assert second._total_bytes == ROW_BYTES
+
+    monkeypatch.setattr(embedding_cache, "_RESYNC_INTERVAL", 0)
+    second.put_many("m", ["z"], _vectors(1))
+    assert second._total_bytes == 12 * ROW_BYTES == _disk_bytes(second)
+
+
+def test_eviction_uses_shared_size(tmp_path):
+    writer = EmbeddingCache(tmp_path / "cache.db")
+    writer.put_many("m", [f"old{i}" for i in range(10)], _vectors(10))
+    # 上限 8 行：超过上限时以数据库中的实际大小为准淘汰最久未访问的条目
+    cache = EmbeddingCache(tmp_path / "cache.db", max_bytes=8 * ROW_BYTES)
+    cache.put_many("m", ["new"], _vectors(1))
+    assert cache._total_bytes == _disk_bytes(cache) <= int(8 * ROW_BYTES * 0.9)
+    assert 0 in cache.get_many("m", ["new"])
+    assert cache.get_many("m", ["old0"]) == {}
+
+
+def test_empty_put_is_noop(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.db")
+    cache.put_many("m", [], np.empty((0, DIM), dtype=np.float32))
+    assert cache._total_bytes == 0
@@ -0,0 +1,102 @@
+"""
+后台任务队列测试：任务状态流转、阶段并发上限、重启后中断任务的识别
+"""
+
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from utils.job_queue import JobQueue
+from utils.metadata_store import get_metadata_store
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    # 元数据存储默认位于 data/metadata.db
+    monkeypatch.chdir(tmp_path)
+
+
+def test_job_lifecycle_and_stage_concurrency():
+    async def scenario():
+        queue = JobQueue({"stage": 1})
+        release = asyncio.Event()
+        seen = []
+
+        async def work(name, progress):
+            progress(1, 4)
+            await release.wait()
+            progress(4)
+            return {"name": name}
+
+        async def fail(progress):
+            raise Exception("处理失败")
+
+        first = queue.submit("stage", work, "a")
+        second = queue.submit("stage", work, "b")
+        failed = queue.submit("other", fail)
+        await asyncio.sleep(0.05)
+        seen.append((queue.get(first["job_id"])["status"], queue.get(second["job_id"])["status"]))
+        seen.append(queue.queue_depth())
+        seen.append(queue.get(first["job_id"])["progress"])
+        release.set()
+        while queue._tasks:
+            await asyncio.sleep(0.01)
+        return queue, first, second, failed, seen
+
+    queue, first, second, failed, seen = asyncio.run(scenario())
+    assert first["status"] == "queued"
+    # 阶段并发为 1：第二个任务排队
+    assert seen[0] == ("running", "queued")
+    assert seen[1] == {"stage": {"queued": 1, "running": 1}}
+    assert seen[2] == 25.0
+
+    done = queue.get(first["job_id"])
+    assert done["status"] == "success" and done["progress"] == 100.0
+    assert done["result"] == {"name": "a"} and done["finish_time"]
+    assert queue.get(second["job_id"])["result"] == {"name": "b"}
+    error = queue.get(failed["job_id"])
+    assert error["status"] == "error" and error["error_message"] == "处理失败"
+    # 结束的任务从内存移除，查询读存储
+    assert queue._jobs == {} and queue.queue_depth() == {}
+
+
+def _dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_orphaned_jobs_marked_interrupted_on_startup():
+    store = get_metadata_store()
+    host = socket.gethostname()
+    jobs = {
+        "dead": {"status": "running", "host": host, "pid": _dead_pid()},
+        "queued_dead": {"status": "queued", "host": host, "pid": _dead_pid()},
+        "same_pid": {"status": "running", "host": host, "pid": os.getpid()},
+        "legacy": {"status": "running"},
+        "alive": {"status": "running", "host": host, "pid": os.getppid()},
+        "other_host": {"status": "running", "host": host + "-other", "pid": 1},
+        "finished": {"status": "success", "host": host, "pid": _dead_pid()},
+    }
+    for job_id, job in jobs.items():
+        store.append("jobs", {"id": job_id, "stage": "text_chunk", **job})
+
+    queue = JobQueue()
+    statuses = {job_id: queue.get(job_id)["status"] for job_id in jobs}
+    assert statuses == {
+        "dead": "interrupted",
+        "queued_dead": "interrupted",
+        "same_pid": "interrupted",
+        "legacy": "interrupted",
+        "alive": "running",
+        "other_host": "running",
+        "finished": "success",
+    }
+    interrupted = queue.get("dead")
+    assert interrupted["error_message"] and interrupted["finish_time"]
+    # 再次启动不会重复处理
+    assert JobQueue()._recover_interrupted() == 0
@@ -0,0 +1,212 @@
+"""
+大模型客户端测试：共享流的回放、相同请求合并，以及订阅者全部断开时取消上游调用
+"""
+
+import asyncio
+from contextlib import aclosing
+from types import SimpleNamespace
+
+import pytest
+
+import services.llm_client as llm_client
+from services.llm_client import _SharedStream
+
+
+async def _collect(stream):
+    return [piece async for piece in stream]
+
+
+def test_late_subscriber_replays_all_pieces():
+    async def scenario():
+        shared = _SharedStream()
+        early = asyncio.create_task(_collect(shared.subscribe()))
+        await shared.publish("你")
+        await shared.publish("好")
+        await asyncio.sleep(0)
+        late = asyncio.create_task(_collect(shared.subscribe()))
+        await shared.publish("！")
+        await shared.publish(done=True)
+        return await early, await late, await _collect(shared.subscribe())
+
+    early, late, after_done = asyncio.run(scenario())
+    assert early == late == after_done == ["你", "好", "！"]
+
+
+def test_error_is_raised_after_replaying_pieces():
+    async def scenario():
+        shared = _SharedStream()
+        await shared.publish("部分")
+        await shared.publish(done=True, error=RuntimeError("上游断开"))
+        received = []
+        with pytest.raises(RuntimeError, match="上游断开"):
+            async for piece in shared.subscribe():
+                received.append(piece)
+        return received
+
+    assert asyncio.run(scenario()) == ["部分"]
+
+
+class FakeCompletions:
+    """按 fail 次数先抛出可重试错误，之后逐段产出 pieces"""
+
+    def __init__(self, pieces, fail=0):
+        self.pieces = pieces
+        self.fail = fail
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def create(self, model, messages, stream, **params):
+        self.calls += 1
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionError("暂时不可用")
+
+        async def chunks():
+            for piece in self.pieces:
+                await self.release.wait()
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+        return chunks()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    pytest.importorskip("openai")
+    monkeypatch.setattr(llm_client, "_retryable_errors", lambda: (ConnectionError,))
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE", 0)
+
+    def make(completions):
+        instance = llm_client.LLMClient(base_url="http://localhost:1/v1", api_key="test")
+        instance.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        return instance
+    return make
+
+
+MESSAGES = [{"role": "user", "content": "你好"}]
+
+
+def test_identical_requests_share_one_upstream_call(client):
+    async def scenario():
+        completions = FakeCompletions(["甲", "乙", "丙"])
+        instance = client(completions)
+        first = asyncio.create_task(instance.complete(MESSAGES, "m"))
+        second = asyncio.create_task(instance.complete(MESSAGES, "m"))
+        other = asyncio.create_task(instance.complete(MESSAGES, "m", temperature=0))
+        await asyncio.sleep(0.01)
+        completions.release.set()
+        results = await asyncio.gather(first, second, other)
+        await instance.close()
+        return results, completions.calls, instance.stats
+
+    results, calls, stats = asyncio.run(scenario())
+    assert results == ["甲乙丙"] * 3
+    # 参数不同的请求不合并
+    assert calls == 2
+    assert stats["requests"] == 3 and stats["coalesced"] == 1
+
+
+def test_retries_before_first_piece(client):
+    async def scenario():
+        completions = FakeCompletions(["好"], fail=2)
+        completions.release.set()
+        instance = client(completions)
+        result = await instance.complete(MESSAGES, "m")
+        await instance.close()
+        return result, instance.stats
+
+    result, stats = asyncio.run(scenario())
+    assert result == "好"
+    assert stats["retries"] == 2 and stats["upstream_calls"] == 3
+
+
+class EndlessCompletions:
+    """不断产出片段的上游，记录上游流是否被关闭"""
+
+    def __init__(self):
+        self.calls = 0
+        self.closed = asyncio.Event()
+
+    async def create(self, model, messages, stream, **params):
+        self.calls += 1
+
+        async def chunks():
+            try:
+                while True:
+                    await asyncio.sleep(0.01)
+                    yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="字"))])
+            finally:
+                self.closed.set()
+        return chunks()
+
+
+async def _read(stream, n):
+    """读取 n 个片段后停住，直到被取消（模拟客户端断开）"""
+    received = []
+    async with aclosing(stream):
+        async for piece in stream:
+            received.append(piece)
+            if len(received) == n:
+                await asyncio.sleep(3600)
+    return received
+
+
+def test_upstream_cancelled_when_all_subscribers_leave(client):
+    async def scenario():
+        completions = EndlessCompletions()
+        instance = client(completions)
+        readers = [asyncio.create_task(_read(instance.stream(MESSAGES, "m"), 2)) for _ in range(2)]
+        await asyncio.sleep(0.1)
+        readers[0].cancel()
+        await asyncio.sleep(0.05)
+        # 还有订阅者时上游继续
+        assert not completions.closed.is_set()
+        readers[1].cancel()
+        await asyncio.wait_for(completions.closed.wait(), 1)
+        await asyncio.gather(*readers, return_exceptions=True)
+        await asyncio.sleep(0)
+        inflight, tasks = dict(instance._inflight), set(instance._tasks)
+
+        # 之后相同的请求重新发起上游调用
+        again = asyncio.create_task(_read(instance.stream(MESSAGES, "m"), 1))
+        await asyncio.sleep(0.05)
+        again.cancel()
+        await asyncio.gather(again, return_exceptions=True)
+        await instance.close()
+        return inflight, tasks, completions.calls, instance.stats
+
+    inflight, tasks, calls, stats = asyncio.run(scenario())
+    assert inflight == {} and tasks == set()
+    assert calls == 2 and stats["cancelled"] == 2
+
+
+def test_cancelled_upstream_ends_subscribers(client):
+    async def scenario():
+        instance = client(EndlessCompletions())
+        reader = asyncio.create_task(instance.complete(MESSAGES, "m"))
+        await asyncio.sleep(0.05)
+        # 关闭客户端会取消在途的上游调用，订阅者收到错误而不是一直等待
+        await instance.close()
+        with pytest.raises(Exception, match="取消"):
+            await asyncio.wait_for(reader, 1)
+
+    asyncio.run(scenario())
+
+
+def test_backend_uses_client_recreated_after_close(client, monkeypatch):
+    from services.llm_backends import OpenAIBackend
+
+    async def scenario():
+        backend = OpenAIBackend()
+        first = client(FakeCompletions(["一"]))
+        first.client.chat.completions.release.set()
+        monkeypatch.setattr(llm_client, "_client", first)
+        answers = [await backend.complete(MESSAGES, "m")]
+        await llm_client.close_llm_client()
+
+        second = client(FakeCompletions(["二"]))
+        second.client.chat.completions.release.set()
+        monkeypatch.setattr(llm_client, "_client", second)
+        answers.append(await backend.complete(MESSAGES, "m"))
+        await second.close()
+        return answers
+
+    assert asyncio.run(scenario()) == ["一", "二"]
@@ -0,0 +1,83 @@
+"""
+元数据过滤索引测试：select 结果应与逐条判断过滤条件一致
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from services.metadata_index import MetadataIndex, FILTER_FIELDS
+
+
+def _chunks(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    chunks = []
+    for label in range(n):
+        metadata = {"source": rng.choice(["a.pdf", "b.pdf", "c.md"]), "chunk_type": rng.choice(["text", "table"])}
+        if rng.random() < 0.8:
+            metadata["page_number"] = rng.randint(1, 4)
+        chunks.append((label, {"seq": label * 2, "file_id": f"f{label % 3}", "metadata": metadata}))
+    return chunks
+
+
+def _matches(chunk, filters):
+    metadata = {**chunk["metadata"], "file_id": chunk["file_id"]}
+    for field, values in filters.items():
+        values = values if isinstance(values, list) else [values]
+        if field not in metadata or str(metadata[field]) not in {str(v) for v in values}:
+            return False
+    return True
+
+
+CHUNKS = _chunks(200)
+
+
+@pytest.fixture(scope="module")
+def index():
+    return MetadataIndex.build(len(CHUNKS), iter(CHUNKS))
+
+
+@pytest.mark.parametrize("filters", [
+    {"source": "a.pdf"},
+    {"source": ["a.pdf", "c.md"]},
+    {"source": "b.pdf", "chunk_type": "table"},
+    {"page_number": 2, "file_id": ["f0", "f2"]},
+    {"page_number": "3"},
+    {"source": "missing.pdf"},
+    {"source": "a.pdf", "chunk_type": []},
+])
+def test_select_matches_linear_scan(index, filters):
+    expected = [label for label, chunk in CHUNKS if _matches(chunk, filters)]
+    selected = index.select(filters)
+    assert selected.tolist() == expected
+    assert np.all(np.diff(selected) > 0)
+
+
+def test_empty_filters_select_everything(index):
+    assert index.select({}).tolist() == list(range(len(CHUNKS)))
+
+
+def test_unknown_field(index):
+    with pytest.raises(ValueError):
+        index.select({"author": "x"})
+
+
+def test_labels_without_chunks_never_match():
+    # 标签 1 在索引中但没有分块（例如已删除的向量），不应出现在任何取值下
+    chunks = [(0, {"seq": 0, "file_id": "f", "metadata": {"source": "a"}}),
+              (2, {"seq": 5, "file_id": "f", "metadata": {"source": "a"}})]
+    index = MetadataIndex.build(3, iter(chunks))
+    assert index.select({"source": "a"}).tolist() == [0, 2]
+    assert index.select({"file_id": "f"}).tolist() == [0, 2]
+    assert index.seqs.tolist() == [0, -1, 5]
+
+
+def test_save_and_load_roundtrip(index, tmp_path):
+    index.save(tmp_path)
+    loaded = MetadataIndex.load(tmp_path)
+    filters = {"source": ["b.pdf", "c.md"], "page_number": 1}
+    assert loaded.select(filters).tolist() == index.select(filters).tolist()
+    assert np.array_equal(loaded.seqs, index.seqs)
+    assert set(loaded.values) == set(FILTER_FIELDS)
+    assert MetadataIndex.load(tmp_path / "missing") is None
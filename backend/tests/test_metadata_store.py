@@ -0,0 +1,93 @@
+"""
+SQLite 元数据存储测试
+"""
+
+import json
+import threading
+
+import pytest
+
+from utils.metadata_store import MetadataStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MetadataStore(tmp_path / "metadata.db")
+
+
+def test_append_get_list_order_and_paging(store):
+    for i in range(5):
+        store.append("files", {"id": f"f{i}", "n": i})
+    assert store.get("files", "f3") == {"id": "f3", "n": 3}
+    assert store.get("files", "missing") is None
+    assert [r["n"] for r in store.list("files")] == [0, 1, 2, 3, 4]
+    assert [r["n"] for r in store.list("files", offset=1, limit=2)] == [1, 2]
+    assert [r["n"] for r in store.list("files", limit=2, desc=True)] == [4, 3]
+    assert store.count("files") == 5
+
+
+def test_update_merges_fields(store):
+    store.append("files", {"id": "f", "status": "processing", "name": "a.pdf"})
+    updated = store.update("files", "f", {"status": "success", "size": 10})
+    assert updated == {"id": "f", "status": "success", "name": "a.pdf", "size": 10}
+    assert store.get("files", "f") == updated
+    assert store.update("files", "missing", {"status": "x"}) is None
+
+
+def test_find_by_field(store):
+    store.create_index("jobs", "status")
+    for i, status in enumerate(["success", "error", "success", "success"]):
+        store.append("jobs", {"id": f"j{i}", "status": status})
+    assert [r["id"] for r in store.find("jobs", "status", "success")] == ["j0", "j2", "j3"]
+    assert [r["id"] for r in store.find("jobs", "status", "success", limit=1, desc=True)] == ["j3"]
+    assert store.find("jobs", "status", "missing") == []
+    with pytest.raises(ValueError):
+        store.find("jobs", "status; DROP", "x")
+
+
+def test_increment_respects_floor(store):
+    store.append("collections", {"id": "c", "version": 3})
+    assert store.increment("collections", "c", "next_version", floor=3) == 4
+    assert store.increment("collections", "c", "next_version", floor=3) == 5
+    assert store.get("collections", "c")["next_version"] == 5
+    assert store.increment("collections", "missing", "next_version") is None
+
+
+def test_increment_is_atomic_across_connections(tmp_path):
+    # 每个线程使用独立的连接，相当于多个进程共享同一个数据库文件
+    MetadataStore(tmp_path / "metadata.db").append("collections", {"id": "c"})
+    stores = [MetadataStore(tmp_path / "metadata.db") for _ in range(4)]
+    values = []
+
+    def worker(store):
+        for _ in range(25):
+            values.append(store.increment("collections", "c", "next_version"))
+
+    threads = [threading.Thread(target=worker, args=(s,)) for s in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(values) == list(range(1, 101))
+
+
+def test_append_many_ignores_existing_and_delete(store):
+    store.append("files", {"id": "a", "v": 1})
+    assert store.append_many("files", [{"id": "a", "v": 2}, {"id": "b", "v": 1}]) == 1
+    assert store.get("files", "a")["v"] == 1
+    assert store.delete("files", "a") is True
+    assert store.delete("files", "a") is False
+    assert [r["id"] for r in store.list("files")] == ["b"]
+
+
+def test_migrate_json_runs_once(store, tmp_path):
+    path = tmp_path / "old.json"
+    path.write_text(json.dumps([{"id": "x"}, {"id": "y"}, {"name": "no id"}]), encoding="utf-8")
+    assert store.migrate_json("files", path) == 2
+    assert store.migrate_json("files", path) == 0
+    assert store.count("files") == 2
+
+
+def test_invalid_table_name(store):
+    with pytest.raises(ValueError):
+        store.append("bad-name", {"id": "x"})
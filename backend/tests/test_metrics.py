@@ -0,0 +1,95 @@
+"""
+运行指标测试：计数器与直方图的 Prometheus 文本格式、阶段计时的状态，以及采集函数
+"""
+
+import asyncio
+
+import pytest
+
+from utils.metrics import (
+    MetricsRegistry, STAGE_ITEMS, STAGE_LATENCY, cache_metrics, queue_metrics, span, traced
+)
+
+
+def _samples(text: str) -> dict:
+    """解析导出文本中的样本行：{名称{标签}: 值}"""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_counter_and_histogram_render():
+    registry = MetricsRegistry()
+    counter = registry.counter("jobs_total", "任务数", ("stage",))
+    counter.inc(stage="chunk")
+    counter.inc(2, stage="chunk")
+    assert registry.counter("jobs_total", "任务数", ("stage",)) is counter
+
+    histogram = registry.histogram("latency_seconds", "耗时", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value, route='/a"b')
+
+    text = registry.render()
+    assert "# TYPE jobs_total counter" in text and "# TYPE latency_seconds histogram" in text
+    samples = _samples(text)
+    assert samples['jobs_total{stage="chunk"}'] == 3
+    # 桶为累积计数，标签值中的引号被转义
+    assert samples['latency_seconds_bucket{route="/a\\"b",le="0.1"}'] == 1
+    assert samples['latency_seconds_bucket{route="/a\\"b",le="1.0"}'] == 3
+    assert samples['latency_seconds_bucket{route="/a\\"b",le="+Inf"}'] == 4
+    assert samples['latency_seconds_count{route="/a\\"b"}'] == 4
+    assert samples['latency_seconds_sum{route="/a\\"b"}'] == pytest.approx(4.05)
+
+
+def _stage_count(stage: str, status: str) -> int:
+    series = STAGE_LATENCY._series.get((stage, status))
+    return series[2] if series else 0
+
+
+def test_span_records_status_and_items():
+    with span("test.ok") as record:
+        record.items = 3
+    with pytest.raises(ValueError):
+        with span("test.error"):
+            raise ValueError("失败")
+    with pytest.raises(asyncio.CancelledError):
+        with span("test.cancelled"):
+            raise asyncio.CancelledError()
+
+    assert _stage_count("test.ok", "success") == 1
+    assert _stage_count("test.error", "error") == 1
+    assert _stage_count("test.cancelled", "cancelled") == 1
+    assert STAGE_ITEMS._values[("test.ok",)] == 3
+
+
+def test_traced_counts_items_from_result():
+    @traced("test.traced", items=lambda result: len(result))
+    async def work(n):
+        return list(range(n))
+
+    assert asyncio.run(work(4)) == [0, 1, 2, 3]
+    assert _stage_count("test.traced", "success") == 1
+    assert STAGE_ITEMS._values[("test.traced",)] == 4
+
+    with pytest.raises(TypeError):
+        traced("test.sync")(lambda: None)
+
+
+def test_collectors():
+    registry = MetricsRegistry()
+    registry.register_collector(lambda: cache_metrics({
+        "search": {"hits": 3, "misses": 1, "hit_rate": 0.75, "items": 2},
+        "answer": None
+    }))
+    registry.register_collector(lambda: queue_metrics({"text_chunk": {"queued": 2, "running": 1}}))
+    registry.register_collector(lambda: 1 / 0)
+
+    samples = _samples(registry.render())
+    assert samples['rag_cache_hit_ratio{cache="search"}'] == 0.75
+    assert samples['rag_cache_items{cache="search"}'] == 2
+    assert not any('cache="answer"' in name for name in samples)
+    assert samples['rag_job_queue_depth{stage="text_chunk",status="queued"}'] == 2
+    assert samples['rag_job_queue_depth{stage="text_chunk",status="running"}'] == 1
@@ -0,0 +1,94 @@
+"""
+采样剖析测试：结果在后台写入线程中保存，后台任务不占用接口请求的剖析名额，旧剖析按保留策略清理
+"""
+
+import threading
+import time
+
+import pytest
+
+import utils.profiling as profiling
+from utils.profiling import Profiler
+
+
+@pytest.fixture
+def profiler(tmp_path):
+    profiler = Profiler(tmp_path / "profiles")
+    profiler.configure(routes=["/api/search", "job:text_chunk"], sample_rate=1.0, interval=0.001)
+    return profiler
+
+
+def _busy_work(seconds: float = 0.02):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+
+
+def test_profile_saved_by_writer_thread(profiler, monkeypatch):
+    writers = []
+    original = profiler._write
+
+    def recording_write(*args):
+        writers.append(threading.current_thread().name)
+        return original(*args)
+
+    monkeypatch.setattr(profiler, "_write", recording_write)
+    with profiler.profile("/api/search", {"top_k": 5}) as capture:
+        assert capture is not None
+        _busy_work()
+        capture["tags"]["status_code"] = 200
+    profiler.flush()
+
+    assert len(writers) == 1 and writers[0].startswith("profile-writer")
+    [meta] = profiler.list_profiles()
+    assert meta["target"] == "/api/search" and meta["status"] == "success"
+    assert meta["tags"] == {"top_k": 5, "status_code": 200}
+    assert profiler.profile_path(meta["id"]).exists() and profiler.captured == 1
+
+
+def test_untargeted_routes_are_not_profiled(profiler):
+    with profiler.profile("/api/other") as capture:
+        assert capture is None
+    with profiler.profile(None) as capture:
+        assert capture is None
+
+
+def test_job_does_not_block_route_sampling(profiler):
+    profiler.configure(mode="cprofile")
+    with profiler.profile("job:text_chunk", {"job_id": "j1"}) as job:
+        assert job is not None
+        # 后台任务运行期间，接口请求仍可被剖析；同类剖析同一时刻只有一个
+        with profiler.profile("/api/search") as route:
+            assert route is not None
+            _busy_work()
+        with profiler.profile("job:text_chunk") as other_job:
+            assert other_job is None
+        _busy_work()
+    profiler.flush()
+
+    assert profiler.skipped_busy == 1
+    files = {meta["target"]: meta for meta in profiler.list_profiles()}
+    # 后台任务总是用 sample 模式，接口请求按配置使用 cprofile
+    assert files["job:text_chunk"]["mode"] == "sample" and files["job:text_chunk"]["file"].endswith(".collapsed")
+    assert files["/api/search"]["mode"] == "cprofile" and files["/api/search"]["file"].endswith(".prof")
+
+
+def test_error_status_recorded(profiler):
+    with pytest.raises(ValueError):
+        with profiler.profile("/api/search"):
+            raise ValueError("失败")
+    profiler.flush()
+    assert profiler.list_profiles()[0]["status"] == "error"
+    # 名额已释放
+    with profiler.profile("/api/search") as capture:
+        assert capture is not None
+
+
+def test_retention_keeps_newest_files(profiler, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_MAX_FILES", 2)
+    for i in range(4):
+        with profiler.profile("/api/search", {"i": i}):
+            pass
+    profiler.flush()
+    assert [meta["tags"]["i"] for meta in profiler.list_profiles()] == [3, 2]
+    assert len([p for p in profiler.profiles_dir.iterdir() if p.name != "config.json"]) == 4
@@ -0,0 +1,123 @@
+"""
+向量量化测试：int8 / PQ 编码误差与打分，以及量化索引的精排
+"""
+
+import numpy as np
+import pytest
+
+from services.quantization import ScalarQuantizer, ProductQuantizer, resolve_quantization
+from services.vector_index import create_index, read_index
+from utils.vector_store import VectorWriter, open_vectors
+
+
+def _unit_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_resolve_quantization():
+    assert resolve_quantization(None) is None
+    assert resolve_quantization("None") is None
+    assert resolve_quantization("SQ8") == "int8"
+    assert resolve_quantization("product") == "pq"
+    with pytest.raises(ValueError):
+        resolve_quantization("int4")
+
+
+def test_int8_reconstruction_and_scores():
+    vectors = _unit_vectors(500, 32)
+    quantizer = ScalarQuantizer(32)
+    quantizer.train(vectors)
+    codes = quantizer.encode(vectors)
+    assert codes.dtype == np.uint8 and codes.shape == (500, 32)
+
+    decoded = quantizer.vmin + codes.astype(np.float32) * quantizer.scale
+    assert np.all(np.abs(decoded - vectors) <= quantizer.scale / 2 + 1e-6)
+    queries = vectors[:5]
+    assert np.allclose(quantizer.scores(queries, codes), queries @ decoded.T, atol=1e-4)
+
+
+def test_int8_constant_dimension_does_not_divide_by_zero():
+    vectors = _unit_vectors(50, 8)
+    vectors[:, 3] = 0.25
+    quantizer = ScalarQuantizer(8)
+    quantizer.train(vectors)
+    decoded = quantizer.vmin + quantizer.encode(vectors).astype(np.float32) * quantizer.scale
+    assert np.allclose(decoded[:, 3], 0.25)
+
+
+def test_pq_scores_match_reconstruction():
+    vectors = _unit_vectors(600, 32)
+    quantizer = ProductQuantizer(32, m=4)
+    quantizer.train(vectors)
+    codes = quantizer.encode(vectors)
+    assert codes.shape == (600, 4) and quantizer.code_size == 4
+
+    decoded = np.concatenate([quantizer.centroids[j, codes[:, j]] for j in range(4)], axis=1)
+    queries = vectors[:5]
+    assert np.allclose(quantizer.scores(queries, codes), queries @ decoded.T, atol=1e-4)
+    # 量化误差明显小于向量本身的范数
+    assert np.mean(np.linalg.norm(decoded - vectors, axis=1)) < 0.8
+
+
+def test_pq_subspaces_and_small_training_set():
+    assert ProductQuantizer(48, m=5).m == 6
+    vectors = _unit_vectors(40, 16)
+    quantizer = ProductQuantizer(16, m=2)
+    quantizer.train(vectors)
+    # 样本少于 256 时未训练的中心不会被选中
+    assert quantizer.encode(vectors).max() < 40
+
+
+def _vector_file(tmp_path, vectors):
+    writer = VectorWriter(tmp_path / "vectors" / "run", vectors.shape[1])
+    writer.append([f"c{i}" for i in range(len(vectors))], vectors)
+    writer.close()
+    return open_vectors(tmp_path / "vectors" / "run")
+
+
+@pytest.mark.parametrize("quantization", ["int8", "pq"])
+@pytest.mark.parametrize("index_type", ["flat", "ivf"])
+def test_quantized_search_is_reranked_with_exact_scores(tmp_path, index_type, quantization):
+    vectors = _unit_vectors(2000, 32)
+    index = create_index(index_type, 32, quantization)
+    index.build(_vector_file(tmp_path, vectors))
+    queries = vectors[:20]
+
+    scores, labels = index.search(queries, 10)
+    # 返回的得分是原始向量的精确内积，而不是编码上的近似值
+    exact = np.take_along_axis(queries @ vectors.T, labels, axis=1)
+    assert np.allclose(scores, exact, atol=1e-5)
+    assert np.all(np.diff(scores, axis=1) <= 1e-6)
+    assert labels[:, 0].tolist() == list(range(20))
+
+    # IVF 保存时按倒排列表重排行，标签会变化，按向量ID比较
+    result_ids = [[index.ids[label] for label in row] for row in labels]
+    index.save(tmp_path / "index")
+    loaded = read_index(tmp_path / "index")
+    assert loaded.quantization["kind"] == quantization
+    assert [[loaded.ids[label] for label in row] for row in loaded.search(queries, 10)[1]] == result_ids
+
+
+def test_quantization_reduces_resident_memory(tmp_path):
+    vectors = _unit_vectors(1000, 64)
+    plain = create_index("flat", 64)
+    plain.build(_vector_file(tmp_path, vectors))
+    quantized = create_index("flat", 64, "int8")
+    quantized.build(_vector_file(tmp_path, vectors))
+    assert plain.memory_report()["compression_ratio"] == 1.0
+    assert quantized.memory_report()["compression_ratio"] > 3.5
+    assert quantized.recall_report(10, 50)["recall"] >= 0.9
+
+
+def test_rerank_skips_padding():
+    vectors = _unit_vectors(100, 16)
+    index = create_index("flat", 16, "int8")
+    index.ids = [f"c{i}" for i in range(100)]
+    index._delta = [vectors]
+    index.deleted = np.zeros(100, dtype=bool)
+    candidates = np.array([[5, 3, -1, -1], [-1, -1, -1, -1]])
+    scores, labels = index._rerank(vectors[[3, 7]], candidates, 3)
+    assert labels[0, 0] == 3 and set(labels[0, :2]) == {3, 5}
+    assert labels[0, 2] == -1 and np.isneginf(scores[0, 2])
+    assert np.all(labels[1] == -1)
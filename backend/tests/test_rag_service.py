@@ -0,0 +1,78 @@
+"""
+检索增强问答测试：检索结果在进程内直接交给生成服务，事件顺序、引用与各阶段耗时
+"""
+
+import asyncio
+
+import pytest
+
+from services.generation_service import GenerationService
+from services.llm_backends import MockBackend
+from services.rag_service import RAGService
+
+
+class StubRetrieval:
+    def __init__(self, results):
+        self.results = results
+        self.calls = []
+
+    async def search(self, query, top_k=5, collection_name=None, mode="hybrid", filters=None):
+        self.calls.append((query, top_k, collection_name, mode, filters))
+        return {"search_id": "s1", "collection": "col", "mode": mode,
+                "cache_hit": False, "results": self.results[:top_k]}
+
+
+RESULTS = [
+    {"id": f"c{i}", "content": f"第{i}段：检索增强生成把检索到的分块放入提示词。", "score": 0.9 - i / 10,
+     "metadata": {"source": f"doc{i}.md", "file_id": f"f{i}"}}
+    for i in range(3)
+]
+
+
+@pytest.fixture
+def rag(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    generation = GenerationService()
+    generation.backend = MockBackend(token_delay=0)
+    generation.answer_cache = None
+    return RAGService(StubRetrieval(RESULTS), generation)
+
+
+def test_stream_events_and_citations(rag):
+    async def scenario():
+        return [event async for event in rag.query_stream("什么是RAG", top_k=2, mode="vector",
+                                                          filters={"source": ["doc0.md"]})]
+
+    events = asyncio.run(scenario())
+    names = [name for name, _ in events]
+    assert names[:3] == ["retrieval", "start", "context"] and names[-1] == "done"
+    assert set(names[3:-1]) == {"token"}
+    assert rag.retrieval.calls == [("什么是RAG", 2, None, "vector", {"source": ["doc0.md"]})]
+
+    retrieval = events[0][1]
+    assert retrieval["search_id"] == "s1" and retrieval["result_count"] == 2
+    done = events[-1][1]
+    # 回答的引用来自检索结果，且拼接的 token 即完整回答
+    assert [c["ids"] for c in done["citations"]] == [["c0"], ["c1"]]
+    assert done["generated_content"] == "".join(data["content"] for name, data in events if name == "token")
+    assert done["search_id"] == "s1" and done["total_ms"] >= retrieval["elapsed_ms"]
+
+
+def test_query_collects_result(rag):
+    result = asyncio.run(rag.query("什么是RAG", top_k=3))
+    assert result["retrieval"]["result_count"] == 3
+    assert result["generated_content"] and len(result["citations"]) == 3
+    assert result["generation_id"] and result["search_id"] == "s1"
+
+
+def test_disconnect_records_cancelled_generation(rag):
+    async def scenario():
+        stream = rag.query_stream("什么是RAG")
+        async for name, _ in stream:
+            if name == "token":
+                break
+        await stream.aclose()
+
+    asyncio.run(scenario())
+    [record] = rag.generation.store.list("generation_history")
+    assert record["status"] == "cancelled" and record["context_used"] == 3
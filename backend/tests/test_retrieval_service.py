@@ -0,0 +1,111 @@
+"""
+检索服务测试：向量检索结果与暴力检索一致，批量检索、元数据过滤与结果缓存
+"""
+
+import asyncio
+
+import numpy as np
+import pytest
+
+import services.vector_db_service as vector_db_service
+from services.retrieval_service import RetrievalService
+from utils.vector_store import VectorWriter
+
+
+DIM = 16
+N = 300
+
+
+class StubEngine:
+    """查询 "q{i}" 的向量为第 i 个查询向量"""
+
+    cache = None
+
+    def __init__(self, queries: np.ndarray):
+        self.queries = queries
+        self.calls = 0
+
+    def embed(self, texts, model=None, batch_size=None):
+        self.calls += 1
+        return self.queries[[int(text[1:]) for text in texts]]
+
+
+def _unit_vectors(n: int, seed: int) -> np.ndarray:
+    vectors = np.random.default_rng(seed).normal(size=(n, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+VECTORS = _unit_vectors(N, 0)
+QUERIES = _unit_vectors(10, 1)
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(vector_db_service, "RECALL_EVAL", "off")
+    retrieval = RetrievalService()
+    retrieval.engine = StubEngine(QUERIES)
+
+    retrieval.chunk_store.add_many("run1", [
+        {"seq": i, "id": f"c{i}", "file_id": f"f{i % 3}", "content": f"分块 {i}",
+         "metadata": {"source": f"doc{i % 3}.md"}}
+        for i in range(N)
+    ])
+    writer = VectorWriter(retrieval.data_dir / "vectors" / "v1", DIM)
+    writer.append([f"c{i}" for i in range(N)], VECTORS)
+    writer.close()
+    retrieval.store.append("vector_info", {
+        "id": "vi1", "status": "success", "vector_path": "data/vectors/v1",
+        "chunk_id": "run1", "model": "m", "dimension": DIM
+    })
+    asyncio.run(retrieval.vector_db.store_vectors("flat", "col", "vi1"))
+    return retrieval
+
+
+def _expected(query_index: int, k: int, allowed=None):
+    scores = VECTORS @ QUERIES[query_index]
+    if allowed is not None:
+        scores = np.where(allowed, scores, -np.inf)
+    return [f"c{i}" for i in np.argsort(-scores)[:k]]
+
+
+def test_search_returns_exact_top_k(service):
+    result = asyncio.run(service.search("q0", top_k=5, collection_name="col", mode="vector"))
+    assert [r["id"] for r in result["results"]] == _expected(0, 5)
+    scores = [r["score"] for r in result["results"]]
+    assert scores == sorted(scores, reverse=True)
+    first = result["results"][0]
+    assert first["content"] == f"分块 {first['id'][1:]}" and first["metadata"]["source"].startswith("doc")
+    assert result["cache_hit"] is False
+
+    # 相同查询命中缓存，不再向量化
+    again = asyncio.run(service.search("q0", top_k=5, collection_name="col", mode="vector"))
+    assert again["cache_hit"] is True and again["results"] == result["results"]
+    assert service.engine.calls == 1
+
+
+def test_batch_search_matches_single_queries(service):
+    queries = [f"q{i}" for i in range(10)]
+    result = asyncio.run(service.search_batch(queries, top_k=3, collection_name="col", mode="vector"))
+    assert [r["query"] for r in result["results"]] == queries
+    for i, item in enumerate(result["results"]):
+        assert [r["id"] for r in item["results"]] == _expected(i, 3)
+    # 整批一次向量化
+    assert service.engine.calls == 1
+
+
+def test_filters_restrict_results(service):
+    result = asyncio.run(service.search(
+        "q2", top_k=5, collection_name="col", mode="vector", filters={"source": ["doc1.md"]}
+    ))
+    allowed = np.arange(N) % 3 == 1
+    assert [r["id"] for r in result["results"]] == _expected(2, 5, allowed)
+
+
+def test_invalid_requests(service):
+    with pytest.raises(Exception, match="不能为空"):
+        asyncio.run(service.search("  ", collection_name="col"))
+    with pytest.raises(Exception, match="top_k"):
+        asyncio.run(service.search("q0", top_k=0, collection_name="col"))
+    with pytest.raises(Exception, match="集合不存在"):
+        asyncio.run(service.search("q0", collection_name="missing"))
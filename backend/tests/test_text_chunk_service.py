@@ -0,0 +1,98 @@
+"""
+分块服务测试：文件部分章节变化时只重新切分变化的章节
+"""
+
+import asyncio
+import hashlib
+import json
+
+import pytest
+
+import services.bm25_index as bm25_index
+import services.text_chunk_service as text_chunk_service
+from services.text_chunk_service import TextChunkService
+
+
+SECTIONS = [
+    "第一章讲述向量数据库的基本概念。索引结构决定了检索速度。" * 6,
+    "第二章讨论文本分块。块太大影响召回，块太小丢失上下文。" * 6,
+    "第三章介绍嵌入模型与缓存。相同文本只计算一次向量。" * 6,
+]
+
+
+def _write_file(store, tmp_path, file_id, sections, previous_hashes=()):
+    chunks = []
+    for i, content in enumerate(sections):
+        content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        chunks.append({
+            "id": f"section_{i}",
+            "content": content,
+            "metadata": {"page_number": i + 1},
+            "content_hash": content_hash,
+            "changed": content_hash not in previous_hashes
+        })
+    path = tmp_path / f"{file_id}.json"
+    path.write_text(json.dumps({"chunks": chunks, "metadata": {}}, ensure_ascii=False), encoding="utf-8")
+    record = {
+        "id": file_id,
+        "status": "success",
+        "processed_data_path": str(path),
+        "content_hash": hashlib.sha256("".join(sections).encode("utf-8")).hexdigest()
+    }
+    if store.get("file_info", file_id):
+        store.update("file_info", file_id, record)
+    else:
+        store.append("file_info", record)
+    return {c["content_hash"] for c in chunks}
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # BM25 索引是进程级单例，指向本测试的临时目录
+    monkeypatch.setattr(bm25_index, "_index", None)
+    return TextChunkService()
+
+
+def test_only_changed_section_is_rechunked(service, tmp_path, monkeypatch):
+    hashes = _write_file(service.store, tmp_path, "f1", SECTIONS)
+    first = asyncio.run(service.process_chunk("sentence", 40, 10))
+    before = service.chunk_store.list_chunks(first["chunk_id"], limit=1000)
+
+    edited = list(SECTIONS)
+    edited[1] = "第二章改写了：分块大小应按模型上下文选择。重叠可以保留句子的完整性。" * 6
+    _write_file(service.store, tmp_path, "f1", edited, previous_hashes=hashes)
+
+    split_texts = []
+    original = text_chunk_service.chunk_text
+
+    def recording_chunk_text(text, *args, **kwargs):
+        if text:
+            split_texts.append(text)
+        return original(text, *args, **kwargs)
+
+    monkeypatch.setattr(text_chunk_service, "chunk_text", recording_chunk_text)
+    second = asyncio.run(service.process_chunk("sentence", 40, 10))
+
+    assert split_texts == [edited[1]]
+    assert second["reused_files"] == 0 and second["reused_sections"] == 2
+    after = service.chunk_store.list_chunks(second["chunk_id"], limit=1000)
+
+    # 未变化章节的分块（ID、内容、位置）与上一次相同，seq 连续
+    def by_section(chunks, section_id):
+        return [(c["id"], c["content"], c["start_pos"], c["end_pos"])
+                for c in chunks if c["metadata"]["section_id"] == section_id]
+
+    for section_id in ("section_0", "section_2"):
+        assert by_section(after, section_id) == by_section(before, section_id)
+    assert [c["seq"] for c in after] == list(range(len(after)))
+    assert all(c["content"] in edited[1] for c in after if c["metadata"]["section_id"] == "section_1")
+
+    # 与不复用、整体重新切分的结果一致
+    monkeypatch.setattr(text_chunk_service, "chunk_text", original)
+    full = list(service._iter_file_chunks(service.store.get("file_info", "f1"), {
+        "method": "sentence", "chunk_size": 40, "overlap_size": 10, "chunk_unit": "char", "encoding_model": None
+    }))
+    assert [(c["id"], c["content"]) for c in after] == [(c["id"], c["content"]) for c in full]
+    # 复用的分块也写入了关键词索引
+    assert service.bm25.search(second["chunk_id"], "嵌入模型", 3)
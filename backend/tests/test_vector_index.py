@@ -0,0 +1,158 @@
+"""
+向量索引测试：flat / IVF / HNSW 与暴力检索结果对比，保存后重新读取，集合版本的分配与旧版本清理
+"""
+
+import asyncio
+
+import numpy as np
+import pytest
+
+import services.vector_db_service as vector_db_service
+from services.vector_db_service import VectorDBService
+from services.vector_index import VectorIndex, create_index, read_index, top_k
+from utils.chunk_store import get_chunk_store
+from utils.vector_store import VectorWriter, open_vectors
+
+
+DIM = 16
+N = 600
+
+
+def _unit_vectors(n: int, dim: int = DIM, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _write_vectors(prefix, vectors):
+    writer = VectorWriter(prefix, vectors.shape[1])
+    writer.append([f"c{i}" for i in range(len(vectors))], vectors)
+    writer.close()
+    return open_vectors(prefix)
+
+
+def _brute_force(vectors, queries, k):
+    return top_k(queries @ vectors.T, k)[1]
+
+
+def _recall(labels, expected):
+    return np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(labels.tolist(), expected.tolist())])
+
+
+def test_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        VectorIndex(DIM)
+
+
+@pytest.mark.parametrize("index_type,min_recall", [("flat", 1.0), ("ivf", 0.9), ("hnsw", 0.9)])
+def test_search_matches_brute_force(tmp_path, index_type, min_recall):
+    vectors = _unit_vectors(N)
+    queries = _unit_vectors(20, seed=1)
+    expected = _brute_force(vectors, queries, 10)
+
+    index = create_index(index_type, DIM)
+    index.build(_write_vectors(tmp_path / "vec", vectors))
+    scores, labels = index.search(queries, 10)
+    assert labels.shape == (20, 10)
+    assert _recall(labels, expected) >= min_recall
+    # 返回的得分就是内积，且按降序排列
+    assert np.allclose(scores, np.take_along_axis(queries @ vectors.T, labels, axis=1), atol=1e-5)
+    assert np.all(np.diff(scores, axis=1) <= 1e-6)
+
+    # 保存后重新读取，检索结果（按分块ID）不变
+    ids = [index.ids_for(row) for row in labels]
+    index.save(tmp_path / "index")
+    reloaded = read_index(tmp_path / "index")
+    assert len(reloaded) == N
+    assert [reloaded.ids_for(row) for row in reloaded.search(queries, 10)[1]] == ids
+
+
+def test_ivf_probing_every_list_is_exact(tmp_path):
+    vectors = _unit_vectors(N)
+    queries = _unit_vectors(20, seed=1)
+    index = create_index("ivf", DIM)
+    index.build(_write_vectors(tmp_path / "vec", vectors))
+    index.nprobe = len(index.centroids)
+    assert np.array_equal(index.search(queries, 10)[1], _brute_force(vectors, queries, 10))
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw"])
+def test_add_delete_and_filter(tmp_path, index_type):
+    vectors = _unit_vectors(N)
+    extra = _unit_vectors(50, seed=2)
+    index = create_index(index_type, DIM)
+    index.build(_write_vectors(tmp_path / "vec", vectors))
+    index.add([f"x{i}" for i in range(50)], extra)
+    assert index.delete(["c0", "c1", "missing"]) == 2
+    assert len(index) == N + 48
+
+    # 以新增的向量本身为查询，应命中自己；已删除的向量不再返回
+    _, labels = index.search(extra[:5], 1)
+    assert [index.ids_for(row)[0] for row in labels] == [f"x{i}" for i in range(5)]
+    _, labels = index.search(vectors[:2], 5)
+    assert not {"c0", "c1"} & {i for row in labels for i in index.ids_for(row)}
+
+    # 过滤掩码之外的标签不返回
+    allowed = np.zeros(len(index.ids), dtype=bool)
+    allowed[10:20] = True
+    _, labels = index.search(vectors[10:11], 5, allowed=allowed)
+    assert set(labels[0][labels[0] >= 0].tolist()) <= set(range(10, 20))
+    assert labels[0][0] == 10
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(vector_db_service, "RECALL_EVAL", "off")
+    svc = VectorDBService()
+    get_chunk_store(svc.data_dir / "chunks" / "chunk_store.db").add_many(
+        "run1", [{"seq": i, "id": f"c{i}", "file_id": "f", "content": f"文本 {i}"} for i in range(N)]
+    )
+    _write_vectors(svc.data_dir / "vectors" / "v1", _unit_vectors(N))
+    svc.store.append("vector_info", {
+        "id": "vi1", "status": "success", "vector_path": "data/vectors/v1",
+        "chunk_id": "run1", "model": "m", "dimension": DIM
+    })
+    return svc
+
+
+def _versions(svc, name):
+    collection = svc.get_collection(name)
+    return collection, sorted(int(p.name[1:]) for p in (svc.indexes_dir / collection["id"]).iterdir())
+
+
+def test_versions_are_reserved_and_old_ones_pruned(service, monkeypatch):
+    monkeypatch.setattr(vector_db_service, "INDEX_KEEP_VERSIONS", 2)
+
+    async def scenario():
+        first = await service.store_vectors("flat", "col", "vi1")
+        # 并发构建同一集合：每个构建分到不同的版本号
+        results = await asyncio.gather(
+            *[service.store_vectors("flat", "col", "vi1") for _ in range(3)], return_exceptions=True
+        )
+        return first, results
+
+    first, results = asyncio.run(scenario())
+    assert first["version"] == 1 and first["vector_count"] == N
+    versions = [r["version"] for r in results if isinstance(r, dict)]
+    assert len(set(versions)) == len(versions) and min(versions) > 1
+    # 被更新版本抢先切换的构建报错，不会覆盖集合
+    assert all("更新的版本" in str(r) for r in results if not isinstance(r, dict))
+
+    collection, on_disk = _versions(service, "col")
+    assert collection["version"] == 4 == max(on_disk)
+    # 只保留当前版本和上一个版本（被丢弃的构建结果已删除）
+    assert min(on_disk) >= 3
+    assert len(service.get_index(collection)) == N
+
+
+@pytest.mark.parametrize("keep,expected", [(2, [4, 5]), (3, [3, 4, 5])])
+def test_sequential_builds_keep_recent_versions(service, monkeypatch, keep, expected):
+    monkeypatch.setattr(vector_db_service, "INDEX_KEEP_VERSIONS", keep)
+
+    async def scenario():
+        for _ in range(5):
+            await service.store_vectors("flat", "col", "vi1")
+
+    asyncio.run(scenario())
+    collection, on_disk = _versions(service, "col")
+    assert collection["version"] == 5 and on_disk == expected
@@ -0,0 +1,91 @@
+"""
+向量文件存储测试：float32/float16 写入后经内存映射读回，未关闭的写入对读者不可见
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from utils.vector_store import VectorWriter, open_vectors
+
+
+DIM = 8
+
+
+def _write(prefix, dtype, batches):
+    writer = VectorWriter(prefix, DIM, dtype)
+    for ids, vectors in batches:
+        writer.append(ids, vectors)
+    return writer.close()
+
+
+@pytest.mark.parametrize("dtype,atol", [("float32", 0.0), ("float16", 1e-3)])
+def test_round_trip(tmp_path, dtype, atol):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((10, DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = [f"c{i}" for i in range(10)]
+
+    header = _write(tmp_path / "vec", dtype, [(ids[:4], vectors[:4]), (ids[4:], vectors[4:])])
+    assert header == {"dim": DIM, "dtype": dtype, "count": 10, "normalized": True}
+
+    vector_file = open_vectors(tmp_path / "vec")
+    assert (vector_file.count, vector_file.dim, vector_file.dtype) == (10, DIM, dtype)
+    assert vector_file.ids == ids
+    assert vector_file.nbytes == 10 * DIM * np.dtype(dtype).itemsize
+    assert (tmp_path / "vec.vec").stat().st_size == vector_file.nbytes
+    assert vector_file.row_of("c7") == 7 and vector_file.row_of("missing") is None
+
+    rows = vector_file.get_rows([7, 2])
+    assert rows.dtype == np.float32
+    np.testing.assert_allclose(rows, vectors[[7, 2]], atol=atol)
+
+    batches = list(vector_file.iter_batches(batch_size=3))
+    assert [start for start, _ in batches] == [0, 3, 6, 9]
+    np.testing.assert_allclose(np.concatenate([b for _, b in batches]), vectors, atol=atol)
+
+
+def test_unpublished_write_is_invisible(tmp_path):
+    prefix = tmp_path / "vec"
+    _write(prefix, "float32", [(["a"], np.ones((1, DIM), dtype=np.float32))])
+
+    writer = VectorWriter(prefix, DIM)
+    writer.append(["b", "c"], np.zeros((2, DIM), dtype=np.float32))
+    # 新文件未发布前，读者看到的仍是旧文件
+    assert open_vectors(prefix).ids == ["a"]
+    writer.abort()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["vec.ids", "vec.json", "vec.vec"]
+
+
+def test_rewrite_reopens_mapping(tmp_path):
+    prefix = tmp_path / "vec"
+    _write(prefix, "float32", [(["a"], np.ones((1, DIM), dtype=np.float32))])
+    assert open_vectors(prefix).count == 1
+    assert open_vectors(prefix) is open_vectors(prefix)
+
+    _write(prefix, "float16", [(["x", "y"], np.full((2, DIM), 0.5, dtype=np.float32))])
+    # 两次写入的间隔可能小于文件系统时间戳的精度，手动推后头信息的修改时间
+    header = tmp_path / "vec.json"
+    mtime = header.stat().st_mtime_ns + 10 ** 9
+    os.utime(header, ns=(mtime, mtime))
+    # 头信息修改时间变化后重新映射
+    reopened = open_vectors(prefix)
+    assert reopened.count == 2 and reopened.dtype == "float16"
+    assert reopened.get_rows([1]).tolist() == [[0.5] * DIM]
+
+
+def test_invalid_input(tmp_path):
+    with pytest.raises(ValueError):
+        VectorWriter(tmp_path / "vec", DIM, "int8")
+    writer = VectorWriter(tmp_path / "vec", DIM)
+    with pytest.raises(ValueError):
+        writer.append(["a", "b"], np.zeros((1, DIM), dtype=np.float32))
+    writer.abort()
+
+
+def test_empty_file(tmp_path):
+    _write(tmp_path / "vec", "float32", [])
+    vector_file = open_vectors(tmp_path / "vec")
+    assert vector_file.count == 0 and vector_file.ids == []
+    assert list(vector_file.iter_batches()) == []
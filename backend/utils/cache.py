@@ -0,0 +1,85 @@
+"""
+进程内缓存模块
+带过期时间的LRU缓存，按名称注册，便于不同服务共享同一个缓存实例（例如写入方主动失效）
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """线程安全的 LRU + TTL 缓存，记录命中/未命中次数"""
+
+    def __init__(self, max_items: int = 1024, ttl: float = 300):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """取缓存值，不存在或已过期时返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < now:
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None) -> int:
+        """删除满足条件的条目（不传条件时清空），返回删除数"""
+        with self._lock:
+            if predicate is None:
+                removed = len(self._items)
+                self._items.clear()
+                return removed
+            keys = [key for key in self._items if predicate(key)]
+            for key in keys:
+                del self._items[key]
+            return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "items": len(self._items),
+            "max_items": self.max_items,
+            "ttl_seconds": self.ttl
+        }
+
+
+# 跨服务共享的缓存名称
+# 检索结果缓存：RetrievalService 读写，VectorDBService 更新集合后失效
+SEARCH_CACHE = "search_results"
+
+
+_caches: Dict[str, TTLCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name: str, max_items: int = 1024, ttl: float = 300) -> TTLCache:
+    """获取（首次调用时创建）指定名称的进程内缓存"""
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = TTLCache(max_items, ttl)
+        return _caches[name]
@@ -0,0 +1,204 @@
+"""
+分块存储模块
+分块结果按批次增量写入 data/chunks 下的SQLite库，支持按顺序流式读取和按ID查询
+"""
+
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Iterator, Iterable, Optional
+
+
+# 单条SQL中 IN 查询的最大参数数
+_QUERY_BATCH = 500
+
+
+class ChunkStore:
+    """
+    分块内容存储
+
+    以 (run_id, seq) 为主键，seq 是分块在一次分块任务中的顺序号。
+    下游的向量行号与 seq 一一对应，按 seq 区间读取即可顺序遍历整个分块结果。
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "run_id TEXT NOT NULL, "
+            "seq INTEGER NOT NULL, "
+            "id TEXT NOT NULL, "
+            "file_id TEXT NOT NULL, "
+            "section_hash TEXT, "
+            "start_pos INTEGER, "
+            "end_pos INTEGER, "
+            "content TEXT NOT NULL, "
+            "metadata TEXT NOT NULL, "
+            "PRIMARY KEY (run_id, seq))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_id ON chunks(run_id, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_file ON chunks(run_id, file_id)")
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "id": row["id"],
+            "seq": row["seq"],
+            "file_id": row["file_id"],
+            "section_hash": row["section_hash"],
+            "content": row["content"],
+            "start_pos": row["start_pos"],
+            "end_pos": row["end_pos"],
+            "size": len(row["content"]),
+            "metadata": json.loads(row["metadata"])
+        }
+
+    def add_many(self, run_id: str, chunks: Iterable[Dict[str, Any]]):
+        """在一个事务中批量写入分块（分块需已包含 seq）"""
+        rows = [
+            (run_id, c["seq"], c["id"], c["file_id"], c.get("section_hash"),
+             c.get("start_pos"), c.get("end_pos"), c["content"],
+             json.dumps(c.get("metadata", {}), ensure_ascii=False))
+            for c in chunks
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO chunks (run_id, seq, id, file_id, section_hash, start_pos, end_pos, "
+                    "content, metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def copy_file_chunks(self, src_run_id: str, dst_run_id: str, file_id: str, seq_start: int) -> int:
+        """把某个文件在旧分块任务中的全部分块复制到新任务，seq 从 seq_start 开始连续编号"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT MIN(seq) AS first FROM chunks WHERE run_id = ? AND file_id = ?",
+                    (src_run_id, file_id)
+                ).fetchone()
+                if row["first"] is None:
+                    self._conn.execute("ROLLBACK")
+                    return 0
+
+                cursor = self._conn.execute(
+                    "INSERT INTO chunks (run_id, seq, id, file_id, section_hash, start_pos, end_pos, "
+                    "content, metadata) "
+                    "SELECT ?, seq - ? + ?, id, file_id, section_hash, start_pos, end_pos, content, metadata "
+                    "FROM chunks WHERE run_id = ? AND file_id = ?",
+                    (dst_run_id, row["first"], seq_start, src_run_id, file_id)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cursor.rowcount
+
+    def iter_chunks(self, run_id: str, batch_size: int = 1000,
+                    start_seq: int = 0) -> Iterator[List[Dict[str, Any]]]:
+        """按 seq 顺序分批读取分块，每次只在内存中保留一批"""
+        last_seq = start_seq - 1
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT * FROM chunks WHERE run_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                    (run_id, last_seq, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            last_seq = rows[-1]["seq"]
+            yield [self._to_dict(row) for row in rows]
+
+    def get_file_chunks(self, run_id: str, file_id: str) -> List[Dict[str, Any]]:
+        """某个文件在一次分块任务中的全部分块，按 seq 排序"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM chunks WHERE run_id = ? AND file_id = ? ORDER BY seq", (run_id, file_id)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def get_many(self, run_id: str, chunk_ids: List[str]) -> List[Dict[str, Any]]:
+        """按分块ID批量获取，返回顺序与传入顺序一致（不存在的ID被忽略）"""
+        if not chunk_ids:
+            return []
+        unique = list(dict.fromkeys(chunk_ids))
+        found = {}
+        with self._lock:
+            # 分批查询，避免超过SQLite单条语句的参数个数上限
+            for start in range(0, len(unique), _QUERY_BATCH):
+                batch = unique[start:start + _QUERY_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT * FROM chunks WHERE run_id = ? AND id IN ({placeholders})",
+                    (run_id, *batch)
+                ).fetchall()
+                found.update((row["id"], self._to_dict(row)) for row in rows)
+        return [found[chunk_id] for chunk_id in chunk_ids if chunk_id in found]
+
+    def get_by_seq(self, run_id: str, seqs: List[int]) -> List[Dict[str, Any]]:
+        """按顺序号批量获取，返回顺序与传入顺序一致"""
+        if not seqs:
+            return []
+        unique = list(dict.fromkeys(int(s) for s in seqs))
+        found = {}
+        with self._lock:
+            for start in range(0, len(unique), _QUERY_BATCH):
+                batch = unique[start:start + _QUERY_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT * FROM chunks WHERE run_id = ? AND seq IN ({placeholders})",
+                    (run_id, *batch)
+                ).fetchall()
+                found.update((row["seq"], self._to_dict(row)) for row in rows)
+        return [found[int(s)] for s in seqs if int(s) in found]
+
+    def list_chunks(self, run_id: str, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """分页查看分块"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM chunks WHERE run_id = ? ORDER BY seq LIMIT ? OFFSET ?",
+                (run_id, limit, offset)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def count(self, run_id: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) AS n FROM chunks WHERE run_id = ?", (run_id,)
+            ).fetchone()
+        return row["n"]
+
+    def delete_run(self, run_id: str) -> int:
+        """删除一次分块任务的全部分块"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM chunks WHERE run_id = ?", (run_id,))
+        return cursor.rowcount
+
+
+_stores: Dict[str, ChunkStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_chunk_store(db_path: Optional[Path] = None) -> ChunkStore:
+    """获取进程内共享的分块存储实例"""
+    db_path = Path(db_path) if db_path else Path("data") / "chunks" / "chunk_store.db"
+    key = str(db_path.resolve())
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = ChunkStore(db_path)
+        return _stores[key]
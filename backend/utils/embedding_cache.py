@@ -0,0 +1,218 @@
+"""
+嵌入缓存模块
+以 (模型名, 归一化文本哈希) 为键的持久化向量缓存，按总大小做LRU淘汰
+"""
+
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Dict, Optional
+
+import numpy as np
+
+
+# 磁盘缓存上限（字节）与进程内热点缓存条数
+EMBED_CACHE_MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+EMBED_CACHE_MEMORY_ITEMS = int(os.getenv("EMBED_CACHE_MEMORY_ITEMS", 10000))
+
+# 单条SQL中 IN 查询的最大参数数
+_QUERY_BATCH = 500
+
+# 从数据库重新统计总大小的间隔（秒）：缓存文件由多个进程共享，进程内计数只是近似值
+_RESYNC_INTERVAL = 60
+
+
+def normalize_text(text: str) -> str:
+    """缓存键使用的文本归一化：Unicode NFKC、去首尾空白、合并连续空白"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha1(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    两级嵌入缓存
+
+    - 进程内 OrderedDict 保存最近使用的向量（查询向量基本都在这一层命中）
+    - SQLite 保存全部缓存向量，记录最近访问时间，总大小超过上限时淘汰最久未用的条目
+    """
+
+    def __init__(self, db_path: Path, max_bytes: int = EMBED_CACHE_MAX_BYTES,
+                 memory_items: int = EMBED_CACHE_MEMORY_ITEMS):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+
+        self._lock = threading.RLock()
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, "
+            "model TEXT NOT NULL, "
+            "vector BLOB NOT NULL, "
+            "last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings(last_access)")
+        self._resync()
+
+    def _resync(self):
+        """从数据库重新统计缓存总大小（包含其他进程写入的条目）"""
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+        self._synced_at = time.time()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _execute_many(self, sql: str, rows: List[tuple]):
+        """在一个事务中批量执行"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(sql, rows)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def get_many(self, model_name: str, texts: List[str]) -> Dict[int, np.ndarray]:
+        """批量查询缓存，返回 {输入下标: 向量}，未命中的下标不出现在结果中"""
+        keys = [cache_key(model_name, text) for text in texts]
+        found: Dict[int, np.ndarray] = {}
+        missing: Dict[str, List[int]] = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[i] = vector
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            missing_keys = list(missing)
+            now = time.time()
+            for start in range(0, len(missing_keys), _QUERY_BATCH):
+                batch = missing_keys[start:start + _QUERY_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(key, vector)
+                    for i in missing[key]:
+                        found[i] = vector
+                if rows:
+                    self._execute_many(
+                        "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                        [(now, key) for key, _ in rows]
+                    )
+
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        return found
+
+    def put_many(self, model_name: str, texts: List[str], vectors: np.ndarray):
+        """批量写入缓存，超过容量上限时按最近访问时间淘汰"""
+        now = time.time()
+        rows = {}
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = cache_key(model_name, text)
+                vector = np.ascontiguousarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                rows[key] = (key, model_name, vector.tobytes(), now)
+            if not rows:
+                return
+
+            # 覆盖已有条目时只计入大小差值，否则重复写入会让计数不断虚增
+            keys = list(rows)
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                replaced = 0
+                for start in range(0, len(keys), _QUERY_BATCH):
+                    batch = keys[start:start + _QUERY_BATCH]
+                    placeholders = ",".join("?" * len(batch))
+                    replaced += self._conn.execute(
+                        f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE key IN ({placeholders})",
+                        batch
+                    ).fetchone()[0]
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, vector, last_access) VALUES (?, ?, ?, ?)",
+                    list(rows.values())
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+            self._total_bytes += sum(len(row[2]) for row in rows.values()) - replaced
+            # 其他进程的写入与淘汰不会反映在本进程计数中，定期或准备淘汰前以数据库为准
+            if self._total_bytes > self.max_bytes or now - self._synced_at > _RESYNC_INTERVAL:
+                self._resync()
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """淘汰最久未访问的条目，直到总大小降到上限的90%"""
+        target = int(self.max_bytes * 0.9)
+        while self._total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_access LIMIT ?", (_QUERY_BATCH,)
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+
+            evicted = []
+            for key, size in rows:
+                evicted.append((key,))
+                self._memory.pop(key, None)
+                self._total_bytes -= size
+                if self._total_bytes <= target:
+                    break
+            self._execute_many("DELETE FROM embeddings WHERE key = ?", evicted)
+
+    def stats(self) -> Dict[str, float]:
+        """缓存命中统计"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "memory_items": len(self._memory),
+            "disk_bytes": self._total_bytes
+        }
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache(db_path: Optional[Path] = None) -> EmbeddingCache:
+    """获取进程内共享的嵌入缓存"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache(db_path or Path("data") / "vectors" / "embedding_cache.db")
+        return _cache
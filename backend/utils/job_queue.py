@@ -0,0 +1,179 @@
+"""
+后台任务队列模块
+把耗时的流水线阶段（分块、嵌入、入库）放到后台执行，接口立即返回任务ID
+"""
+
+import os
+import time
+import uuid
+import socket
+import asyncio
+from datetime import datetime
+from typing import Dict, Any, Callable, Awaitable, Optional
+
+from utils.metadata_store import get_metadata_store
+from utils.profiling import get_profiler, call_tags
+
+
+# 各阶段同时运行的任务数上限
+STAGE_CONCURRENCY = {
+    "text_chunk": int(os.getenv("JOB_CONCURRENCY_TEXT_CHUNK", 2)),
+    "vector_embed": int(os.getenv("JOB_CONCURRENCY_VECTOR_EMBED", 1)),
+    "vector_db": int(os.getenv("JOB_CONCURRENCY_VECTOR_DB", 1))
+}
+
+# 进度写入存储的最小间隔（秒），避免高频进度回调反复写库
+PROGRESS_PERSIST_INTERVAL = 1.0
+
+
+class JobQueue:
+    """
+    进程内任务队列
+
+    - 每个阶段一个信号量，超出并发上限的任务保持 queued 状态
+    - 任务状态保存在内存中，并同步到元数据存储的 jobs 表，
+      其他 uvicorn worker 也能查询到任务进度
+    - 任务函数需接受 progress 关键字参数：progress(已完成数, 总数)
+    - 任务状态：queued → running → success / error；启动时把所属进程已退出、
+      却仍是 queued/running 的任务标记为 interrupted（服务崩溃或重启中断，需要重新提交）
+    """
+
+    def __init__(self, concurrency: Optional[Dict[str, int]] = None):
+        self.concurrency = concurrency or STAGE_CONCURRENCY
+        self.store = get_metadata_store()
+
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._tasks = set()
+        self._last_persist: Dict[str, float] = {}
+        
+        self.host = socket.gethostname()
+        self.store.create_index("jobs", "status")
+        self._recover_interrupted()
+
+    def _owner_alive(self, job: Dict[str, Any]) -> bool:
+        """任务所属进程是否仍在运行（其他主机上的进程无法判断，视为运行中）"""
+        if not job.get("host") or not job.get("pid"):
+            # 旧版本记录没有所属进程信息
+            return False
+        if job["host"] != self.host:
+            return True
+        if job["pid"] == os.getpid():
+            # 进程号被本进程复用（例如容器重启后都是同一个 pid），原进程必然已退出
+            return False
+        try:
+            os.kill(job["pid"], 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _recover_interrupted(self) -> int:
+        """把上次进程退出时遗留的 queued/running 任务标记为中断"""
+        recovered = 0
+        for status in ("queued", "running"):
+            for job in self.store.find("jobs", "status", status):
+                if self._owner_alive(job):
+                    continue
+                self.store.update("jobs", job["id"], {
+                    "status": "interrupted",
+                    "error_message": "服务重启或异常退出，任务已中断，请重新提交",
+                    "finish_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                })
+                recovered += 1
+        return recovered
+
+    def _semaphore(self, stage: str) -> asyncio.Semaphore:
+        if stage not in self._semaphores:
+            self._semaphores[stage] = asyncio.Semaphore(self.concurrency.get(stage, 1))
+        return self._semaphores[stage]
+
+    def _persist(self, job: Dict[str, Any], force: bool = False):
+        """把任务状态写入存储（进度更新按时间节流）"""
+        now = time.monotonic()
+        if not force and now - self._last_persist.get(job["id"], 0) < PROGRESS_PERSIST_INTERVAL:
+            return
+        self._last_persist[job["id"]] = now
+        self.store.update("jobs", job["id"], job)
+
+    def submit(self, stage: str, func: Callable[..., Awaitable[Dict[str, Any]]],
+               *args, **kwargs) -> Dict[str, Any]:
+        """提交任务，立即返回任务信息"""
+        job = {
+            "id": str(uuid.uuid4()),
+            "stage": stage,
+            "status": "queued",
+            "progress": 0.0,
+            "processed": 0,
+            "total": None,
+            "throughput": 0.0,
+            "create_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "start_time": None,
+            "finish_time": None,
+            "result": None,
+            "error_message": None,
+            # 所属进程，重启后据此识别被中断的任务
+            "host": self.host,
+            "pid": os.getpid()
+        }
+        self._jobs[job["id"]] = job
+        self.store.append("jobs", job)
+
+        task = asyncio.create_task(self._run(job, func, args, kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        return {
+            "job_id": job["id"],
+            "stage": stage,
+            "status": job["status"]
+        }
+
+    async def _run(self, job: Dict[str, Any], func, args, kwargs):
+        async with self._semaphore(job["stage"]):
+            started = time.monotonic()
+            job["status"] = "running"
+            job["start_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self._persist(job, force=True)
+
+            def progress(processed: int, total: Optional[int] = None):
+                job["processed"] = processed
+                if total is not None:
+                    job["total"] = total
+                if job["total"]:
+                    job["progress"] = round(min(processed / job["total"], 1.0) * 100, 1)
+                elapsed = time.monotonic() - started
+                job["throughput"] = round(processed / elapsed, 2) if elapsed > 0 else 0.0
+                self._persist(job)
+
+            try:
+                # 按 PROFILE_ROUTES 中的 job:阶段名 采样剖析，标签为任务参数（chunk_method、embed_model 等）
+                tags = {"job_id": job["id"], **call_tags(func, args, kwargs)}
+                with get_profiler().profile(f"job:{job['stage']}", tags):
+                    job["result"] = await func(*args, progress=progress, **kwargs)
+                job["status"] = "success"
+                job["progress"] = 100.0
+            except Exception as e:
+                job["status"] = "error"
+                job["error_message"] = str(e)
+            finally:
+                job["finish_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                self._persist(job, force=True)
+                self._last_persist.pop(job["id"], None)
+                # 已结束的任务只保留在存储中
+                self._jobs.pop(job["id"], None)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务状态，运行中的任务直接读内存中的最新进度"""
+        return self._jobs.get(job_id) or self.store.get("jobs", job_id)
+
+    def queue_depth(self, stage: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        """按阶段统计排队中和运行中的任务数"""
+        depth = {}
+        for job in self._jobs.values():
+            if stage and job["stage"] != stage:
+                continue
+            counts = depth.setdefault(job["stage"], {"queued": 0, "running": 0})
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return depth
@@ -0,0 +1,259 @@
+"""
+元数据存储模块
+基于SQLite(WAL模式)的共享元数据存储层，替代各服务对 data/*.json 的全量读写
+"""
+
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterable
+
+
+class MetadataStore:
+    """
+    通用的记录存储
+
+    每张表只有 seq(自增主键)、id(唯一索引)、data(JSON) 三列：
+    - 追加为单条 INSERT，代价与历史记录数无关
+    - 按 id 查询走唯一索引
+    - 分页按 seq 排序，支持 offset/limit
+    - 需要按其他字段查找时，可对 JSON 字段建立表达式索引
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            str(self.db_path),
+            check_same_thread=False,
+            isolation_level=None  # 手动控制事务
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS _migrations (name TEXT PRIMARY KEY, applied_time TEXT NOT NULL)"
+        )
+
+        self._tables = set()
+        self._indexes = set()
+
+    def _ensure_table(self, table: str):
+        """按需创建表"""
+        if table in self._tables:
+            return
+        if not table.isidentifier():
+            raise ValueError(f"非法的表名: {table}")
+
+        with self._lock:
+            self._conn.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table}" ('
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "id TEXT NOT NULL UNIQUE, "
+                "data TEXT NOT NULL)"
+            )
+            self._tables.add(table)
+
+    def create_index(self, table: str, field: str):
+        """为记录中的某个字段建立表达式索引"""
+        self._ensure_table(table)
+        if (table, field) in self._indexes:
+            return
+        if not field.isidentifier():
+            raise ValueError(f"非法的字段名: {field}")
+
+        with self._lock:
+            self._conn.execute(
+                f'CREATE INDEX IF NOT EXISTS "idx_{table}_{field}" '
+                f"ON \"{table}\"(json_extract(data, '$.{field}'))"
+            )
+            self._indexes.add((table, field))
+
+    @staticmethod
+    def _dumps(record: Dict) -> str:
+        return json.dumps(record, ensure_ascii=False)
+
+    def append(self, table: str, record: Dict[str, Any]):
+        """追加一条记录，记录必须包含 id"""
+        self._ensure_table(table)
+        with self._lock:
+            self._conn.execute(
+                f'INSERT INTO "{table}" (id, data) VALUES (?, ?)',
+                (record["id"], self._dumps(record))
+            )
+
+    def append_many(self, table: str, records: Iterable[Dict[str, Any]]) -> int:
+        """在一个事务中批量追加记录，已存在的 id 会被忽略"""
+        self._ensure_table(table)
+        rows = [(record["id"], self._dumps(record)) for record in records]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._conn.executemany(
+                    f'INSERT OR IGNORE INTO "{table}" (id, data) VALUES (?, ?)',
+                    rows
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cursor.rowcount
+
+    def get(self, table: str, record_id: str) -> Optional[Dict[str, Any]]:
+        """按 id 获取记录"""
+        self._ensure_table(table)
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT data FROM "{table}" WHERE id = ?', (record_id,)
+            ).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def update(self, table: str, record_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """合并更新记录字段，返回更新后的记录"""
+        self._ensure_table(table)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f'SELECT data FROM "{table}" WHERE id = ?', (record_id,)
+                ).fetchone()
+                if not row:
+                    self._conn.execute("ROLLBACK")
+                    return None
+
+                record = json.loads(row["data"])
+                record.update(fields)
+                self._conn.execute(
+                    f'UPDATE "{table}" SET data = ? WHERE id = ?',
+                    (self._dumps(record), record_id)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return record
+
+    def increment(self, table: str, record_id: str, field: str, floor: int = 0) -> Optional[int]:
+        """
+        原子地把记录的计数字段加一并返回新值（字段缺失或小于 floor 时从 floor 开始），
+        在同一个写事务内完成读取和写回，多进程并发调用也不会拿到相同的值
+        """
+        self._ensure_table(table)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f'SELECT data FROM "{table}" WHERE id = ?', (record_id,)
+                ).fetchone()
+                if not row:
+                    self._conn.execute("ROLLBACK")
+                    return None
+
+                record = json.loads(row["data"])
+                value = max(record.get(field) or 0, floor) + 1
+                record[field] = value
+                self._conn.execute(
+                    f'UPDATE "{table}" SET data = ? WHERE id = ?',
+                    (self._dumps(record), record_id)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return value
+
+    def delete(self, table: str, record_id: str) -> bool:
+        """删除记录"""
+        self._ensure_table(table)
+        with self._lock:
+            cursor = self._conn.execute(
+                f'DELETE FROM "{table}" WHERE id = ?', (record_id,)
+            )
+        return cursor.rowcount > 0
+
+    def list(self, table: str, offset: int = 0, limit: Optional[int] = None,
+             desc: bool = False) -> List[Dict[str, Any]]:
+        """分页获取记录"""
+        self._ensure_table(table)
+        order = "DESC" if desc else "ASC"
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT data FROM "{table}" ORDER BY seq {order} LIMIT ? OFFSET ?',
+                (-1 if limit is None else limit, offset)
+            ).fetchall()
+        return [json.loads(row["data"]) for row in rows]
+
+    def find(self, table: str, field: str, value: Any, limit: Optional[int] = None,
+             desc: bool = False) -> List[Dict[str, Any]]:
+        """按字段值查找记录（字段需先调用 create_index 才会走索引）"""
+        self._ensure_table(table)
+        if not field.isidentifier():
+            raise ValueError(f"非法的字段名: {field}")
+
+        order = "DESC" if desc else "ASC"
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT data FROM \"{table}\" WHERE json_extract(data, '$.{field}') = ? "
+                f"ORDER BY seq {order} LIMIT ?",
+                (value, -1 if limit is None else limit)
+            ).fetchall()
+        return [json.loads(row["data"]) for row in rows]
+
+    def count(self, table: str) -> int:
+        """记录总数"""
+        self._ensure_table(table)
+        with self._lock:
+            row = self._conn.execute(f'SELECT COUNT(*) AS n FROM "{table}"').fetchone()
+        return row["n"]
+
+    def migrate_json(self, table: str, json_path: Path) -> int:
+        """
+        一次性把旧的 JSON 列表文件导入到表中
+
+        迁移完成后写入 _migrations 记录，之后再调用不会重复导入。
+        原 JSON 文件保留不动，便于回滚。
+        """
+        self._ensure_table(table)
+        migration_name = f"json:{table}"
+        json_path = Path(json_path)
+
+        with self._lock:
+            applied = self._conn.execute(
+                "SELECT 1 FROM _migrations WHERE name = ?", (migration_name,)
+            ).fetchone()
+            if applied:
+                return 0
+
+            records = []
+            if json_path.exists():
+                try:
+                    with open(json_path, 'r', encoding='utf-8') as f:
+                        records = json.load(f)
+                except (OSError, ValueError):
+                    records = []
+
+            imported = self.append_many(table, [r for r in records if r.get("id")])
+            self._conn.execute(
+                "INSERT OR IGNORE INTO _migrations (name, applied_time) VALUES (?, ?)",
+                (migration_name, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+        return imported
+
+
+_stores: Dict[str, MetadataStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_metadata_store(db_path: Optional[Path] = None) -> MetadataStore:
+    """获取进程内共享的元数据存储实例"""
+    db_path = Path(db_path) if db_path else Path("data") / "metadata.db"
+    key = str(db_path.resolve())
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = MetadataStore(db_path)
+        return _stores[key]
@@ -0,0 +1,259 @@
+"""
+运行指标模块
+进程内的计数器与延迟直方图，按 Prometheus 文本格式导出（/metrics）；
+多个 uvicorn worker 时每个进程各自统计，由 Prometheus 按实例汇总。
+"""
+
+import time
+import asyncio
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# 延迟直方图的桶上界（秒），覆盖毫秒级检索到分钟级的入库任务
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# 采集函数返回的指标族：(名称, 类型, 说明, [(标签, 值)])
+MetricFamily = Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(dict(zip(self.label_names, key)))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """累积桶直方图，p50/p99 由 Prometheus 的 histogram_quantile 计算"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        # 标签 -> [各桶计数（非累积）, 总和, 总数]
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                labels = dict(zip(self.label_names, key))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表：直接记录的计数器/直方图，加上导出时调用的采集函数（缓存命中率、队列深度等）"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: List[Callable[[], List[MetricFamily]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, help_text, label_names)
+            return self._metrics[name]
+
+    def histogram(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, help_text, label_names, buckets)
+            return self._metrics[name]
+
+    def register_collector(self, collector: Callable[[], List[MetricFamily]]):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """导出为 Prometheus 文本格式"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        for collector in list(self._collectors):
+            try:
+                families = collector()
+            except Exception:
+                # 单个采集函数出错不影响其他指标导出
+                continue
+            for name, metric_type, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry() -> MetricsRegistry:
+    return _registry
+
+
+# 流水线各阶段：upload_file、process_chunk、process_embed、store_vectors、search、generate，
+# 以及阶段内的子步骤（如 search.embed、search.vector）
+STAGE_LATENCY = _registry.histogram(
+    "rag_stage_duration_seconds", "流水线阶段耗时（秒）", ("stage", "status")
+)
+STAGE_ITEMS = _registry.counter(
+    "rag_stage_items_total", "流水线阶段处理的条目数（文件、分块、向量、查询、回答）", ("stage",)
+)
+STAGE_BYTES = _registry.counter(
+    "rag_stage_bytes_total", "流水线阶段处理的字节数", ("stage",)
+)
+FIRST_TOKEN_LATENCY = _registry.histogram(
+    "rag_generation_first_token_seconds", "生成首个片段的耗时（秒）", ("model",)
+)
+HTTP_LATENCY = _registry.histogram(
+    "http_request_duration_seconds", "HTTP 请求耗时（秒，流式响应为首字节时间）", ("method", "route", "status")
+)
+
+
+class Span:
+    """一次阶段计时，可在结束前设置处理的条目数和字节数"""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.items = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+
+@contextmanager
+def span(stage: str) -> Iterator[Span]:
+    """
+    阶段计时
+
+        with span("search.vector") as s:
+            ...
+            s.items = len(queries)
+
+    正常结束记为 success，抛出异常记为 error，被取消（任务取消、客户端断开）记为 cancelled。
+    """
+    record = Span(stage)
+    status = "success"
+    try:
+        yield record
+    except Exception:
+        status = "error"
+        raise
+    except BaseException:
+        status = "cancelled"
+        raise
+    finally:
+        STAGE_LATENCY.observe(record.elapsed, stage=stage, status=status)
+        if record.items:
+            STAGE_ITEMS.inc(record.items, stage=stage)
+        if record.bytes:
+            STAGE_BYTES.inc(record.bytes, stage=stage)
+
+
+def traced(stage: str, items: Optional[Callable[[Any], int]] = None):
+    """
+    异步服务方法的阶段计时装饰器
+
+    items 从返回值中取处理的条目数，例如 traced("process_chunk", items=lambda r: r["total_chunks"])
+    """
+    def decorator(func):
+        if not asyncio.iscoroutinefunction(func):
+            raise TypeError("traced 只用于 async 函数，同步代码请使用 span")
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(stage) as record:
+                result = await func(*args, **kwargs)
+                if items is not None:
+                    record.items = items(result) or 0
+                return result
+        return wrapper
+    return decorator
+
+
+def cache_metrics(caches: Dict[str, Optional[Dict[str, Any]]]) -> List[MetricFamily]:
+    """把各缓存的 stats()（hits/misses/items）转换为指标族，缓存关闭时传 None"""
+    hits, misses, ratios, items = [], [], [], []
+    for name, stats in caches.items():
+        if not stats:
+            continue
+        labels = {"cache": name}
+        hits.append((labels, stats.get("hits", 0)))
+        misses.append((labels, stats.get("misses", 0)))
+        ratios.append((labels, stats.get("hit_rate", 0.0)))
+        if "items" in stats:
+            items.append((labels, stats["items"]))
+    return [
+        ("rag_cache_hits_total", "counter", "缓存命中次数", hits),
+        ("rag_cache_misses_total", "counter", "缓存未命中次数", misses),
+        ("rag_cache_hit_ratio", "gauge", "缓存命中率", ratios),
+        ("rag_cache_items", "gauge", "缓存条目数", items)
+    ]
+
+
+def queue_metrics(depth: Dict[str, Dict[str, int]]) -> List[MetricFamily]:
+    """把 JobQueue.queue_depth() 转换为指标族"""
+    samples = [
+        ({"stage": stage, "status": status}, count)
+        for stage, counts in sorted(depth.items())
+        for status, count in sorted(counts.items())
+    ]
+    return [("rag_job_queue_depth", "gauge", "后台任务队列中排队/运行中的任务数", samples)]
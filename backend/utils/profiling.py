@@ -0,0 +1,417 @@
+"""
+采样性能分析模块
+按采样率对选定的接口路由（或后台任务阶段）抓取性能剖析，用于线上排查慢请求，无需重新部署：
+
+- sample 模式（默认）：后台线程按固定间隔采集所有线程的调用栈，输出折叠栈（*.collapsed，
+  可直接用 flamegraph.pl / speedscope 查看），能覆盖 asyncio.to_thread 中执行的检索、分块等计算
+- cprofile 模式：cProfile 确定性剖析（*.prof，用 pstats / snakeviz 查看），只覆盖事件循环线程
+
+同一时刻每个进程只剖析一个请求和一个后台任务，期间其他请求和后台任务的开销也会出现在结果中。
+后台任务可能运行很久，使用单独的占用名额，不会挡住接口请求的采样；后台任务总是用 sample 模式
+（cProfile 只能剖析事件循环线程，且与请求的 cProfile 剖析互相冲突）。
+剖析结果的写入和旧文件清理在后台写入线程中进行，不阻塞事件循环。
+流式响应只剖析到首字节。配置来自环境变量，可通过 /api/admin/profiling 在运行时修改，
+修改写入 data/profiles/config.json，同一目录下的其他 worker 进程也会读取。
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import pstats
+import cProfile
+import inspect
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+# 要剖析的目标，逗号分隔：接口路由模板（如 /api/retrieval/search）或后台任务阶段（如 job:text_chunk）
+PROFILE_ROUTES = os.getenv("PROFILE_ROUTES", "")
+# 命中目标的请求中被剖析的比例
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0.01))
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample")
+# sample 模式的采样间隔（秒）
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))
+
+# 保留策略：文件数、总大小、保留时长，超出时从最旧的开始删除
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 200))
+PROFILE_MAX_MB = float(os.getenv("PROFILE_MAX_MB", 500))
+PROFILE_MAX_AGE_HOURS = float(os.getenv("PROFILE_MAX_AGE_HOURS", 72))
+
+PROFILE_MODES = ("sample", "cprofile")
+
+# 后台任务剖析目标的前缀
+JOB_TARGET_PREFIX = "job:"
+
+# 运行时配置文件的检查间隔（秒）
+CONFIG_CHECK_INTERVAL = 2.0
+
+# 标签值的最大长度（查询文本等较长参数截断）
+MAX_TAG_LENGTH = 200
+
+# 空闲线程停留的栈顶函数（等待事件循环、线程池取任务、锁等待），采样时跳过
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker")
+}
+
+_PROFILE_ID = re.compile(r"^[\w\-]+$")
+
+
+def _short(value: Any) -> Any:
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    text = str(value)
+    return text if len(text) <= MAX_TAG_LENGTH else text[:MAX_TAG_LENGTH] + "..."
+
+
+def request_tags(request) -> Dict[str, Any]:
+    """HTTP 请求的标签：方法、路径和查询参数（top_k、mode、chunk_method 等）"""
+    tags = {"method": request.method, "path": request.url.path}
+    tags.update((key, _short(value)) for key, value in request.query_params.items())
+    if request.headers.get("content-length"):
+        tags["content_length"] = int(request.headers["content-length"])
+    return tags
+
+
+def call_tags(func, args: tuple, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """后台任务的标签：按函数签名把位置参数还原为参数名（chunk_method、embed_model 等）"""
+    try:
+        bound = inspect.signature(func).bind_partial(*args, **kwargs).arguments
+    except TypeError:
+        bound = {f"arg{i}": value for i, value in enumerate(args)}
+    return {key: _short(value) for key, value in bound.items() if not callable(value)}
+
+
+def route_template(app, scope: Dict[str, Any]) -> Optional[str]:
+    """请求对应的路由模板（中间件在路由匹配之前执行，需要自行匹配）"""
+    from starlette.routing import Match
+
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", None)
+    return None
+
+
+class StackSampler(threading.Thread):
+    """按固定间隔采集所有线程调用栈，统计为折叠栈计数"""
+
+    def __init__(self, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        names = {}
+        while not self._stop_event.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    name = getattr(code, "co_qualname", code.co_name)
+                    stack.append(f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def dump(self, path: Path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """
+    进程内的采样剖析器
+
+        with profiler.profile("/api/retrieval/search", tags) as capture:
+            ...
+            if capture is not None:
+                capture["tags"]["status"] = 200
+
+    未命中目标、未被采样或已有剖析在进行时 capture 为 None，不产生额外开销。
+    剖析结束后只停止采集，结果交给后台写入线程保存。
+    """
+
+    def __init__(self, profiles_dir: Optional[Path] = None):
+        self.profiles_dir = Path(profiles_dir) if profiles_dir else Path("data") / "profiles"
+        self.profiles_dir.mkdir(parents=True, exist_ok=True)
+        self.config_path = self.profiles_dir / "config.json"
+
+        self.config = {
+            "routes": [route.strip() for route in PROFILE_ROUTES.split(",") if route.strip()],
+            "sample_rate": PROFILE_SAMPLE_RATE,
+            "mode": PROFILE_MODE if PROFILE_MODE in PROFILE_MODES else "sample",
+            "interval": PROFILE_INTERVAL
+        }
+        self._config_mtime = None
+        self._config_checked = 0.0
+        # 接口请求和后台任务各占一个名额
+        self._busy = threading.Lock()
+        self._job_busy = threading.Lock()
+        self._lock = threading.Lock()
+        # 单线程依次写入剖析结果、清理旧文件
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-writer")
+        self.captured = 0
+        self.skipped_busy = 0
+        self.last_error = None
+        self._refresh(force=True)
+
+    # ---------- 配置 ----------
+
+    @property
+    def active(self) -> bool:
+        """是否有任何剖析目标（关闭时中间件直接跳过路由匹配）"""
+        self._refresh()
+        return bool(self.config["routes"]) and self.config["sample_rate"] > 0
+
+    def _refresh(self, force: bool = False):
+        """按间隔检查运行时配置文件，其他进程修改的配置也能生效"""
+        now = time.monotonic()
+        if not force and now - self._config_checked < CONFIG_CHECK_INTERVAL:
+            return
+        self._config_checked = now
+        try:
+            mtime = self.config_path.stat().st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._config_mtime:
+            return
+        try:
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            self._config_mtime = mtime
+            self.config.update({key: saved[key] for key in self.config if key in saved})
+
+    def configure(self, routes: Optional[List[str]] = None, sample_rate: Optional[float] = None,
+                  mode: Optional[str] = None, interval: Optional[float] = None) -> Dict[str, Any]:
+        """修改并保存运行时配置，未传的项保持不变；routes 为空列表即关闭剖析"""
+        if sample_rate is not None and not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate 必须在 0 到 1 之间")
+        if mode is not None and mode not in PROFILE_MODES:
+            raise ValueError(f"不支持的剖析模式: {mode}，可选: {', '.join(PROFILE_MODES)}")
+        if interval is not None and interval <= 0:
+            raise ValueError("interval 必须大于0")
+
+        self._refresh(force=True)
+        with self._lock:
+            if routes is not None:
+                self.config["routes"] = [route.strip() for route in routes if route.strip()]
+            if sample_rate is not None:
+                self.config["sample_rate"] = sample_rate
+            if mode is not None:
+                self.config["mode"] = mode
+            if interval is not None:
+                self.config["interval"] = interval
+            tmp_path = self.config_path.with_suffix(".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.config, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.config_path)
+            self._config_mtime = self.config_path.stat().st_mtime
+            return dict(self.config)
+
+    def status(self) -> Dict[str, Any]:
+        self._refresh()
+        return {
+            **self.config,
+            "captured": self.captured,
+            "skipped_busy": self.skipped_busy,
+            "last_error": self.last_error,
+            "retention": {
+                "max_files": PROFILE_MAX_FILES,
+                "max_mb": PROFILE_MAX_MB,
+                "max_age_hours": PROFILE_MAX_AGE_HOURS
+            }
+        }
+
+    # ---------- 剖析 ----------
+
+    def _select(self, target: Optional[str]) -> Optional[threading.Lock]:
+        """目标命中且被采样，并且同类剖析（接口请求或后台任务）空闲时占用名额，返回占用的名额"""
+        if not target or not self.active or target not in self.config["routes"]:
+            return None
+        if random.random() >= self.config["sample_rate"]:
+            return None
+        slot = self._job_busy if target.startswith(JOB_TARGET_PREFIX) else self._busy
+        if not slot.acquire(blocking=False):
+            self.skipped_busy += 1
+            return None
+        return slot
+
+    @contextmanager
+    def profile(self, target: Optional[str], tags: Optional[Dict[str, Any]] = None) -> Iterator[Optional[Dict]]:
+        slot = self._select(target)
+        if slot is None:
+            yield None
+            return
+
+        mode = "sample" if slot is self._job_busy else self.config["mode"]
+        capture = {"target": target, "tags": dict(tags or {})}
+        profiler = sampler = None
+        try:
+            if mode == "cprofile":
+                profiler = cProfile.Profile()
+                profiler.enable()
+            else:
+                sampler = StackSampler(self.config["interval"])
+                sampler.start()
+        except Exception as e:
+            # 例如已有其他剖析工具在运行，本次不剖析
+            slot.release()
+            self.last_error = f"启动性能剖析失败: {str(e)}"
+            yield None
+            return
+
+        started = time.perf_counter()
+        status = "success"
+        try:
+            yield capture
+        except Exception:
+            status = "error"
+            raise
+        except BaseException:
+            status = "cancelled"
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+            slot.release()
+            self._writer.submit(self._save, capture, mode, profiler, sampler, status, time.perf_counter() - started)
+
+    def flush(self):
+        """等待已结束的剖析全部写入"""
+        self._writer.submit(lambda: None).result()
+
+    def _save(self, capture: Dict[str, Any], mode: str, profiler: Optional[cProfile.Profile],
+              sampler: Optional[StackSampler], status: str, elapsed: float):
+        """在写入线程中保存剖析结果并清理旧文件，失败只记录错误，不影响请求本身"""
+        try:
+            self._write(capture, mode, profiler, sampler, status, elapsed)
+            self.enforce_retention()
+        except Exception as e:
+            self.last_error = f"保存性能剖析失败: {str(e)}"
+
+    def _write(self, capture: Dict[str, Any], mode: str, profiler: Optional[cProfile.Profile],
+               sampler: Optional[StackSampler], status: str, elapsed: float):
+        slug = re.sub(r"[^\w]+", "_", capture["target"]).strip("_") or "root"
+        profile_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{slug}_{uuid.uuid4().hex[:8]}"
+        if profiler is not None:
+            data_path = self.profiles_dir / f"{profile_id}.prof"
+            stats = pstats.Stats(profiler)
+            stats.dump_stats(str(data_path))
+            samples = stats.total_calls
+        else:
+            data_path = self.profiles_dir / f"{profile_id}.collapsed"
+            sampler.dump(data_path)
+            samples = sampler.samples
+
+        meta = {
+            "id": profile_id,
+            "target": capture["target"],
+            "mode": mode,
+            "status": status,
+            "tags": capture["tags"],
+            "elapsed_ms": round(elapsed * 1000, 2),
+            # cprofile 为函数调用次数，sample 为采样次数
+            "samples": samples,
+            "file": data_path.name,
+            "size": data_path.stat().st_size,
+            "pid": os.getpid(),
+            "create_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        with open(self.profiles_dir / f"{profile_id}.json", 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        self.captured += 1
+
+    # ---------- 存储 ----------
+
+    def _metas(self) -> List[Path]:
+        """所有剖析的元数据文件，按时间从新到旧"""
+        return sorted((path for path in self.profiles_dir.glob("*.json") if path != self.config_path),
+                      key=lambda path: path.name, reverse=True)
+
+    def _remove(self, meta_path: Path):
+        for path in self.profiles_dir.glob(f"{meta_path.stem}.*"):
+            path.unlink(missing_ok=True)
+
+    def enforce_retention(self) -> int:
+        """按保留时长、文件数和总大小清理旧剖析，返回删除的数量"""
+        expire = (datetime.now() - timedelta(hours=PROFILE_MAX_AGE_HOURS)).timestamp()
+        max_bytes = PROFILE_MAX_MB * 1024 * 1024
+        kept = total = removed = 0
+        for meta_path in self._metas():
+            try:
+                size = sum(path.stat().st_size for path in self.profiles_dir.glob(f"{meta_path.stem}.*"))
+                expired = meta_path.stat().st_mtime < expire
+            except FileNotFoundError:
+                # 其他进程同时在清理
+                continue
+            if expired or kept >= PROFILE_MAX_FILES or total + size > max_bytes:
+                self._remove(meta_path)
+                removed += 1
+                continue
+            kept += 1
+            total += size
+        return removed
+
+    def list_profiles(self, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        profiles = []
+        for meta_path in self._metas()[offset:offset + limit]:
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def profile_path(self, profile_id: str) -> Path:
+        """剖析数据文件路径"""
+        if not _PROFILE_ID.match(profile_id or ""):
+            raise Exception(f"无效的剖析ID: {profile_id}")
+        meta_path = self.profiles_dir / f"{profile_id}.json"
+        if not meta_path.exists():
+            raise FileNotFoundError(f"剖析不存在: {profile_id}")
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return self.profiles_dir / json.load(f)["file"]
+
+
+_profiler: Optional[Profiler] = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> Profiler:
+    """获取进程内共享的剖析器"""
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = Profiler()
+        return _profiler
@@ -0,0 +1,36 @@
+"""
+服务器推送事件（SSE）模块
+把 (事件, 数据) 异步序列转换为 text/event-stream 响应
+"""
+
+import json
+from typing import Any, AsyncIterator, Dict, Tuple
+
+from fastapi.responses import StreamingResponse
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """单个事件编码为 SSE 文本（数据为一行 JSON）"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _encode(events: AsyncIterator[Tuple[str, Dict[str, Any]]]) -> AsyncIterator[str]:
+    try:
+        async for event, data in events:
+            yield format_sse(event, data)
+    except Exception as e:
+        # 响应头已经发出，错误只能作为事件通知客户端
+        yield format_sse("error", {"message": str(e)})
+
+
+def sse_response(events: AsyncIterator[Tuple[str, Dict[str, Any]]]) -> StreamingResponse:
+    """
+    创建 SSE 流式响应
+
+    关闭缓存和反向代理（nginx）缓冲，保证每个事件产生后立即送达客户端。
+    """
+    return StreamingResponse(
+        _encode(events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
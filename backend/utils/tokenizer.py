@@ -0,0 +1,34 @@
+"""
+分词计数工具模块
+基于tiktoken，按模型缓存编码器，整个进程内每种编码只加载一次
+"""
+
+from functools import lru_cache
+from typing import List, Optional
+
+import tiktoken
+
+
+# 未知模型使用的默认编码
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: Optional[str] = None) -> tiktoken.Encoding:
+    """获取模型对应的编码器（缓存）"""
+    if not model:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """统计文本的token数"""
+    return len(get_encoding(model).encode_ordinary(text))
+
+
+def count_tokens_batch(texts: List[str], model: Optional[str] = None) -> List[int]:
+    """批量统计token数（tiktoken在内部并行编码）"""
+    return [len(tokens) for tokens in get_encoding(model).encode_ordinary_batch(texts)]
@@ -0,0 +1,155 @@
+"""
+向量文件存储模块
+向量以连续的 float32/float16 行存放在 data/vectors 下，通过 np.memmap 只读映射，
+多个 uvicorn worker 共享同一份操作系统页缓存，打开文件几乎不耗时
+"""
+
+import os
+import json
+import threading
+from pathlib import Path
+from typing import List, Dict, Optional
+
+import numpy as np
+
+
+SUPPORTED_DTYPES = ("float32", "float16")
+
+# 每个进程最多同时保持映射的向量文件数
+_MAX_OPEN_FILES = 16
+
+
+class VectorWriter:
+    """
+    向量文件写入器
+
+    文件布局（以 prefix 为前缀）：
+    - {prefix}.vec   连续的向量行，第 i 行的字节偏移为 i * dim * itemsize
+    - {prefix}.ids   每行一个ID，行号即向量行号
+    - {prefix}.json  头信息：维度、数据类型、行数
+
+    写入过程中使用 .part 临时文件，close() 时才原子替换，读者不会看到写了一半的文件。
+    """
+
+    def __init__(self, prefix: Path, dim: int, dtype: str = "float32"):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"不支持的向量数据类型: {dtype}")
+
+        self.prefix = Path(prefix)
+        self.prefix.parent.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.dtype = dtype
+        self.count = 0
+
+        self._vec_file = open(self._part(".vec"), 'wb')
+        self._ids_file = open(self._part(".ids"), 'w', encoding='utf-8')
+
+    def _part(self, suffix: str) -> Path:
+        return self.prefix.with_name(self.prefix.name + suffix + ".part")
+
+    def append(self, ids: List[str], vectors: np.ndarray):
+        """追加一批向量"""
+        if vectors.shape != (len(ids), self.dim):
+            raise ValueError(f"向量形状 {vectors.shape} 与ID数量/维度不匹配")
+        self._vec_file.write(np.ascontiguousarray(vectors, dtype=self.dtype).tobytes())
+        self._ids_file.write("".join(f"{i}\n" for i in ids))
+        self.count += len(ids)
+
+    def close(self) -> Dict:
+        """写入头信息并发布文件，返回头信息"""
+        self._vec_file.close()
+        self._ids_file.close()
+
+        header = {
+            "dim": self.dim,
+            "dtype": self.dtype,
+            "count": self.count,
+            "normalized": True
+        }
+        with open(self._part(".json"), 'w', encoding='utf-8') as f:
+            json.dump(header, f)
+
+        # 头信息最后替换，读者以头信息为准
+        for suffix in (".vec", ".ids", ".json"):
+            os.replace(self._part(suffix), self.prefix.with_name(self.prefix.name + suffix))
+        return header
+
+    def abort(self):
+        """放弃写入，删除临时文件"""
+        self._vec_file.close()
+        self._ids_file.close()
+        for suffix in (".vec", ".ids", ".json"):
+            self._part(suffix).unlink(missing_ok=True)
+
+
+class VectorFile:
+    """只读的内存映射向量文件"""
+
+    def __init__(self, prefix: Path):
+        self.prefix = Path(prefix)
+        with open(self._path(".json"), 'r', encoding='utf-8') as f:
+            header = json.load(f)
+
+        self.dim = header["dim"]
+        self.dtype = header["dtype"]
+        self.count = header["count"]
+        self.vectors = np.memmap(
+            self._path(".vec"), dtype=self.dtype, mode="r", shape=(self.count, self.dim)
+        ) if self.count else np.empty((0, self.dim), dtype=self.dtype)
+
+        self._ids: Optional[List[str]] = None
+        self._rows: Optional[Dict[str, int]] = None
+
+    def _path(self, suffix: str) -> Path:
+        return self.prefix.with_name(self.prefix.name + suffix)
+
+    @property
+    def nbytes(self) -> int:
+        return self.count * self.dim * np.dtype(self.dtype).itemsize
+
+    @property
+    def ids(self) -> List[str]:
+        """行号 -> ID（首次访问时读取）"""
+        if self._ids is None:
+            with open(self._path(".ids"), 'r', encoding='utf-8') as f:
+                self._ids = f.read().splitlines()
+        return self._ids
+
+    def row_of(self, vector_id: str) -> Optional[int]:
+        """ID -> 行号"""
+        if self._rows is None:
+            self._rows = {vector_id: row for row, vector_id in enumerate(self.ids)}
+        return self._rows.get(vector_id)
+
+    def get_rows(self, rows) -> np.ndarray:
+        """读取指定行并转换为 float32"""
+        return np.asarray(self.vectors[np.asarray(rows)], dtype=np.float32)
+
+    def iter_batches(self, batch_size: int = 65536):
+        """按行顺序分批读取（float32），用于建索引等全量扫描"""
+        for start in range(0, self.count, batch_size):
+            yield start, np.asarray(self.vectors[start:start + batch_size], dtype=np.float32)
+
+
+_open_files: Dict[str, tuple] = {}
+_open_lock = threading.Lock()
+
+
+def open_vectors(prefix: Path) -> VectorFile:
+    """打开向量文件（进程内按路径和修改时间缓存映射）"""
+    prefix = Path(prefix)
+    header_path = prefix.with_name(prefix.name + ".json")
+    key = str(prefix.resolve())
+    mtime = header_path.stat().st_mtime_ns
+
+    with _open_lock:
+        cached = _open_files.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        vector_file = VectorFile(prefix)
+        _open_files.pop(key, None)
+        _open_files[key] = (mtime, vector_file)
+        while len(_open_files) > _MAX_OPEN_FILES:
+            _open_files.pop(next(iter(_open_files)))
+        return vector_file
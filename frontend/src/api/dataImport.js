@@ -3,14 +3,19 @@ import api from './index.js'
 // 数据导入相关API
 export const dataImportAPI = {
   // 上传文件
-  uploadFile: (fileType, fileFormat, pdfParser = null) => {
+  uploadFile: (file, fileType, fileFormat, pdfParser = null) => {
     const params = new URLSearchParams()
     params.append('file_type', fileType)
     params.append('file_format', fileFormat)
     if (pdfParser) {
       params.append('pdf_parser', pdfParser)
     }
-    return api.post(`/data-import/upload?${params.toString()}`)
+    const formData = new FormData()
+    formData.append('file', file)
+    return api.post(`/data-import/upload?${params.toString()}`, formData, {
+      headers: { 'Content-Type': 'multipart/form-data' },
+      timeout: 0
+    })
   },
   
   // 获取文件列表